@@ -0,0 +1,296 @@
+import json
+from collections import deque
+from itertools import islice
+
+from client import run_query
+from logging_config import get_logger
+
+logger = get_logger()
+
+DEFAULT_BATCH_SIZE = 25
+DEFAULT_MAX_BATCH_BYTES = 1000000
+
+
+def field_selection(graphql_query, field):
+    """Return the selection set, braces included, that follows `field(...)` in a query."""
+    start = graphql_query.index(f"{field}(")
+    start = graphql_query.index("{", graphql_query.index(")", start))
+
+    depth = 0
+    for end in range(start, len(graphql_query)):
+        if graphql_query[end] == "{":
+            depth += 1
+        elif graphql_query[end] == "}":
+            depth -= 1
+            if depth == 0:
+                return graphql_query[start:end + 1]
+    raise ValueError(f"Unbalanced selection set for '{field}'")
+
+
+def chunked(iterable, size):
+    """
+    Yield lists of up to `size` items from an iterable. If the iterable raises (e.g. a
+    search page fails), the items read so far are yielded before the error is passed on.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = []
+        try:
+            chunk.extend(islice(iterator, size))
+        except Exception:
+            if chunk:
+                yield chunk
+            raise
+        if not chunk:
+            return
+        yield chunk
+
+
+def map_ahead(executor, function, items, ahead):
+    """
+    Like executor.map(), but with at most `ahead` calls submitted and not yet consumed.
+
+    Items are pulled from `items` only as results are taken, so a search that is paged
+    lazily is read as fast as its results are used, and finished results never pile up
+    in memory. Results are yielded in input order. If `items` raises, the results of the
+    calls already submitted are yielded before the error is passed on.
+    """
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= ahead:
+                yield pending.popleft().result()
+    except Exception:
+        while pending:
+            yield pending.popleft().result()
+        raise
+    while pending:
+        yield pending.popleft().result()
+
+
+class BatchedQuery:
+    """
+    Runs many copies of a single-field query such as foods.get in one request.
+
+    Each input gets its own alias and variable (f0: get(input: $i0), f1: get(input: $i1), ...)
+    and the response is split back into one payload per input. The number of inputs per
+    request is capped by batch_size and shrunk further when the observed payload size
+    would push a response over max_batch_bytes.
+
+    With a ResponseCache, each input is looked up on its own before anything is sent and
+    only the misses are fetched. Entries are tagged with the input's `food_id_field` so
+    they can be invalidated when the food changes.
+    """
+
+    def __init__(self, graphql_query, root, field, input_type,
+                 batch_size=DEFAULT_BATCH_SIZE, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES,
+                 cache=None, food_id_field=None):
+        self.root = root
+        self.field = field
+        self.input_type = input_type
+        self.selection = field_selection(graphql_query, field)
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.item_bytes = None
+        self.cache = cache
+        self.food_id_field = food_id_field
+        self._documents = {}
+
+    def variable_definitions(self, count, prefix=""):
+        """Return the variable definitions for `count` inputs."""
+        return [f"${prefix}i{i}: {self.input_type}!" for i in range(count)]
+
+    def fields(self, count, prefix=""):
+        """Return the aliased fields for `count` inputs."""
+        return [f"{prefix}f{i}: {self.field}(input: ${prefix}i{i}){self.selection}" for i in range(count)]
+
+    def document(self, count):
+        """Return the aliased query document for `count` inputs."""
+        if count not in self._documents:
+            variable_definitions = ", ".join(self.variable_definitions(count))
+            fields = "\n".join(self.fields(count))
+            self._documents[count] = f"query({variable_definitions}){{\n{self.root}{{\n{fields}\n}}\n}}"
+        return self._documents[count]
+
+    def next_batch_size(self):
+        """Return how many inputs to send in the next request."""
+        if self.item_bytes is None:
+            return self.batch_size
+        return max(1, min(self.batch_size, int(self.max_batch_bytes // self.item_bytes)))
+
+    def _record_payload_size(self, payload):
+        # Sampling one payload per batch is enough to follow the size trend without
+        # re-encoding every response.
+        size = len(json.dumps(payload, separators=(',', ':')))
+        if self.item_bytes is None:
+            self.item_bytes = size
+        else:
+            self.item_bytes = 0.8 * self.item_bytes + 0.2 * size
+
+    def _run(self, inputs):
+        """Send one request for the inputs and return a payload (or None) for each, or None if it failed."""
+        variables = {f"i{i}": value for i, value in enumerate(inputs)}
+        result = run_query(self.document(len(inputs)), variables)
+        if result is None:
+            return None
+
+        for error in result.get("errors") or []:
+            logger.error(f"{self.root}.{self.field} error at {error.get('path')}: {error.get('message')}")
+
+        return self.payloads(result, len(inputs))
+
+    def payloads(self, result, count, prefix=""):
+        """Split a response into the payload (or None) of each of `count` aliased fields."""
+        data = (result.get("data") or {}).get(self.root) or {}
+        payloads = [data.get(f"{prefix}f{i}") for i in range(count)]
+
+        sample = next((payload for payload in payloads if payload), None)
+        if sample is not None:
+            self._record_payload_size(sample)
+        return payloads
+
+    def cached(self, inputs):
+        """
+        Look the inputs up in the cache.
+
+        Returns:
+            The payloads found (None for misses), the cache keys of the inputs, and the
+            indices of the inputs that still have to be fetched.
+        """
+        payloads = [None] * len(inputs)
+        if self.cache is None:
+            return payloads, None, list(range(len(inputs)))
+
+        # Key each input by the single-food document so hits do not depend on how inputs were batched
+        document = self.document(1)
+        keys = [self.cache.key(document, value) for value in inputs]
+        cached = self.cache.get_many(keys)
+        for i, key in enumerate(keys):
+            if key in cached:
+                payloads[i] = cached[key]
+        return payloads, keys, [i for i, key in enumerate(keys) if key not in cached]
+
+    def store(self, inputs, keys, batch, results):
+        """Cache the payloads fetched for the inputs at the `batch` indices."""
+        if self.cache is not None:
+            self.cache.put_many([
+                (keys[i], payload, inputs[i].get(self.food_id_field) if self.food_id_field else None)
+                for i, payload in zip(batch, results) if payload is not None
+            ])
+
+    def run(self, inputs, failed=None):
+        """
+        Run the query for every input and return the payloads in input order.
+
+        A payload is None both when the API answered the input's field with null (its error
+        is logged) and when the whole request failed after every retry. To tell them apart,
+        pass a `failed` set: the indices of the inputs whose request failed are added to it.
+        """
+        payloads, keys, pending = self.cached(inputs)
+
+        position = 0
+        while position < len(pending):
+            batch = pending[position:position + self.next_batch_size()]
+            results = self._run([inputs[i] for i in batch])
+            if results is None:
+                results = [None] * len(batch)
+                if failed is not None:
+                    failed.update(batch)
+            for i, payload in zip(batch, results):
+                payloads[i] = payload
+            self.store(inputs, keys, batch, results)
+            position += len(batch)
+        return payloads
+
+
+class CombinedQuery:
+    """
+    Runs several batched queries for the same foods in one request per batch.
+
+    GraphQL allows several root fields in one document, so e.g. foods.get and
+    analysis.getAnalysis for a batch of foods can share a request:
+
+        query($p0_i0: GetFoodInput!, $p1_i0: GetAnalysisInput!, ...){
+            foods{ p0_f0: get(input: $p0_i0){...} ... }
+            analysis{ p1_f0: getAnalysis(input: $p1_i0){...} ... }
+        }
+
+    Each part is a BatchedQuery and keeps its own selection, cache and payload size
+    estimate; parts only share the request. A food whose payload for one part is already
+    cached is only sent for the other parts.
+    """
+
+    def __init__(self, parts, batch_size=DEFAULT_BATCH_SIZE, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES):
+        self.parts = parts
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self._documents = {}
+
+    def document(self, counts):
+        """Return the query document with counts[p] aliased inputs for part p."""
+        counts = tuple(counts)
+        if counts not in self._documents:
+            variable_definitions = []
+            fields = {}
+            for p, (part, count) in enumerate(zip(self.parts, counts)):
+                variable_definitions.extend(part.variable_definitions(count, f"p{p}_"))
+                fields.setdefault(part.root, []).extend(part.fields(count, f"p{p}_"))
+            roots = "\n".join(f"{root}{{\n" + "\n".join(lines) + "\n}" for root, lines in fields.items() if lines)
+            self._documents[counts] = f"query({', '.join(variable_definitions)}){{\n{roots}\n}}"
+        return self._documents[counts]
+
+    def next_batch_size(self):
+        """Return how many foods to send in the next request."""
+        item_bytes = sum(part.item_bytes or 0 for part in self.parts)
+        if not item_bytes:
+            return self.batch_size
+        return max(1, min(self.batch_size, int(self.max_batch_bytes // item_bytes)))
+
+    def _run(self, inputs):
+        """Send one request for the inputs of every part and return the payloads of each part, or None if it failed."""
+        variables = {}
+        for p, part_inputs in enumerate(inputs):
+            variables.update({f"p{p}_i{i}": value for i, value in enumerate(part_inputs)})
+        result = run_query(self.document(len(part_inputs) for part_inputs in inputs), variables)
+        if result is None:
+            return None
+
+        for error in result.get("errors") or []:
+            logger.error(f"Combined query error at {error.get('path')}: {error.get('message')}")
+
+        return [part.payloads(result, len(part_inputs), f"p{p}_")
+                for p, (part, part_inputs) in enumerate(zip(self.parts, inputs))]
+
+    def run(self, inputs, failed=None):
+        """
+        Run every part for its inputs.
+
+        Args:
+            inputs: One list of inputs per part, in the order of the parts.
+            failed: Optional set. The indices of the inputs whose request failed after every
+                retry are added to it, for any part (see BatchedQuery.run).
+
+        Returns:
+            One list of payloads per part, each in input order.
+        """
+        lookups = [part.cached(part_inputs) for part, part_inputs in zip(self.parts, inputs)]
+        payloads = [lookup[0] for lookup in lookups]
+
+        position = 0
+        while any(position < len(pending) for _, _, pending in lookups):
+            size = self.next_batch_size()
+            batches = [pending[position:position + size] for _, _, pending in lookups]
+            results = self._run([[part_inputs[i] for i in batch] for part_inputs, batch in zip(inputs, batches)])
+            if results is None:
+                results = [[None] * len(batch) for batch in batches]
+                if failed is not None:
+                    for batch in batches:
+                        failed.update(batch)
+            for part, part_inputs, (_, keys, _), part_payloads, batch, part_results in zip(
+                    self.parts, inputs, lookups, payloads, batches, results):
+                for i, payload in zip(batch, part_results):
+                    part_payloads[i] = payload
+                part.store(part_inputs, keys, batch, part_results)
+            position += size
+        return payloads
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of the playground scripts against the local mock API (mock_server.py).
+
+Each script is run as its own process, in a scratch directory with a config.ini pointing
+at a freshly started mock server with a catalog of the given size. Interactive prompts are
+answered from stdin, and the input files of the import scripts are generated to the same
+size. For every run it reports the requests the script issued, requests per second, wall
+time, server-side p50/p95/p99 latency and the script's peak RSS.
+
+    python benchmark.py --sizes 1000,10000 --output results.json
+    python benchmark.py --sizes 1000 --compare results.json
+
+With --compare, runs whose wall time grew by more than --tolerance against the earlier
+results are reported and the benchmark exits with status 1.
+"""
+
+import argparse
+import configparser
+import csv
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import requests
+
+from constants import NUTRIENTS
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS = ["export_to_csv", "bulk_download", "import_from_csv", "build_upload", "bulk_create_label"]
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_TOLERANCE = 0.2
+SERVER_START_TIMEOUT = 30
+# Seconds between checks of a run that has a timeout
+WAIT_POLL_INTERVAL = 0.01
+
+# Answers to each script's prompts
+STDIN = {
+    "export_to_csv": "\na\ny\n",   # no dates, all stages, proceed
+    "bulk_create_label": "1\n1\n",  # all recipes, US 2016 labels
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def write_import_csv(path, size):
+    """Write an ingredient import CSV with `size` rows."""
+    nutrients = list(NUTRIENTS)[:10]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Name", "Supplier", "Alias", "Status", "Weight", "Unit", "Authority",
+                         "Contains Allergens", "May Contain Allergens"] + nutrients)
+        for i in range(size):
+            writer.writerow([f"Benchmark Ingredient {i}", f"Supplier {i % 20}", f"Alias {i}",
+                             "Approved" if i % 2 else "Draft", 100, "Gram", "US", "Milk", ""]
+                            + [round((i * 7 + n) % 97 + 0.5, 1) for n in range(len(nutrients))])
+
+
+def write_input_json(path, size):
+    """Write a build_upload input file with `size` foods."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([{"name": f"Benchmark Food {i}"} for i in range(size)], f)
+
+
+def prepare(workdir, endpoint, size):
+    """Write config.ini and the input files of the import scripts into workdir."""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(SCRIPT_DIR, "config.ini"))
+    config.set("api", "endpoint", endpoint)
+    config.set("api", "api_key", "benchmark")
+    config.set("cache", "enabled", "false")
+    config.set("options", "incremental", "false")
+    with open(os.path.join(workdir, "config.ini"), "w") as f:
+        config.write(f)
+
+    write_import_csv(os.path.join(workdir, config.get("files", "input_csv")), size)
+    write_input_json(os.path.join(workdir, config.get("files", "input_file")), size)
+
+
+def start_server(size, latency, jitter):
+    """Start mock_server.py in its own process and return (process, endpoint)."""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(SCRIPT_DIR, "mock_server.py"), "--port", str(port), "--foods", str(size),
+         "--latency", str(latency), "--jitter", str(jitter)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    stats_url = f"http://127.0.0.1:{port}/stats"
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while True:
+        try:
+            requests.get(stats_url, timeout=1)
+            return process, f"http://127.0.0.1:{port}/graphql"
+        except requests.ConnectionError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError("The mock server did not start")
+            time.sleep(0.1)
+
+
+def run_script(script, workdir, timeout):
+    """
+    Run a script to completion and return (exit code, wall seconds, peak RSS in MB or None).
+
+    A run still going after `timeout` seconds is killed; its exit code is then the negative
+    signal number, as with subprocess.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [SCRIPT_DIR, os.environ.get("PYTHONPATH")])))
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(SCRIPT_DIR, f"{script}.py")], cwd=workdir, env=env,
+                               stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    process.stdin.write(STDIN.get(script, "").encode())
+    process.stdin.close()
+
+    peak_rss = None
+    if hasattr(os, "wait4"):
+        # wait4() also returns the run's own resource usage. With a timeout it is polled, so the
+        # run can be killed at the deadline.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            pid, status, usage = os.wait4(process.pid, 0 if deadline is None else os.WNOHANG)
+            if pid:
+                break
+            if time.monotonic() > deadline:
+                process.kill()
+                _, status, usage = os.wait4(process.pid, 0)
+                break
+            time.sleep(WAIT_POLL_INTERVAL)
+        # Same as os.waitstatus_to_exitcode(), which needs Python 3.9
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak_rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    else:
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    wall_time = time.perf_counter() - started
+    return process.returncode, wall_time, peak_rss
+
+
+def benchmark(script, size, latency=0.0, jitter=0.0, timeout=None):
+    """Run one script against a mock catalog of `size` foods and return its measurements."""
+    workdir = tempfile.mkdtemp(prefix=f"genesis_bench_{script}_")
+    server, endpoint = start_server(size, latency, jitter)
+    try:
+        prepare(workdir, endpoint, size)
+        exit_code, wall_time, peak_rss = run_script(script, workdir, timeout)
+        stats = requests.get(endpoint.replace("/graphql", "/stats"), timeout=10).json()
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "script": script,
+        "foods": size,
+        "exit_code": exit_code,
+        "requests": stats["requests"],
+        "throttled": stats["throttled"],
+        "errors": stats["errors"],
+        "wall_time_s": round(wall_time, 3),
+        "requests_per_second": round(stats["requests"] / wall_time, 2) if wall_time else None,
+        "latency_ms": stats["latency_ms"],
+        "peak_rss_mb": round(peak_rss, 1) if peak_rss is not None else None,
+        "fields": stats["fields"]
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous, tolerance):
+    """Return a message for each run whose wall time regressed by more than `tolerance` against `previous`."""
+    earlier = {(r["script"], r["foods"]): r for r in previous.get("results", [])}
+    regressions = []
+    for result in results:
+        before = earlier.get((result["script"], result["foods"]))
+        if not before or not before.get("wall_time_s"):
+            continue
+        change = result["wall_time_s"] / before["wall_time_s"] - 1
+        if change > tolerance:
+            regressions.append(f"{result['script']} at {result['foods']} foods: {before['wall_time_s']}s -> "
+                               f"{result['wall_time_s']}s ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the playground scripts against the local mock API.")
+    parser.add_argument("--scripts", default=",".join(SCRIPTS), help="Comma separated scripts to run")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Comma separated catalog sizes")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the mock server adds to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra random seconds per request")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds to wait for each run")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file")
+    parser.add_argument("--compare", default=None, help="Earlier results to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed wall time growth against --compare, e.g. 0.2 for 20%%")
+    args = parser.parse_args(argv)
+
+    scripts = [s.strip() for s in args.scripts.split(",") if s.strip()]
+    unknown = [s for s in scripts if s not in SCRIPTS]
+    if unknown:
+        parser.error(f"Unknown scripts: {', '.join(unknown)}")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    results = []
+    for size in sizes:
+        for script in scripts:
+            result = benchmark(script, size, args.latency, args.jitter, args.timeout)
+            results.append(result)
+            latency = result["latency_ms"]
+            print(f"{script:18} {size:>7} foods  exit {result['exit_code']}  {result['requests']:>7} requests  "
+                  f"{result['requests_per_second']:>9} req/s  {result['wall_time_s']:>8}s  "
+                  f"p50 {latency['p50']} p95 {latency['p95']} p99 {latency['p99']} ms  "
+                  f"peak RSS {result['peak_rss_mb']} MB", flush=True)
+
+    report = {
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            return 1
+    return 1 if any(r["exit_code"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,12 @@
-import requests
-import configparser
 import json
 import os
 import uuid
-from logging_config import setup_logging
+from logging_config import setup_logging, get_logger
+import profiling
+from client import run_query
+from settings import get_config
 
-# Set up logging
-logger = setup_logging()
-
-# Read the configuration file
-config = configparser.ConfigParser()
-config.read('config.ini')
-
-# Retrieve the API settings
-endpoint = config.get('api', 'endpoint')
-api_key = config.get('api', 'api_key')
-
-# Define the headers with API Key
-headers = {
-    "X-API-KEY": api_key,
-    "Content-Type": "application/json"
-}
+logger = get_logger()
 
 # Define the GraphQL mutation for creating an ingredient
 mutation = """
@@ -78,13 +64,7 @@ def run_mutation(food, food_type):
         }
     }
 
-    response = requests.post(endpoint, json={"query": mutation, "variables": input_data}, headers=headers)
-
-    if response.status_code == 200:
-        return response.json()
-    else:
-        logger.error(f"Error: {response.status_code} - {response.text}")
-        return None
+    return run_query(mutation, input_data)
 
 
 def bulk_import(food_type, file_path):
@@ -105,8 +85,11 @@ def bulk_import(food_type, file_path):
 
 
 def main():
+    setup_logging()
+    profiling.start()
+
     # Load the input file path from config
-    input_file_path = config.get('files', 'input_file')
+    input_file_path = get_config().get('files', 'input_file')
 
     # Ensure the file exists
     if not os.path.exists(input_file_path):
@@ -1,44 +1,16 @@
-import configparser
-import os
+import argparse
 from datetime import datetime
-import requests
-from logging_config import setup_logging
+from logging_config import setup_logging, get_logger
+import profiling
+from client import run_query
+from pagination import paginate_search
+from settings import get_config
+from sharding import parse_shard
 
-# Set up logging
-logger = setup_logging()
-
-# Read the configuration file
-config = configparser.ConfigParser()
-config.read('config.ini')
-
-# Retrieve the API settings
-endpoint = config.get('api', 'endpoint')
-api_key = config.get('api', 'api_key')
-
-# Retrieve the output file path from the configuration
-output_file = config.get('files', 'output_file')
-output_csv = config.get('files', 'output_csv')
-
-# Retrieve options
-food_type = config.get('options', 'food_type')
-output_limit = int(config.get('options', 'limit', fallback=10000))
-
-# Ensure the file is written to the local directory
-file_path = os.path.join(os.getcwd(), output_file)
+logger = get_logger()
 
 SKIP_FOOD_IDS = []
 
-# Delete the file if it already exists
-if os.path.exists(file_path):
-    os.remove(file_path)
-    logger.info(f"Existing file '{file_path}' has been deleted.")
-
-# Define the headers
-headers = {
-    "X-API-KEY": api_key,
-    "Content-Type": "application/json"
-}
-
 search_query = """
     query ($input: FoodSearchInput!){
         foods {
@@ -200,22 +172,25 @@ add_recipe_to_mx2020_label_mutation = """
     }
 """
 
-def run_query(graphql_query, variables):
-    """Run a GraphQL query against the Genesis API with variables."""
-    response = requests.post(
-        endpoint,
-        json={'query': graphql_query, 'variables': variables},
-        headers=headers
-    )
-    if response.status_code == 200:
-        return response.json()
-    else:
-        logger.error(f"Request failed with status code {response.status_code}")
-        logger.error(response.text)
-        logger.error(f"Endpoint: {endpoint}")
-        logger.error(f"Query: {graphql_query} \r\n Variables: {variables}")
-        return None
-    
+LABEL_CHOICES = {
+    'us2016': ['US2016'],
+    'ca2016': ['CA2016'],
+    'eu2011': ['EU2011'],
+    'mx2020': ['MX2020'],
+    'all': ['US2016', 'CA2016', 'EU2011', 'MX2020']
+}
+
+def shard_foods(foods, shard):
+    """Keep only the foods that belong to the shard, if one was given."""
+    if shard is None:
+        return foods
+    logger.info(f"Processing the foods of shard {shard}.")
+    return shard.filter(foods, key=lambda food: food.get("id"))
+
+def search_options():
+    """Return the page size and result limit for searches from config.ini."""
+    config = get_config()
+    return int(config.get('options', 'page_size', fallback=500)), int(config.get('options', 'limit', fallback=0))
 
 def search(graphql_query, food_type):
     variables = {
@@ -224,17 +199,14 @@ def search(graphql_query, food_type):
             "foodTypes": [food_type],
             "itemSourceFilter": "Customer",
             "archiveFilter": "Unarchived",
-            "versionFilter": "Latest",
-            "first": output_limit,
-            "after": 0
+            "versionFilter": "Latest"
         }
     }
 
     logger.info(f"Running query...")
-    result = run_query(graphql_query, variables)
+    result = paginate_search(graphql_query, variables, *search_options())
     if result:
-        total_count = result.get("data", {}).get("foods", {}).get("search", {}).get("totalCount", 0)
-        logger.info(f"Found {total_count} results.")
+        logger.info(f"Found {result.total_count} results.")
 
     return result
 
@@ -246,16 +218,13 @@ def search_by_tags(graphql_query, food_type, tags):
             "itemSourceFilter": "Customer",
             "archiveFilter": "Unarchived",
             "versionFilter": "Latest",
-            "tagsFilter": tags,
-            "first": output_limit,
-            "after": 0
+            "tagsFilter": tags
         }
     }
     logger.info(f"Running query...")
-    result = run_query(graphql_query, variables)
+    result = paginate_search(graphql_query, variables, *search_options())
     if result:
-        total_count = result.get("data", {}).get("foods", {}).get("search", {}).get("totalCount", 0)
-        logger.info(f"Found {total_count} results with tags {tags}")
+        logger.info(f"Found {result.total_count} results with tags {tags}")
 
     return result
 
@@ -368,7 +337,8 @@ def add_single_recipe_to_label(graphql_query, food_id, label_id):
         logger.error(f"Failed to add recipe to EU 2011 label for {food_id}")
         return None
     
-def bulk_create_for_all_recipes():    
+def bulk_create_for_all_recipes(labels=None, shard=None):
+    food_type = get_config().get('options', 'food_type')
 
     search_result = search(search_query, food_type)  # Food type from config
     if search_result is None:
@@ -376,42 +346,34 @@ def bulk_create_for_all_recipes():
         exit(0)
 
     # Get the total count of search results
-    total_count = search_result.get("data", {}).get("foods", {}).get("search", {}).get("totalCount", 0)
+    total_count = search_result.total_count
     logger.info(f"Found {total_count} {food_type} items to process.")
     
     # Ask user about label types after search results are known
-    print(f"\nFound {total_count} {food_type} items.")
-    print("Available label types:")
-    print("1. US 2016")
-    print("2. CA 2016") 
-    print("3. EU 2011")
-    print("4. MX 2020")
-    print("5. All label types")
+    if labels is None:
+        print(f"\nFound {total_count} {food_type} items.")
+        print("Available label types:")
+        print("1. US 2016")
+        print("2. CA 2016") 
+        print("3. EU 2011")
+        print("4. MX 2020")
+        print("5. All label types")
     
-    while True:
-        choice = input("\nEnter your choice (1-5): ").strip()
-        if choice in ['1', '2', '3', '4', '5']:
-            break
-        print("Invalid choice. Please enter 1, 2, 3, 4, or 5.")
+        while True:
+            choice = input("\nEnter your choice (1-5): ").strip()
+            if choice in ['1', '2', '3', '4', '5']:
+                break
+            print("Invalid choice. Please enter 1, 2, 3, 4, or 5.")
+        labels = ['us2016', 'ca2016', 'eu2011', 'mx2020', 'all'][int(choice) - 1]
     
     # Define which label types to create based on user choice
-    label_types_to_create = []
-    if choice == '1':
-        label_types_to_create = ['US2016']
-    elif choice == '2':
-        label_types_to_create = ['CA2016']
-    elif choice == '3':
-        label_types_to_create = ['EU2011']
-    elif choice == '4':
-        label_types_to_create = ['MX2020']
-    elif choice == '5':
-        label_types_to_create = ['US2016', 'CA2016', 'EU2011', 'MX2020']
+    label_types_to_create = LABEL_CHOICES[labels]
     
     logger.info(f"Selected label types: {', '.join(label_types_to_create)}")
 
     try:
         # Create labels and add recipes to them
-        for food in search_result.get("data", {}).get("foods", {}).get("search", {}).get("foodSearchResults", []):
+        for food in shard_foods(search_result, shard):
             food_name = food.get("name", "")
             food_id = food.get("id", "")
 
@@ -446,12 +408,13 @@ def bulk_create_for_all_recipes():
 
 # This is pretty rudimentary and brute-forcey, but it works for now. 
 # Ideally its changed to allow the user to map a tag to a regulation since their tags may not align with these options.
-def bulk_create_for_all_recipes_by_tag():
+def bulk_create_for_all_recipes_by_tag(tags=None, yes=False, shard=None):
     # We need to ask the user for a list of tags they want to include in their search, 
     # we then can look up the Id of those tags via the api so we can include it in our search results
-    print("What tags do you want to include in your search?")
-    print("Enter a comma separated list of tags. Default: US, Canada, Mexico")
-    tags = input("Enter the tags [Use default, press enter]: ").strip()
+    if tags is None:
+        print("What tags do you want to include in your search?")
+        print("Enter a comma separated list of tags. Default: US, Canada, Mexico")
+        tags = input("Enter the tags [Use default, press enter]: ").strip()
     if not tags:
         tags = "US, Canada, Mexico"
 
@@ -467,6 +430,7 @@ def bulk_create_for_all_recipes_by_tag():
     for tag in matching_tags:
         print(f"{tag.get('name')}")
 
+    food_type = get_config().get('options', 'food_type')
     search_results = []
     for tag in matching_tags:
         tag_id = tag.get('id')
@@ -477,7 +441,7 @@ def bulk_create_for_all_recipes_by_tag():
             logger.warning(f"No results found for tag {tag_name}. Skipping.")
             continue
 
-        total_count = result.get("data", {}).get("foods", {}).get("search", {}).get("totalCount", 0)
+        total_count = result.total_count
         logger.info(f"Found {total_count} {food_type} items with tag {tag_name}")
 
         search_results.append({
@@ -493,16 +457,17 @@ def bulk_create_for_all_recipes_by_tag():
 
     logger.info(f"Found results for {len(search_results)} tags")
 
-    print("Continue with bulk create? (y/n)")
-    continue_with_bulk_create = input("Enter your choice (y/n): ").strip()
-    if continue_with_bulk_create != 'y':
-        logger.info(f"Exiting.")
-        exit(0)
+    if not yes:
+        print("Continue with bulk create? (y/n)")
+        continue_with_bulk_create = input("Enter your choice (y/n): ").strip()
+        if continue_with_bulk_create != 'y':
+            logger.info(f"Exiting.")
+            exit(0)
 
     try:
         for search_result in search_results:
             tag = search_result.get("tag_name")
-            for food in search_result.get("result", {}).get("data", {}).get("foods", {}).get("search", {}).get("foodSearchResults", []):
+            for food in shard_foods(search_result.get("result", []), shard):
                 food_name = food.get("name", "")
                 food_id = food.get("id", "")
 
@@ -534,25 +499,53 @@ def bulk_create_for_all_recipes_by_tag():
         logger.error(f"Error: {e}")
         exit(1)
 
-if __name__ == "__main__":
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Create nutrition labels for recipes in bulk. Without --mode, the options are prompted for.")
+    parser.add_argument("--mode", choices=["all", "tags"],
+                        help="Create labels for all recipes, or for the recipes with the given tags")
+    parser.add_argument("--labels", choices=sorted(LABEL_CHOICES), type=str.lower,
+                        help="Label types to create; required with --mode all")
+    parser.add_argument("--tags", help="Comma separated tags for --mode tags. Default: US, Canada, Mexico")
+    parser.add_argument("--yes", action="store_true", help="Don't ask for confirmation before creating labels")
+    parser.add_argument("--shard", type=parse_shard, metavar="I/N",
+                        help="Process only shard I of N of the recipes")
+    args = parser.parse_args(argv)
+    # --mode runs without prompts, so everything that mode needs has to be given
+    if args.mode == "all" and args.labels is None:
+        parser.error("--mode all requires --labels")
+    if args.mode == "tags" and args.labels is not None:
+        parser.error("--labels only applies to --mode all; --mode tags picks each recipe's label type from its tag")
+    if args.mode == "all" and args.tags is not None:
+        parser.error("--tags only applies to --mode tags")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging()
+    profiling.start()
     logger.info(f"Starting bulk create label process...")
-    
-    print("Available Bulk Create Options:")
-    print("1. Bulk create for all recipes")
-    print("2. Bulk create for selected recipes by tag")
 
-    while True:
-        choice = input("\nEnter your choice (1-2): ").strip()
-        if choice in ['1', '2']:
-            break
-        print("Invalid choice. Please enter 1 or 2.")
+    choice = {"all": '1', "tags": '2'}.get(args.mode)
+    if choice is None:
+        print("Available Bulk Create Options:")
+        print("1. Bulk create for all recipes")
+        print("2. Bulk create for selected recipes by tag")
+
+        while True:
+            choice = input("\nEnter your choice (1-2): ").strip()
+            if choice in ['1', '2']:
+                break
+            print("Invalid choice. Please enter 1 or 2.")
 
     if choice == '1':
-        bulk_create_for_all_recipes()
+        bulk_create_for_all_recipes(args.labels, args.shard)
     elif choice == '2':
-        bulk_create_for_all_recipes_by_tag()
+        tags = args.tags if args.tags is not None else ("" if args.mode else None)
+        bulk_create_for_all_recipes_by_tag(tags, args.yes, args.shard)
     
-    logger.info(f"Bulk create label process completed.")    
+    logger.info(f"Bulk create label process completed.")
 
-    
-    
+
+if __name__ == "__main__":
+    main()
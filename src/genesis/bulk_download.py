@@ -1,37 +1,11 @@
-import requests
-import configparser
-import json
-import csv
 import os
-from logging_config import setup_logging
+from logging_config import setup_logging, get_logger
+import profiling
+from pagination import paginate_search, windowed_search, IncompleteSearchError
+from settings import get_config
+from writers import ArchiveWriter, CsvRowSink
 
-# Set up logging
-logger = setup_logging()
-
-# Read the configuration file
-config = configparser.ConfigParser()
-config.read('config.ini')
-
-# Retrieve the API settings
-endpoint = config.get('api', 'endpoint')
-api_key = config.get('api', 'api_key')
-
-# Retrieve the output file path from the configuration
-output_file = config.get('files', 'output_file')
-
-# Ensure the file is written to the local directory
-file_path = os.path.join(os.getcwd(), output_file)
-
-# Delete the file if it already exists
-if os.path.exists(file_path):
-    os.remove(file_path)
-    logger.info(f"Existing file '{file_path}' has been deleted.")
-
-# Define the headers
-headers = {
-    "X-API-KEY": api_key,
-    "Content-Type": "application/json"
-}
+logger = get_logger()
 
 # Define the GraphQL query
 query = """
@@ -62,83 +36,73 @@ query($input: FoodSearchInput!){
 }
 """
 
+# CSV columns; these must match the foodSearchResults selection of the query above
+fieldnames = ["id", "name", "modified", "created", "versionName", "eshaCode", "foodType",
+              "product", "supplier", "versionHistoryId"]
 
-def run_query(graphql_query, variables):
-    """Run a GraphQL query against the Genesis API with variables."""
-    response = requests.post(
-        endpoint,
-        json={'query': graphql_query, 'variables': variables},
-        headers=headers
-    )
-    if response.status_code == 200:
-        return response.json()
-    else:
-        logger.error(f"Request failed with status code {response.status_code}")
-        logger.error(response.text)
-        return None
 
+def output_paths():
+    """Return the archive and CSV paths from config.ini, in the current directory."""
+    config = get_config()
+    file_path = os.path.join(os.getcwd(), config.get('files', 'output_file'))
+    csv_path = os.path.splitext(file_path)[0] + '.csv'
+    if config.getboolean('options', 'compress_archive', fallback=False):
+        file_path += ".gz"
+    return file_path, csv_path
 
-def export(graphql_query, food_type):
-    first_entry = True
-    """Iterate through each character in the corpus and update the searchText."""
-    with open(file_path, "a") as file:
 
-        file.write("[\n")  # Write the opening bracket for the JSON array
+def export(graphql_query, food_type):
+    """Search for every food of a type and write each result to the NDJSON archive and the CSV."""
+    file_path, csv_path = output_paths()
+    config = get_config()
+    page_size = int(config.get('options', 'page_size', fallback=500))
+    window_size = int(config.get('options', 'search_window_size', fallback=0))
+    compress_archive = file_path.endswith(".gz")
+    with ArchiveWriter(file_path, compress_archive) as archive, CsvRowSink(csv_path, fieldnames) as sink:
 
         variables = {
             "input": {
                 "searchText": '',
                 "foodTypes": [food_type],
                 "itemSourceFilter": "Customer",
-                "versionFilter": "All",
-                "first": 10000,
-                "after": 0
+                "versionFilter": "All"
             }
         }
 
         logger.info(f"Running query...")
-        result = run_query(graphql_query, variables)
+        if window_size:
+            result = windowed_search(graphql_query, variables, page_size, target=window_size,
+                                     workers=int(config.get('options', 'concurrency', fallback=8)))
+        else:
+            result = paginate_search(graphql_query, variables, page_size)
         if result:
-            total_count = result.get("data", {}).get("foods", {}).get("search", {}).get("totalCount", 0)
-            logger.info(f"Found {total_count} results")
-            if total_count > 0:
-                if not first_entry:
-                    file.write(",\n")  # Add a comma before each entry - except the first
-                json.dump(result, file, indent=4)  # Append the JSON response to the file
-                first_entry = False
-            else:
+            logger.info(f"Found {result.total_count} results")
+            # Write each result as its page arrives instead of holding the whole search in memory
+            for food in result:
+                archive.write(food)
+                sink.write(food)
+            if archive.count == 0:
                 logger.info(f"No results found. Skipping write.")
 
-        file.write("\n]")  # Write the closing bracket for the JSON array
-
-
-def json_to_csv(json_file, csv_file):
-    """Convert a JSON file to CSV format."""
-
-    # Delete the file if it already exists
-    if os.path.exists(csv_file):
-        os.remove(csv_file)
-        logger.info(f"Existing file '{csv_file}' has been deleted.")
-
-    # Extract the nested "foodSearchResults" list from the JSON structure
-    with open(json_file) as f:
-        json_file = json.load(f)
 
-    food_results = json_file[0]["data"]["foods"]["search"]["foodSearchResults"]
+def main():
+    setup_logging()
+    profiling.start()
 
-    # Write JSON data to CSV
-    with open(csv_file, mode='w', newline='') as file:
-        # Use the keys of the first item as the header
-        fieldnames = food_results[0].keys()
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
+    # Each run starts a new archive
+    file_path, csv_path = output_paths()
+    if os.path.exists(file_path):
+        os.remove(file_path)
+        logger.info(f"Existing file '{file_path}' has been deleted.")
 
-        # Write header and rows
-        writer.writeheader()
-        writer.writerows(food_results)
+    try:
+        export(query, 'Ingredient')  # Ingredient or Recipe
+    except IncompleteSearchError as e:
+        logger.error(f"{e}. {file_path} and {csv_path} are incomplete.")
+        exit(1)
+    logger.info(f"Complete. Exported results to {file_path} and {csv_path}")
 
 
 # Run the playground script
 if __name__ == "__main__":
-    export(query, 'Ingredient')  # Ingredient or Recipe
-    json_to_csv(file_path, file_path.replace('.json', '.csv'))
-    logger.info(f"Complete. Exported results to {file_path}")
+    main()
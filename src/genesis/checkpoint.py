@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+from batching import chunked
+from logging_config import get_logger
+from models import as_dict
+
+logger = get_logger()
+
+# Number of search results looked up in the journal per query
+LOOKUP_SIZE = 500
+
+
+class Checkpoint:
+    """
+    A journal of the foods an export has finished, so a failed run can resume.
+
+    Each stage (ingredients, recipes, recipe_items) records every food it completes: the
+    record written to the archive and the rows written to the CSV, tagged with the food's
+    `modified` value. A restarted run replays the journaled output for foods that have not
+    changed since and only enriches the rest. Foods whose requests failed after every retry
+    are exported with blank details but not journaled, so the next run fetches them again.
+    The journal is kept in a SQLite file next to the output and is deleted once the whole
+    run succeeds.
+
+    The journal is tied to the CSV columns through `schema`; if the columns change (e.g. a
+    different nutrients_to_include) the old journal is discarded.
+    """
+
+    def __init__(self, path, schema=""):
+        self.path = path
+        self.schema = hashlib.sha256(schema.encode("utf-8")).hexdigest()
+        self.resumed = 0
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS foods (
+                    stage TEXT NOT NULL,
+                    food_id TEXT NOT NULL,
+                    modified TEXT,
+                    record TEXT NOT NULL,
+                    rows TEXT,
+                    PRIMARY KEY (stage, food_id)
+                )
+            """)
+            stored = connection.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+            if stored is None or stored[0] != self.schema:
+                if stored is not None:
+                    logger.info(f"CSV columns changed since checkpoint {self.path} was written, starting over")
+                connection.execute("DELETE FROM foods")
+                connection.execute("INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (self.schema,))
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def resume(self, stage, items, on_done):
+        """
+        Yield the search results (models.SearchResult) a stage still has to process.
+
+        Items the journal already has, with the same `modified` value, are not yielded;
+        on_done(record, rows) is called with their journaled output instead. That happens as
+        soon as the lookup reaches them, so a resumed run writes journaled foods ahead of the
+        pending foods around them that are still being enriched: rows are not in search order.
+        """
+        for chunk in chunked(items, LOOKUP_SIZE):
+            ids = [str(item.id) for item in chunk]
+            with self._lock:
+                placeholders = ",".join("?" * len(ids))
+                journaled = {
+                    food_id: (modified, record, rows) for food_id, modified, record, rows in self._connect().execute(
+                        f"SELECT food_id, modified, record, rows FROM foods WHERE stage = ? AND food_id IN ({placeholders})",
+                        (stage, *ids)
+                    )
+                }
+
+            for food_id, item in zip(ids, chunk):
+                entry = journaled.get(food_id)
+                if entry is None or entry[0] != item.modified:
+                    yield item
+                    continue
+                record = json.loads(entry[1])
+                rows = json.loads(entry[2]) if entry[2] is not None else [record]
+                self.resumed += 1
+                on_done(record, rows)
+
+    def record(self, stage, completed):
+        """
+        Journal the foods a stage has completed.
+
+        Args:
+            stage: The stage name.
+            completed: (record, rows) pairs, where record is the food's archive record and
+                rows its CSV rows, or None if the only row is the record itself. Records and
+                rows can be dicts or records from models.py.
+        """
+        entries = []
+        for record, rows in completed:
+            record = as_dict(record)
+            if rows is not None:
+                rows = json.dumps([as_dict(row) for row in rows], separators=(',', ':'))
+            entries.append((stage, str(record.get("id")), record.get("modified"),
+                            json.dumps(record, separators=(',', ':')), rows))
+        if not entries:
+            return
+        with self._lock:
+            connection = self._connect()
+            connection.executemany("INSERT OR REPLACE INTO foods VALUES (?, ?, ?, ?, ?)", entries)
+            connection.commit()
+
+    def clear(self):
+        """Delete the journal after a successful run."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(self.path + suffix):
+                    os.remove(self.path + suffix)
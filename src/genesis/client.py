@@ -0,0 +1,250 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from logging_config import get_logger
+from metrics import get_metrics, operation_name
+from persisted_queries import extensions, persisted_query_error, NOT_SUPPORTED
+from profiling import span
+from rate_limiter import TokenBucket
+from settings import get_config
+
+logger = get_logger()
+
+# Defaults used when config.ini does not override them
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 120
+DEFAULT_RATE_LIMIT = 0
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 30
+
+# Throttling: the request was rejected without being processed, so it is always safe to resend
+THROTTLED_STATUS_CODES = {429}
+# Gateway and availability errors: the request may or may not have been processed
+TRANSIENT_STATUS_CODES = {502, 503, 504}
+
+_session = None
+_rate_limiter = None
+_settings = None
+_persisted_queries_supported = True
+_lock = threading.Lock()
+
+
+def _load_settings():
+    """Read the API settings from config.ini."""
+    config = get_config()
+
+    return {
+        "endpoint": config.get('api', 'endpoint'),
+        "api_key": config.get('api', 'api_key'),
+        "pool_size": config.getint('api', 'pool_size', fallback=DEFAULT_POOL_SIZE),
+        "timeout": (
+            config.getfloat('api', 'connect_timeout', fallback=DEFAULT_CONNECT_TIMEOUT),
+            config.getfloat('api', 'read_timeout', fallback=DEFAULT_READ_TIMEOUT)
+        ),
+        "rate_limit": config.getfloat('api', 'rate_limit', fallback=DEFAULT_RATE_LIMIT),
+        "rate_burst": config.getint('api', 'rate_burst', fallback=0),
+        "max_retries": config.getint('api', 'max_retries', fallback=DEFAULT_MAX_RETRIES),
+        "backoff_base": config.getfloat('api', 'backoff_base', fallback=DEFAULT_BACKOFF_BASE),
+        "backoff_max": config.getfloat('api', 'backoff_max', fallback=DEFAULT_BACKOFF_MAX),
+        "persisted_queries": config.getboolean('api', 'persisted_queries', fallback=False)
+    }
+
+
+def get_settings():
+    """Return the API settings, reading config.ini on first use."""
+    global _settings
+    if _settings is None:
+        with _lock:
+            if _settings is None:
+                _settings = _load_settings()
+    return _settings
+
+
+def get_session():
+    """
+    Return the shared requests.Session, creating it on first use.
+
+    The session keeps connections to the endpoint alive between calls, so only the
+    first request on each pooled connection pays for the TCP and TLS handshakes.
+    """
+    global _session
+    if _session is None:
+        settings = get_settings()
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings["pool_size"])
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({
+                    "X-API-KEY": settings["api_key"],
+                    "Content-Type": "application/json"
+                })
+                _session = session
+    return _session
+
+
+def get_rate_limiter():
+    """Return the token bucket shared by all requests, creating it on first use."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        settings = get_settings()
+        with _lock:
+            if _rate_limiter is None:
+                _rate_limiter = TokenBucket(settings["rate_limit"], settings["rate_burst"])
+    return _rate_limiter
+
+
+def close():
+    """Close the shared session and release its pooled connections."""
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def is_mutation(graphql_query):
+    """Return True if the GraphQL document is a mutation."""
+    return graphql_query.lstrip().startswith("mutation")
+
+
+def retry_after(response):
+    """Return the delay in seconds asked for by a Retry-After header, or None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt):
+    """Return a jittered exponential backoff delay for a retry attempt (0 based)."""
+    settings = get_settings()
+    return random.uniform(0, min(settings["backoff_max"], settings["backoff_base"] * 2 ** attempt))
+
+
+def run_query(graphql_query, variables, idempotent=None):
+    """
+    Run a GraphQL query or mutation against the Genesis API with variables.
+
+    Requests wait for the shared rate limiter and are retried with jittered exponential
+    backoff when the API throttles us (429) or a gateway error or timeout occurs. A
+    Retry-After header from the server is honored and pauses every caller. Every attempt
+    is counted and timed in metrics.py. With persisted_queries on, the document is sent
+    by its hash and only sent in full when the server does not have it yet (see
+    persisted_queries.py).
+
+    Args:
+        graphql_query: The GraphQL document.
+        variables: The variables for the document.
+        idempotent: Whether the request can safely be sent more than once. Defaults to True
+            for queries and False for mutations. Non-idempotent requests are only retried
+            when the server cannot have processed them (429 or a connect timeout), so a
+            create mutation is never submitted twice.
+
+    Returns:
+        The decoded JSON response, or None if the request failed.
+    """
+    settings = get_settings()
+    endpoint = settings["endpoint"]
+    if idempotent is None:
+        idempotent = not is_mutation(graphql_query)
+
+    global _persisted_queries_supported
+    persisted = settings["persisted_queries"] and _persisted_queries_supported
+    send_document = not persisted
+
+    max_retries = settings["max_retries"]
+    metrics = get_metrics()
+    attempt = 0
+    while True:
+        payload = {'variables': variables}
+        if send_document:
+            payload['query'] = graphql_query
+        if persisted:
+            payload['extensions'] = extensions(graphql_query)
+
+        get_rate_limiter().acquire()
+        started = time.perf_counter()
+        try:
+            with span("run_query", operation=operation_name(graphql_query), attempt=attempt):
+                response = get_session().post(
+                    endpoint,
+                    json=payload,
+                    timeout=settings["timeout"]
+                )
+        except requests.RequestException as e:
+            metrics.observe(graphql_query, "error", time.perf_counter() - started)
+            # A connect timeout means the request never reached the server
+            retryable = idempotent or isinstance(e, requests.ConnectTimeout)
+            if retryable and isinstance(e, (requests.ConnectionError, requests.Timeout)) and attempt < max_retries:
+                delay = backoff_delay(attempt)
+                attempt += 1
+                logger.warning(f"Request failed: {e}. Retrying in {delay:.1f}s (attempt {attempt} of {max_retries})")
+                time.sleep(delay)
+                continue
+            logger.error(f"Request failed: {e}")
+            logger.error(f"Endpoint: {endpoint}")
+            return None
+
+        metrics.observe(graphql_query, response.status_code, time.perf_counter() - started,
+                        len(response.request.body or b""), len(response.content))
+        result = None
+        if response.status_code == 200:
+            with span("decode json", bytes=len(response.content)):
+                result = response.json()
+        elif not send_document and response.status_code == 400:
+            try:
+                result = response.json()
+            except ValueError:
+                pass
+
+        if not send_document:
+            # The server did not run a request it could not find by hash, so even a mutation
+            # is safe to send again, this time with the document
+            error = persisted_query_error(result)
+            if error == NOT_SUPPORTED:
+                logger.warning("The API does not support persisted queries; sending full documents.")
+                _persisted_queries_supported = False
+                persisted = False
+            if error:
+                send_document = True
+                continue
+
+        if response.status_code == 200:
+            return result
+
+        retryable = response.status_code in THROTTLED_STATUS_CODES or (
+            idempotent and response.status_code in TRANSIENT_STATUS_CODES)
+        if retryable and attempt < max_retries:
+            delay = retry_after(response)
+            if delay is not None:
+                # The server told us when to come back; hold every caller until then
+                get_rate_limiter().pause(delay)
+            else:
+                delay = backoff_delay(attempt)
+            attempt += 1
+            logger.warning(f"Request failed with status code {response.status_code}. "
+                           f"Retrying in {delay:.1f}s (attempt {attempt} of {max_retries})")
+            time.sleep(delay)
+            continue
+
+        logger.error(f"Request failed with status code {response.status_code}")
+        logger.error(response.text)
+        logger.error(f"Endpoint: {endpoint}")
+        logger.error(f"Query: {graphql_query} \r\n Variables: {variables}")
+        return None
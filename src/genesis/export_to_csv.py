@@ -1,46 +1,31 @@
-import requests
-import configparser
+import argparse
+import asyncio
 import json
-import csv
 import os
-from constants import UNITS
-from datetime import datetime
-from logging_config import setup_logging
-
-# Set up logging
-logger = setup_logging()
-
-# Read the configuration file
-config = configparser.ConfigParser()
-config.read('config.ini')
-
-# Retrieve the API settings
-endpoint = config.get('api', 'endpoint')
-api_key = config.get('api', 'api_key')
-
-# Retrieve the output file path from the configuration
-output_file = config.get('files', 'output_file')
-recipe_csv = config.get('files', 'recipe_analysis_csv')
-ingredient_csv = config.get('files', 'ingredients_csv')
-recipe_items_csv = config.get('files', 'recipe_items_csv')
-
-# Retrieve options
-food_type = config.get('options', 'food_type')
-output_limit = int(config.get('options', 'limit', fallback=10000))
-
-# Ensure the file is written to the local directory
-file_path = os.path.join(os.getcwd(), output_file)
-
-# Delete the file if it already exists
-if os.path.exists(file_path):
-    os.remove(file_path)
-    logger.info(f"Existing file '{file_path}' has been deleted.")
-
-# Define the headers
-headers = {
-    "X-API-KEY": api_key,
-    "Content-Type": "application/json"
-}
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from constants import UNITS, NUTRIENTS
+from datetime import datetime, timezone
+from logging_config import setup_logging, get_logger
+import profiling
+from profiling import traced
+from pagination import paginate_search, windowed_search, SearchResults, IncompleteSearchError
+from batching import BatchedQuery, CombinedQuery, chunked, map_ahead
+from response_cache import ResponseCache
+from memo import MemoCache
+from checkpoint import Checkpoint
+from models import SearchResult, FoodDetails, NutrientInfo, NutrientProjection, Row
+from writers import ArchiveWriter, CsvRowSink, MultiSink
+from matrix import MatrixRebuildSink, NutrientMatrixSink, merge_matrices
+from incremental import load_watermark, save_watermark, HighWaterMark, CsvMergeSink, to_datetime
+from selection import food_document
+from settings import get_config
+from sharding import parse_shard, shard_path, merge_csv as merge_csv_shards, merge_files
+
+logger = get_logger()
+
+_context = None
+_context_lock = threading.Lock()
 
 # Define a set of nutrients to include in the analysis
 # nutrients_to_include = ["Saturated Fat", 
@@ -75,6 +60,24 @@ nutrients_to_include = ["Added Sugar",
                         "Vitamin D",
                         "Calories from Fat"]
 
+# CSV columns, known up front so rows can be written as soon as they are enriched.
+# search_fields must match the foodSearchResults selection of the search query below.
+search_fields = ["id", "name", "modified"]
+ingredient_fields = search_fields + ["usercode", "cost", "amount", "subIngredients"] + nutrients_to_include
+recipe_fields = search_fields + ["cookMethod", "cookTime", "cookTemperature", "instructions", "panSize",
+                                 "preparationTime", "ingredientStatement", "allergenStatement",
+                                 "voluntaryStatement", "notes", "usercode"] + nutrients_to_include + ["cost", "amount"]
+recipe_item_fields = ["recipe_id", "item_usercode", "item_id", "item_name", "item_amount_measure", "item_amount_quantity"]
+
+# Row types for the CSVs; each row keeps its values in a list in column order
+IngredientRow = Row.schema("IngredientRow", ingredient_fields)
+RecipeRow = Row.schema("RecipeRow", recipe_fields)
+RecipeItemRow = Row.schema("RecipeItemRow", recipe_item_fields)
+
+# Where each nutrient of nutrients_to_include goes in the rows, by nutrient id
+ingredient_nutrients = NutrientProjection(IngredientRow, nutrients_to_include, NUTRIENTS)
+recipe_nutrients = NutrientProjection(RecipeRow, nutrients_to_include, NUTRIENTS)
+
 # Define the GraphQL query
 query = """
 query($input: FoodSearchInput!){
@@ -83,6 +86,7 @@ query($input: FoodSearchInput!){
             foodSearchResults{
                 id
                 name
+                modified
             }
             totalCount
             pageInfo{
@@ -96,101 +100,6 @@ query($input: FoodSearchInput!){
 }
 """
 
-food_query = """
-query($input: GetFoodInput!){
-    foods{
-        get(input: $input){
-            food{
-                amountCost { 
-                    amount {
-                        quantity {
-                            value
-                        }
-                        unit {
-                            name
-                        }
-                    }
-                    cost
-                }
-                conversions{
-                    to {
-                        quantity {
-                            value
-                        }
-                        unit {
-                            name
-                        }
-                    }
-                    from {
-                        quantity {
-                            value
-                        }
-                        unit {
-                            name
-                        }
-                    }
-                }
-                customFields {
-                    value
-                    customField{
-                        name
-                    }
-                }
-                notes {
-                    text
-                }     
-                created
-                modified  
-                ... on Recipe{
-                    id
-                    name
-                    cookMethod
-                    cookTime
-                    cookTemperature
-                    instructions
-                    panSize
-                    preparationTime
-                    items {
-                        food {
-                            id
-                            name
-                        }
-                        amount {
-                            quantity {
-                                value
-                            }
-                            unit {
-                                name
-                            }
-                        }
-                    }
-                    unitedStates2016AllergenStatement {
-                        englishStatements {
-                            statement
-                            voluntaryStatement
-                        }
-                    }
-                    unitedStates2016IngredientStatement {
-                        englishStatement {
-                            customStatement
-                            generatedStatement
-                        }
-                    }                    
-                }
-                ... on Ingredient{
-                    id
-                    name
-                    subIngredients {
-                        name
-                        percentage
-                    }                            
-                }
-            }
-        }
-    }
-}
-"""
-
 analysis_query = """
 query($input : GetAnalysisInput!){
     analysis{
@@ -242,98 +151,22 @@ query($input: GetLabelsForFoodInput!){
 }
 """
 
-def run_query(graphql_query, variables):
-    """Run a GraphQL query against the Genesis API with variables."""
-    response = requests.post(
-        endpoint,
-        json={'query': graphql_query, 'variables': variables},
-        headers=headers
-    )
-    if response.status_code == 200:
-        return response.json()
-    else:
-        logger.error(f"Request failed with status code {response.status_code}")
-        logger.error(response.text)
-        logger.error(f"Endpoint: {endpoint}")
-        logger.error(f"Query: {graphql_query} \r\n Variables: {variables}")
-        return None
-
-
-def get_analysis_at_100g(graphql_query, food_id):
-    nutrients = {}
-
-    variables = {
-        "input": {
-            "foodId": food_id,
-            "analysisInput": {
-                "analysisType": "Net",
-                "amount": {
-                    "quantity": "100",
-                    "unitId": UNITS["Gram"]
-                }
-            }
-        }
-    }
-
-    result = run_query(graphql_query, variables)
-    if result:
-        nutrients = result.get("data", {}).get("analysis", {}).get("getAnalysis", {}).get("analysis", {}).get("nutrientInfos", [])
-        if len(nutrients) == 0:
-            logger.warning(f"Unable to get nutrient information for {food_id}")
-
-    return nutrients
-
-# Get Net analysis at 1 serving. 
-def get_analysis_at_1serving(graphql_query, food_id):
-    nutrients = {}
-
-    variables = {
-        "input": {
-            "foodId": food_id,
-            "analysisInput": {
-                "analysisType": "Net",
-                "amount": {
-                    "quantity": "1",
-                    "unitId": UNITS["Serving"]
-                }
-            }
-        }
-    }
-
-    result = run_query(graphql_query, variables)
-    if result:
-        nutrients = result.get("data", {}).get("analysis", {}).get("getAnalysis", {}).get("analysis", {}).get("nutrientInfos", [])
-        if len(nutrients) == 0:
-            logger.warning(f"Unable to get nutrient information for {food_id}")
-
-    return nutrients
-
-# Get LabelRounded analysis at 1 serving. 
-def get_analysis_labelrounded(graphql_query, food_id, label_id):
-    nutrients = {}
-
-    variables = {
-        "input": {
-            "foodId": food_id,
-            "analysisInput": {
-                "analysisType": "LabelRounded",
-                "amount": {
-                    "quantity": "1",
-                    "unitId": UNITS["Serving"]
-                },
-                "labelId": label_id
+def analysis_input(food_id, analysis_type, quantity, unit, label_id=None):
+    """Build the GetAnalysisInput for an analysis of a food at an amount."""
+    input_data = {
+        "foodId": food_id,
+        "analysisInput": {
+            "analysisType": analysis_type,
+            "amount": {
+                "quantity": quantity,
+                "unitId": UNITS[unit]
             }
         }
     }
+    if label_id:
+        input_data["analysisInput"]["labelId"] = label_id
 
-    result = run_query(graphql_query, variables)
-    if result:
-        nutrients = result.get("data", {}).get("analysis", {}).get("getAnalysis", {}).get("analysis", {}).get("nutrientInfos", [])
-        if len(nutrients) == 0:
-            logger.warning(f"Unable to get nutrient information for {food_id}")
-
-    return nutrients
-
+    return input_data
 
 def search(graphql_query, food_type):
     variables = {
@@ -342,19 +175,12 @@ def search(graphql_query, food_type):
             "foodTypes": [food_type],
             "itemSourceFilter": "Customer",
             "archiveFilter": "Unarchived",
-            "versionFilter": "Latest",
-            "first": output_limit,
-            "after": 0
+            "versionFilter": "Latest"
         }
     }
 
     logger.info(f"Running query...")
-    result = run_query(graphql_query, variables)
-    if result:
-        total_count = result.get("data", {}).get("foods", {}).get("search", {}).get("totalCount", 0)
-        logger.info(f"Found {total_count} results.")
-
-    return result
+    return decode_search(run_search(graphql_query, variables))
 
 def search_by_modified_date(graphql_query, food_type, modified_after, modified_before):
     variables = {
@@ -365,379 +191,781 @@ def search_by_modified_date(graphql_query, food_type, modified_after, modified_b
             "archiveFilter": "Unarchived",
             "versionFilter": "Latest",
             "modifiedAfter": modified_after.strftime("%Y-%m-%dT%H:%M:%SZ"),
-            "modifiedBefore": modified_before.strftime("%Y-%m-%dT%H:%M:%SZ"),
-            "first": output_limit,
-            "after": 0
+            "modifiedBefore": modified_before.strftime("%Y-%m-%dT%H:%M:%SZ")
         }
     }
 
     logger.info(f"Running query...")
-    result = run_query(graphql_query, variables)
-    if result:
-        total_count = result.get("data", {}).get("foods", {}).get("search", {}).get("totalCount", 0)
-        logger.info(f"Found {total_count} results.")
-
-    return result
-
-def get_recipe_items(recipe_id):
-    variables = {
-        "input": {
-            "id": recipe_id
-        }
-    }
-    
-    logger.info(f"Running query to get recipe items for {recipe_id} ...")
-    result = run_query(food_query, variables)
-    if result:
-        return result.get("data", {}).get("foods", {}).get("get", {}).get("food", {}).get("items", [])
-    else:
-        return []
-    
-def get_food_details(food_id):
-    variables = {
-        "input": {
-            "id": food_id
-        }
-    }
-    
-    logger.info(f"Running query to get item details for {food_id} ...")
-    result = run_query(food_query, variables)
-    if result:
-        return result.get("data", {}).get("foods", {}).get("get", {}).get("food", {})
-    else:
-        logger.error(f"Failed to get details for {food_id}")
-        return {}
-
-def get_label_id(graphql_query, food_id):
-    variables = {
-        "input": {
-            "foodId": food_id
-        }
-    }
-
-    logger.info(f"Running query to get label id for {food_id} ...")
-    result = run_query(graphql_query, variables)
-    if result:
-        # This assumes you only have one label for each food. If you have multiple labels, you will 
-        # need to modify this. This also is regulation agnostic, it will return the first label id it finds regardless of regulation.
-        labels = result.get("data", {}).get("labels", {}).get("getLabelsForFood", {}).get("labels", [])
-        logger.info(f"Found {len(labels)} labels for {food_id}")
-        return labels[0].get("id", "") if labels else ""
-    else:
-        logger.warning(f"No labels found for {food_id}")
-        logger.error(f"Failed to get label id for {food_id}")
-        return ""
-
-def export_to_json(result):
-    first_entry = True
-
-    """Iterate through each character and update the searchText."""
-    with open(file_path, "a") as file:
-
-        file.write("[\n")  # Write the opening bracket for the JSON array
-        if not first_entry:
-            file.write(",\n")  # Add a comma before each entry - except first
-
-        json.dump(result, file, indent=4)  # Append the JSON to the file
-        first_entry = False
+    return decode_search(run_search(graphql_query, variables))
+
+def run_search(graphql_query, variables):
+    """Page through a search, in parallel date windows if search_window_size is set."""
+    context = get_context()
+    if context.search_window_size:
+        return windowed_search(graphql_query, variables, context.page_size, context.output_limit,
+                               context.search_window_size, context.concurrency)
+    return paginate_search(graphql_query, variables, context.page_size, context.output_limit)
+
+def decode_search(result):
+    """Decode the foodSearchResults of a search into SearchResult records as they arrive."""
+    if result is None:
+        return None
+    logger.info(f"Found {result.total_count} results.")
+    results = map(SearchResult.from_json, result)
+    shard = get_context().shard
+    if shard:
+        logger.info(f"Exporting the results of shard {shard}.")
+        results = shard.filter(results)
+    return SearchResults(result.total_count, results)
+
+class ExportContext:
+    """
+    The export settings from config.ini, and the caches, journal and batched queries they configure.
 
-        file.write("\n]")  # Write the closing bracket for the JSON array
+    It is created by get_context() when an export first needs it, so importing this module
+    reads no configuration and opens no files. With a sharding.Shard, only the shard's foods
+    are exported and every output, checkpoint and watermark file gets the shard's suffix.
+    """
 
+    def __init__(self, config, shard=None):
+        self.shard = shard
+        output = shard.path if shard else (lambda path: path)
+
+        # Output files, written to the current directory
+        self.compress_archive = config.getboolean('options', 'compress_archive', fallback=False)
+        self.file_path = output(os.path.join(os.getcwd(), config.get('files', 'output_file')))
+        if self.compress_archive:
+            self.file_path += ".gz"
+        self.recipe_csv = output(config.get('files', 'recipe_analysis_csv'))
+        self.ingredient_csv = output(config.get('files', 'ingredients_csv'))
+        self.recipe_items_csv = output(config.get('files', 'recipe_items_csv'))
+        self.watermark_file = output(config.get('files', 'watermark_file', fallback='export_watermark.json'))
+
+        self.output_limit = int(config.get('options', 'limit', fallback=0))
+        self.page_size = int(config.get('options', 'page_size', fallback=500))
+        # If set, searches are split into modified date windows of at most this many results,
+        # searched `concurrency` at a time (see pagination.windowed_search)
+        self.search_window_size = int(config.get('options', 'search_window_size', fallback=0))
+        # Also write the nutrient values as a foods x nutrients .npy matrix next to the analysis CSVs
+        self.nutrient_matrix = config.getboolean('options', 'nutrient_matrix', fallback=False)
+        # Export only foods modified since the last successful run and merge them into the existing CSVs
+        self.incremental = config.getboolean('options', 'incremental', fallback=False)
+        # Number of batches of foods enriched in parallel. Each has one request in flight at a time,
+        # so keep [api] pool_size at or above this value.
+        self.concurrency = int(config.get('options', 'concurrency', fallback=8))
+        # Maximum foods per batched request, and the response size batches are shrunk to stay under
+        self.batch_size = int(config.get('options', 'batch_size', fallback=25))
+        self.batch_max_bytes = int(config.get('options', 'batch_max_bytes', fallback=1000000))
+
+        # Optional on-disk cache for food details, analyses and labels between runs
+        self.response_cache = None
+        if config.getboolean('cache', 'enabled', fallback=False):
+            self.response_cache = ResponseCache(
+                config.get('cache', 'path', fallback='genesis_cache.sqlite'),
+                int(config.get('cache', 'ttl', fallback=86400)),
+                int(config.get('cache', 'max_bytes', fallback=500000000))
+            )
+
+        # Food details fetched during this run, so the recipe and recipe item stages fetch each food
+        # only once. Up to memo_max_items are kept in memory and the rest spill to a temporary file.
+        self.food_memo = MemoCache(int(config.get('options', 'memo_max_items', fallback=10000)), self.response_cache)
+
+        # Journal of finished foods, so a failed run can be restarted without redoing them
+        self.checkpoint = Checkpoint(
+            output(os.path.join(os.getcwd(), config.get('files', 'checkpoint_file', fallback='export_checkpoint.sqlite'))),
+            json.dumps([ingredient_fields, recipe_fields, recipe_item_fields]))
+        # Foods whose requests still failed after every retry. They are exported with blank details but
+        # left out of the journal, and the run exits non-zero so they are fetched again on the next run.
+        self.failed = 0
+
+        # Batched forms of analysis_query and label_query. Each request carries up to batch_size
+        # aliased copies of the query, one per food (see batching.py).
+        self.batched_analysis_query = BatchedQuery(analysis_query, "analysis", "getAnalysis", "GetAnalysisInput",
+                                                   self.batch_size, self.batch_max_bytes, self.response_cache, "foodId")
+        self.batched_label_query = BatchedQuery(label_query, "labels", "getLabelsForFood", "GetLabelsForFoodInput",
+                                                self.batch_size, self.batch_max_bytes, self.response_cache, "foodId")
+        self.select_stages("a")
+
+    def select_stages(self, stages):
+        """
+        Build the foods.get queries for the stages that will run (i, r, ri or a).
+
+        Each food type gets the smallest foods.get selection for the columns it is exported
+        to (see selection.py). The recipe and recipe item stages share one recipe query, so
+        with both running each recipe's details are still fetched only once.
+        """
+        self.ingredient_food_query = BatchedQuery(food_document(ingredient_fields, "Ingredient"), "foods", "get",
+                                                  "GetFoodInput", self.batch_size, self.batch_max_bytes,
+                                                  self.food_memo, "id")
+        self.recipe_food_query = BatchedQuery(food_document(recipe_columns(stages), "Recipe"), "foods", "get",
+                                               "GetFoodInput", self.batch_size, self.batch_max_bytes,
+                                               self.food_memo, "id")
+
+        # Documents that fetch several of the above for the same foods in a single request:
+        # analysis and details for ingredients, details and labels for recipes. The recipe analysis
+        # needs the label id, so it stays a separate request.
+        self.ingredient_data_query = CombinedQuery([self.batched_analysis_query, self.ingredient_food_query],
+                                                   self.batch_size, self.batch_max_bytes)
+        self.recipe_data_query = CombinedQuery([self.recipe_food_query, self.batched_label_query],
+                                               self.batch_size, self.batch_max_bytes)
+
+def recipe_columns(stages):
+    """Return the recipe columns the stages that will run (r, ri or a) fill from foods.get."""
+    columns = []
+    if stages in ('r', 'a'):
+        columns += recipe_fields
+    if stages in ('ri', 'a'):
+        columns += recipe_item_fields
+    return columns
+
+def persisted_documents():
+    """
+    Return the documents an export sends, for persisted_queries.registry().
 
-def json_to_csv(food_results, csv_file):
-    """ Convert a JSON array to CSV format.
-        Expectation that this will be the foodSearchResult element of the array
+    Every request is a batched or combined query, so this builds them the way select_stages()
+    does for each choice of stages, with every batch size from 1 to the configured batch_size:
+    full batches, the shorter last batch and batches shrunk to fit batch_max_bytes. Combined
+    batches where the cache already had one part for some foods are persisted when first sent.
     """
+    context = ExportContext(get_config())
+    documents = []
+    for stages in ('i', 'r', 'ri', 'a'):
+        context.select_stages(stages)
+        for count in range(1, context.batch_size + 1):
+            if stages in ('i', 'a'):
+                documents.append(context.ingredient_data_query.document((count, count)))
+            if stages in ('r', 'a'):
+                documents.append(context.recipe_data_query.document((count, count)))
+                documents.append(context.batched_analysis_query.document(count))
+            if stages in ('ri', 'a'):
+                documents.append(context.recipe_food_query.document(count))
+    return documents
+
+def get_context():
+    """Return the ExportContext, creating it from config.ini on first use."""
+    global _context
+    if _context is None:
+        with _context_lock:
+            if _context is None:
+                _context = ExportContext(get_config())
+    return _context
+
+def configure(shard=None):
+    """Create the ExportContext for a run, optionally for one shard of the foods, and return it."""
+    global _context
+    with _context_lock:
+        _context = ExportContext(get_config(), shard)
+    return _context
+
+def invalidate_modified(items):
+    """Drop cached responses for search results modified since they were cached."""
+    response_cache = get_context().response_cache
+    if response_cache is None:
+        return
+    for item in items:
+        if item.modified:
+            response_cache.invalidate_food(item.id, item.modified)
+
+def food_inputs(food_ids):
+    return [{"id": food_id} for food_id in food_ids]
+
+def label_inputs(food_ids):
+    return [{"foodId": food_id} for food_id in food_ids]
+
+def parse_foods_details(food_ids, payloads):
+    """Decode the food of each foods.get payload; a failed lookup decodes to empty details."""
+    details = []
+    for food_id, payload in zip(food_ids, payloads):
+        if payload is None:
+            logger.error(f"Failed to get details for {food_id}")
+        details.append(FoodDetails.from_json((payload or {}).get("food")))
+    return details
+
+def parse_analyses(analysis_inputs, payloads):
+    """Decode the nutrientInfos of each analysis.getAnalysis payload."""
+    all_nutrients = []
+    for input_data, payload in zip(analysis_inputs, payloads):
+        nutrient_infos = ((payload or {}).get("analysis") or {}).get("nutrientInfos")
+        # Both row types project the same nutrients, so only those are decoded
+        nutrients = NutrientInfo.decode_all(nutrient_infos, ingredient_nutrients.wanted)
+        if not nutrient_infos:
+            logger.warning(f"Unable to get nutrient information for {input_data['foodId']}")
+        all_nutrients.append(nutrients)
+    return all_nutrients
+
+def parse_label_ids(food_ids, payloads):
+    """Return the first label id of each labels.getLabelsForFood payload, or ""."""
+    label_ids = []
+    for food_id, payload in zip(food_ids, payloads):
+        if payload is None:
+            logger.error(f"Failed to get label id for {food_id}")
+        # This assumes one label per food: it takes the first label regardless of regulation
+        labels = (payload or {}).get("labels") or []
+        label_ids.append(labels[0].get("id", "") if labels else "")
+    return label_ids
+
+def add_failed(failed, food_ids, indices):
+    """
+    Add the ids of the foods at `indices`, whose request failed after every retry (see
+    BatchedQuery.run), to the `failed` set if one is given. A field the API answered with
+    an error is not a failure: the food is exported with blank values like any other.
+    """
+    if failed is not None:
+        failed.update(food_ids[i] for i in indices)
+
+@traced("get_foods_details")
+def get_foods_details(food_ids, failed=None):
+    """Fetch the details of several recipes in batched requests. Returns them in input order."""
+    logger.info(f"Running batched query to get item details for {len(food_ids)} foods ...")
+    failed_requests = set()
+    payloads = get_context().recipe_food_query.run(food_inputs(food_ids), failed_requests)
+    add_failed(failed, food_ids, failed_requests)
+    return parse_foods_details(food_ids, payloads)
+
+@traced("get_analyses")
+def get_analyses(analysis_inputs, failed=None):
+    """Run several analyses in batched requests. Returns their nutrientInfos in input order."""
+    failed_requests = set()
+    payloads = get_context().batched_analysis_query.run(analysis_inputs, failed_requests)
+    add_failed(failed, [input_data['foodId'] for input_data in analysis_inputs], failed_requests)
+    return parse_analyses(analysis_inputs, payloads)
+
+@traced("get_ingredient_data")
+def get_ingredient_data(food_ids, failed=None):
+    """Fetch the 100g analyses and details of several ingredients, one request per batch."""
+    logger.info(f"Running combined query to get analyses and item details for {len(food_ids)} foods ...")
+    analysis_inputs = [analysis_input(food_id, "Net", "100", "Gram") for food_id in food_ids]
+    failed_requests = set()
+    analysis_payloads, food_payloads = get_context().ingredient_data_query.run(
+        [analysis_inputs, food_inputs(food_ids)], failed_requests)
+    add_failed(failed, food_ids, failed_requests)
+    return parse_analyses(analysis_inputs, analysis_payloads), parse_foods_details(food_ids, food_payloads)
+
+@traced("get_recipe_data")
+def get_recipe_data(food_ids, failed=None):
+    """Fetch the details and label ids of several recipes, one request per batch."""
+    logger.info(f"Running combined query to get item details and label ids for {len(food_ids)} foods ...")
+    failed_requests = set()
+    food_payloads, label_payloads = get_context().recipe_data_query.run(
+        [food_inputs(food_ids), label_inputs(food_ids)], failed_requests)
+    add_failed(failed, food_ids, failed_requests)
+    return parse_foods_details(food_ids, food_payloads), parse_label_ids(food_ids, label_payloads)
+
+def archive_writer():
+    """Open the NDJSON archive that each stage appends its processed foods to."""
+    context = get_context()
+    return ArchiveWriter(context.file_path, context.compress_archive)
+
+def csv_sink(csv_file, fieldnames, merge=False, key="id", projection=None):
+    """
+    Open the row sink for a CSV file.
 
-    # Delete the file if it already exists
+    Rows are streamed straight to the file, or for incremental runs (merge=True) merged
+    into the existing file by `key` when the sink is closed. With nutrient_matrix on and
+    a NutrientProjection, the projected nutrients are also written to a .npy matrix with
+    the same name as the CSV; after a merge the matrix is rebuilt from the merged CSV.
+    """
+    nutrient_matrix = get_context().nutrient_matrix
+    matrix_path = os.path.splitext(csv_file)[0] + ".npy"
+    if merge:
+        sink = CsvMergeSink(csv_file, fieldnames, key)
+        if nutrient_matrix and projection is not None:
+            return MultiSink(sink, MatrixRebuildSink(csv_file, matrix_path, projection))
+        return sink
     if os.path.exists(csv_file):
-        os.remove(csv_file)
-        logger.info(f"Existing file '{csv_file}' has been deleted.")
-
-    # Different results may have different fields; handle
-    fieldnames = []
-    for r in food_results:
-        for key in r.keys():
-            if key not in fieldnames:
-                fieldnames.append(key)
-
-    # Write JSON data to CSV
-    with open(csv_file, mode='w', newline='', encoding='utf-8') as file:
-        # Use the keys of the first item as the header
-        # fieldnames = food_results[0].keys()
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-
-        # Write header and rows
-        writer.writeheader()
-        writer.writerows(food_results)
-
-def filter_and_assign_nutrients(item, nutrients, desired_nutrients=None):
+        logger.info(f"Existing file '{csv_file}' will be overwritten.")
+    sink = CsvRowSink(csv_file, fieldnames)
+    if nutrient_matrix and projection is not None:
+        return MultiSink(sink, NutrientMatrixSink(matrix_path, projection))
+    return sink
+
+def filter_and_assign_nutrients(item, nutrients, projection):
     """
-    Filter nutrients and assign them to the item dictionary.
+    Filter nutrients and assign them to the item row.
     Args:
-        item: The food item dictionary to update
-        nutrients: List of nutrient dictionaries with name and value
-        desired_nutrients: Optional list of nutrient names to include. If None, include all.
+        item: The export row to update
+        nutrients: List of NutrientInfo
+        projection: The NutrientProjection for the row type, which picks the nutrients and their columns
     """
-    for n in nutrients:
-        nutrient_name = n['nutrient']['name']
-        if desired_nutrients is None or nutrient_name in desired_nutrients:
-            item[nutrient_name] = n['value']
-
-def process_recipe_items(search_result):
-    export_to_json(search_result)
-    
+    projection.apply(item, nutrients)
+
+def search_row(row_type, result):
+    """Start an export row from a SearchResult."""
+    row = row_type()
+    row['id'] = result.id
+    row['name'] = result.name
+    row['modified'] = result.modified
+    return row
+
+def write_journaled(archive, sink, replace=False):
+    """Return a callback that writes a food's journaled output (see Checkpoint.resume) to the archive and CSV."""
+    def write(record, rows):
+        archive.write(record)
+        if replace:
+            sink.replace(record.get("id"))
+        for row in rows:
+            sink.write(row)
+    return write
+
+@traced("process_recipe_items")
+def process_recipe_items(search_result, merge=False):
+    context = get_context()
+    checkpoint = context.checkpoint
     logger.info(f"Processing recipe items...")
-    recipes = search_result.get("data", {}).get("foods", {}).get("search", {}).get("foodSearchResults", [])
-    
-    # Create list to store all recipe items
-    all_recipe_items = []
     
-    # Iterate through each recipe
-    for recipe in recipes:
-        recipe_id = recipe.get("id")
-        
-        # Get recipe items using food_query
-        recipe_data = get_recipe_items(recipe_id)
-        
-        if recipe_data:
-            
-            # Extract item details
-            for item in recipe_data:
-                food = item.get("food", {})
-                amount = item.get("amount", {})
-                customFields = food.get('customFields', [])
-                item_details = {
-                    "recipe_id": recipe_id,
-                    "item_id": food.get("id"),
-                    "item_usercode": next((cf['value'] for cf in customFields if cf.get('customField', {}).get('name') == 'User Code'), ""),
-                    "item_name": food.get("name"),
-                    "item_amount_measure": amount.get("unit", {}).get("name"),
-                    "item_amount_quantity": amount.get("quantity", {}).get("value")
-                }
-                
-                all_recipe_items.append(item_details)
-        else:
-            logger.error(f"Failed to get details for recipe {recipe_id}")
-            
-    # Export to CSV
-    if all_recipe_items:        
-        fieldnames = ["recipe_id", "item_usercode", "item_id", "item_name", "item_amount_measure", "item_amount_quantity"]
-        
-        with open(recipe_items_csv, mode='w', newline='', encoding='utf-8') as file:
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(all_recipe_items)
-            
-        logger.info(f"Recipe items exported to {recipe_items_csv}")
+    # Iterate through the recipes a batch at a time, writing each recipe's items as soon as they arrive
+    with archive_writer() as archive, csv_sink(context.recipe_items_csv, recipe_item_fields, merge, "recipe_id") as sink:
+        pending = checkpoint.resume("recipe_items", search_result, write_journaled(archive, sink, merge))
+        for batch in chunked(pending, context.batch_size):
+            for recipe in batch:
+                archive.write(recipe)
+                if merge:
+                    # Replace every item of the exported recipes, including recipes that no longer have items
+                    sink.replace(recipe.id)
+            invalidate_modified(batch)
+
+            # Get recipe items using batched foods.get requests
+            failed = set()
+            all_details = get_foods_details([recipe.id for recipe in batch], failed)
+            context.failed += len(failed)
+
+            completed = []
+            for recipe, recipe_info in zip(batch, all_details):
+                recipe_id = recipe.id
+                recipe_data = recipe_info.items
+
+                if recipe_data:
+                    rows = []
+
+                    # Extract item details
+                    for item in recipe_data:
+                        item_details = RecipeItemRow([
+                            recipe_id, item.usercode, item.food_id, item.name, item.measure, item.quantity
+                        ])
+
+                        sink.write(item_details)
+                        rows.append(item_details)
+                    completed.append((recipe, rows))
+                else:
+                    logger.error(f"Failed to get details for recipe {recipe_id}")
+            checkpoint.record("recipe_items", completed)
+
+    if sink.count:
+        logger.info(f"{sink.count} recipe items exported to {context.recipe_items_csv}")
     else:
-        logger.info("No recipe items found to export")    
+        logger.info("No recipe items found to export")
+
+def apply_ingredient_details(item, ingredient_info, nutrients):
+    """Add the ingredient details and nutrients to the ingredient row."""
+    item['usercode'] = ingredient_info.usercode
+    # Cost, and the amount value and unit combined into a single column
+    item['cost'] = ingredient_info.cost
+    item['amount'] = ingredient_info.amount
+    # Sub Ingredients
+    item['subIngredients'] = ingredient_info.sub_ingredients
+
+    filter_and_assign_nutrients(item, nutrients, ingredient_nutrients)
 
-def process_ingredients(ingredient_result):
-    export_to_json(ingredient_result)
+@traced("enrich_ingredients")
+def enrich_ingredients(results):
+    """
+    Fetch the 100g analyses and details for a batch of ingredients. Returns their rows and
+    the ids of the ingredients whose requests failed.
+    """
+    invalidate_modified(results)
+    failed = set()
+    all_nutrients, all_details = get_ingredient_data([result.id for result in results], failed)
+
+    items = []
+    for result, ingredient_info, nutrients in zip(results, all_details, all_nutrients):
+        item = search_row(IngredientRow, result)
+        apply_ingredient_details(item, ingredient_info, nutrients)
+        items.append(item)
+    return items, failed
+
+@traced("process_ingredients")
+def process_ingredients(ingredient_result, merge=False):
+    context = get_context()
+    checkpoint = context.checkpoint
     # Process ingredients
-    logger.info(f"Processing ingredients...")
+    logger.info(f"Processing ingredients with {context.concurrency} workers...")
     if ingredient_result:
-        ingredient_items = ingredient_result.get("data", {}).get("foods", {}).get("search", {}).get("foodSearchResults", [])
-        for item in ingredient_items:
-            nutrients = get_analysis_at_100g(analysis_query, item['id'])            
-            ingredient_info = get_food_details(item['id'])
-            amountCost = ingredient_info.get('amountCost', {})
-            conversions = ingredient_info.get('conversions', {})
-            customFields = ingredient_info.get('customFields', [])
-            subIngredients = ingredient_info.get('subIngredients', [])
-            item['usercode'] = next((cf['value'] for cf in customFields if cf.get('customField', {}).get('name') == 'User Code'), "")
-
-            # Extract cost and amount information from amountCost
-            if amountCost:
-                item['cost'] = amountCost.get('cost', '')
-                # Combine amount value and unit into single column
-                amount_value = amountCost.get('amount', {}).get('quantity', {}).get('value', '')
-                amount_unit = amountCost.get('amount', {}).get('unit', {}).get('name', '')
-                item['amount'] = f"{amount_value} {amount_unit}".strip()
-            else:
-                item['cost'] = ''
-                item['amount'] = ''
-
-            # Sub Ingredients
-            item['subIngredients'] = ','.join(subIngredient.get('name', '') for subIngredient in subIngredients)
-
-            filter_and_assign_nutrients(item, nutrients, nutrients_to_include)
-        json_to_csv(ingredient_items, ingredient_csv)
-    logger.info(f"Ingredients exported to {ingredient_csv}")
+        # Enrich up to `concurrency` batches of ingredients at once; map_ahead() yields results in input
+        # order so the CSV rows keep the search order regardless of which request finishes first. A batch
+        # is submitted as its search page arrives, and the oldest batch is written as soon as it is done.
+        with ThreadPoolExecutor(max_workers=context.concurrency) as executor, archive_writer() as archive, \
+                csv_sink(context.ingredient_csv, ingredient_fields, merge, projection=ingredient_nutrients) as sink:
+            # Ingredients finished by an earlier, failed run are written from the checkpoint instead
+            pending = checkpoint.resume("ingredients", ingredient_result, write_journaled(archive, sink))
+            # Archive and write each ingredient as soon as its batch is done
+            for batch, failed in map_ahead(executor, enrich_ingredients, chunked(pending, context.batch_size),
+                                           context.concurrency):
+                for item in batch:
+                    archive.write(item)
+                    sink.write(item)
+                # Ingredients whose requests failed were written with blank details, so are not journaled
+                checkpoint.record("ingredients", [(item, None) for item in batch if item['id'] not in failed])
+                context.failed += len(failed)
+    logger.info(f"Ingredients exported to {context.ingredient_csv}")
+
+def apply_recipe_details(item, recipe_info, nutrients):
+    """Add the recipe details and nutrients to the recipe row."""
+    item['cookMethod'] = recipe_info.cook_method
+    item['cookTime'] = recipe_info.cook_time
+    item['cookTemperature'] = recipe_info.cook_temperature
+    item['instructions'] = recipe_info.instructions
+    item['panSize'] = recipe_info.pan_size
+    item['preparationTime'] = recipe_info.preparation_time
+    item['ingredientStatement'] = recipe_info.ingredient_statement
+    item['allergenStatement'] = recipe_info.allergen_statement
+    item['voluntaryStatement'] = recipe_info.voluntary_statement
+    item['notes'] = recipe_info.notes
+    item['usercode'] = recipe_info.usercode
+    filter_and_assign_nutrients(item, nutrients, recipe_nutrients)
+    # Cost, and the amount value and unit combined into a single column
+    item['cost'] = recipe_info.cost
+    item['amount'] = recipe_info.amount
+
+async def enrich_recipe_batch(items, semaphore, loop, executor):
+    """
+    Fetch the labels, analyses and details for a batch of recipes. Returns their rows and
+    the ids of the recipes whose requests failed.
+    """
+    food_ids = [item.id for item in items]
+    failed = set()
+    async with semaphore:
+        await loop.run_in_executor(executor, invalidate_modified, items)
+        # The details and label lookup share one request. Only the analysis has to wait,
+        # because LabelRounded analysis needs the label id.
+        all_details, label_ids = await loop.run_in_executor(executor, get_recipe_data, food_ids, failed)
+        analysis_inputs = [
+            analysis_input(food_id, "LabelRounded", "1", "Serving", label_id) if label_id
+            else analysis_input(food_id, "Net", "1", "Serving")
+            for food_id, label_id in zip(food_ids, label_ids)
+        ]
+        all_nutrients = await loop.run_in_executor(executor, get_analyses, analysis_inputs, failed)
 
-# Process recipe analysis
-def process_recipes(recipe_result):
-    export_to_json(recipe_result)
+    rows = []
+    for result, recipe_info, nutrients in zip(items, all_details, all_nutrients):
+        row = search_row(RecipeRow, result)
+        apply_recipe_details(row, recipe_info, nutrients)
+        rows.append(row)
+    return rows, failed
 
-    logger.info(f"Processing recipes...")
+async def enrich_recipes(recipe_items, on_enriched):
+    """
+    Enrich all recipes, with at most `concurrency` batches of recipes in flight at once.
+
+    on_enriched(rows, failed) is called with each enriched batch as soon as it and every
+    batch before it are done, so output keeps the search order while enrichment runs ahead.
+    """
+    context = get_context()
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(context.concurrency)
+    # One worker per batch in flight, plus one to pull search results
+    with ThreadPoolExecutor(max_workers=context.concurrency + 1) as executor:
+        # Bounded, so the search is only read as far ahead as the batches being enriched
+        tasks = asyncio.Queue(maxsize=context.concurrency)
+
+        async def schedule():
+            # Pull search results on a worker thread so fetching the next page does not block the
+            # event loop, and recipes from the first page are enriched while later pages load.
+            batches = chunked(recipe_items, context.batch_size)
+            try:
+                while True:
+                    batch = await loop.run_in_executor(executor, next, batches, None)
+                    if batch is None:
+                        return
+                    await tasks.put(asyncio.ensure_future(enrich_recipe_batch(batch, semaphore, loop, executor)))
+            finally:
+                # Also on a failed search, so the loop below finishes and `await scheduler` raises
+                await tasks.put(None)
+
+        scheduler = asyncio.ensure_future(schedule())
+        while True:
+            task = await tasks.get()
+            if task is None:
+                break
+            on_enriched(*await task)
+        await scheduler
+
+# Process recipe analysis
+@traced("process_recipes")
+def process_recipes(recipe_result, merge=False):
+    context = get_context()
+    checkpoint = context.checkpoint
+    logger.info(f"Processing recipes with {context.concurrency} workers...")
     
     # Process recipes
     if recipe_result:
-        recipe_items = recipe_result.get("data", {}).get("foods", {}).get("search", {}).get("foodSearchResults", [])
-        for item in recipe_items:
-            # If you want to get LabelRounded analysis, you must insert code here to call the label_query to get the 
-            # label_id for this food, then call the get_analysis_labelrounded function.
-            # Example:
-            label_id = get_label_id(label_query, item['id'])
-            if label_id:
-                nutrients = get_analysis_labelrounded(analysis_query, item['id'], label_id)
-            else:
-                nutrients = get_analysis_at_1serving(analysis_query, item['id'])
-            
-            recipe_info = get_food_details(item['id'])                
-            amountCost = recipe_info.get('amountCost', {})
-            conversions = recipe_info.get('conversions', {})
-            customFields = recipe_info.get('customFields', [])
-
-            # Cook Method
-            item['cookMethod'] = recipe_info.get('cookMethod', '')
-            # Cook Time
-            item['cookTime'] = recipe_info.get('cookTime', '')
-            # Cook Temperature
-            item['cookTemperature'] = recipe_info.get('cookTemperature', '')
-            # Instructions
-            item['instructions'] = recipe_info.get('instructions', '')
-            # Pan Size
-            item['panSize'] = recipe_info.get('panSize', '')
-            # Preparation Time
-            item['preparationTime'] = recipe_info.get('preparationTime', '')
-            # Ingredient Statement
-            ingredientStatement = recipe_info.get('unitedStates2016IngredientStatement', {}).get('englishStatement', {}).get('generatedStatement', {})
-            item['ingredientStatement'] = ingredientStatement
-            # Allergen Statement
-            allergenStatement = recipe_info.get('unitedStates2016AllergenStatement', {}).get('englishStatements', {}).get('statement', {})
-            voluntaryStatement = recipe_info.get('unitedStates2016AllergenStatement', {}).get('englishStatements', {}).get('voluntaryStatement', {})
-            item['allergenStatement'] = allergenStatement
-            item['voluntaryStatement'] = voluntaryStatement
-            # Notes
-            notes = recipe_info.get('notes', [])
-            item['notes'] = '|'.join(note.get('text', '') for note in notes)
-
-            # User Code
-            item['usercode'] = next((cf['value'] for cf in customFields if cf.get('customField', {}).get('name') == 'User Code'), "")                
-            filter_and_assign_nutrients(item, nutrients, nutrients_to_include)
-
-            # Extract cost and amount information from amountCost
-            if amountCost:
-                item['cost'] = amountCost.get('cost', '')
-                # Combine amount value and unit into single column
-                amount_value = amountCost.get('amount', {}).get('quantity', {}).get('value', '')
-                amount_unit = amountCost.get('amount', {}).get('unit', {}).get('name', '')
-                item['amount'] = f"{amount_value} {amount_unit}".strip()
-            else:
-                item['cost'] = ''
-                item['amount'] = ''
-        
-        json_to_csv(recipe_items, recipe_csv)
-    logger.info(f"Recipes exported to {recipe_csv}")
+        with archive_writer() as archive, csv_sink(context.recipe_csv, recipe_fields, merge, projection=recipe_nutrients) as sink:
+            def write_batch(batch, failed):
+                # Archive and write each recipe as soon as its batch is done
+                for item in batch:
+                    archive.write(item)
+                    sink.write(item)
+                # Recipes whose requests failed were written with blank details, so are not journaled
+                checkpoint.record("recipes", [(item, None) for item in batch if item['id'] not in failed])
+                context.failed += len(failed)
+
+            # Recipes finished by an earlier, failed run are written from the checkpoint instead
+            pending = checkpoint.resume("recipes", recipe_result, write_journaled(archive, sink))
+            asyncio.run(enrich_recipes(pending, write_batch))
+    logger.info(f"Recipes exported to {context.recipe_csv}")
+
+def search_changed(food_type, watermarks, modified_before):
+    """Search for foods modified after the oldest of the watermarks, or all foods if one is missing."""
+    if None in watermarks:
+        logger.info(f"No watermark found for {food_type}, running a full export.")
+        return search(query, food_type)
+
+    modified_after = min(to_datetime(watermark) for watermark in watermarks)
+    logger.info(f"Searching for {food_type} modified after {modified_after.strftime('%Y-%m-%dT%H:%M:%SZ')}...")
+    return search_by_modified_date(query, food_type, modified_after, modified_before)
+
+def run_incremental_export(choice):
+    """
+    Export the foods modified since the last successful run and merge them into the CSVs by id.
 
-# Run the playground script
-if __name__ == "__main__":
+    The latest `modified` value seen by each stage is saved to watermark_file once every
+    stage has finished and every food was fetched, so a failed run is simply repeated from
+    the old watermarks. The API does not return results in `modified` order, so a search
+    that stops short must not move a watermark: it raises IncompleteSearchError before any
+    is saved. A stage without a watermark runs a full export and overwrites its CSV.
+    """
+    context = get_context()
+    watermark_file = context.watermark_file
+    modified_before = datetime.now(timezone.utc)
+    watermarks = {}
+
+    if choice in ['i', 'a']:
+        previous = load_watermark(watermark_file, "ingredients")
+        ingredient_result = search_changed("Ingredient", [previous], modified_before)
+        if ingredient_result is None:
+            logger.error(f"Ingredient search failed. Exiting without updating the watermark.")
+            return False
+        mark = HighWaterMark(previous)
+        process_ingredients(mark.track(ingredient_result), merge=previous is not None)
+        watermarks["ingredients"] = mark.value
+
+    if choice in ['r', 'ri', 'a']:
+        stages = (["recipes"] if choice in ['r', 'a'] else []) + (["recipe_items"] if choice in ['ri', 'a'] else [])
+        previous = {stage: load_watermark(watermark_file, stage) for stage in stages}
+        recipe_result = search_changed("Recipe", list(previous.values()), modified_before)
+        if recipe_result is None:
+            logger.error(f"Recipe search failed. Exiting without updating the watermark.")
+            return False
+        if len(stages) > 1:
+            recipe_result = list(recipe_result)
+        if "recipes" in stages:
+            mark = HighWaterMark(previous["recipes"])
+            process_recipes(mark.track(recipe_result), merge=previous["recipes"] is not None)
+            watermarks["recipes"] = mark.value
+        if "recipe_items" in stages:
+            mark = HighWaterMark(previous["recipe_items"])
+            process_recipe_items(mark.track(recipe_result), merge=previous["recipe_items"] is not None)
+            watermarks["recipe_items"] = mark.value
+
+    if context.failed:
+        logger.error(f"Requests failed for {context.failed} foods. Exiting without updating the watermark; "
+                     f"run the export again to fetch them.")
+        return False
+    for stage, modified in watermarks.items():
+        if modified:
+            save_watermark(watermark_file, stage, modified)
+    context.checkpoint.clear()
+    return True
+
+def merge_shard_outputs(count):
+    """Merge the outputs of `count` finished shards into the unsharded output files."""
+    context = configure()
+    for csv_file, matrix in ((context.ingredient_csv, True), (context.recipe_csv, True),
+                             (context.recipe_items_csv, False)):
+        if not os.path.exists(shard_path(csv_file, 1, count)):
+            continue
+        merge_csv_shards(csv_file, count)
+        npy_file = os.path.splitext(csv_file)[0] + ".npy"
+        if matrix and os.path.exists(shard_path(npy_file, 1, count)):
+            merge_matrices([shard_path(npy_file, index, count) for index in range(1, count + 1)], npy_file)
+    if os.path.exists(shard_path(context.file_path, 1, count)):
+        merge_files(context.file_path, count)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export ingredients, recipe analyses and recipe items to CSV. "
+                    "Without --stages, the options are prompted for.")
+    parser.add_argument("--stages", choices=["i", "r", "ri", "a"], type=str.lower,
+                        help="Export ingredients (i), recipe analysis (r), recipe items (ri) or all (a)")
+    parser.add_argument("--modified-after", help="Only export foods modified after this date, e.g. 2023-12-31 "
+                                                 "or 12/31/2023. Needs --modified-before.")
+    parser.add_argument("--modified-before", help="Only export foods modified before this date")
+    parser.add_argument("--shard", type=parse_shard, metavar="I/N",
+                        help="Export only shard I of N of the foods, to shard-suffixed output files")
+    parser.add_argument("--merge-shards", type=int, metavar="N",
+                        help="Merge the outputs of N finished shards into the configured output files and exit")
+    args = parser.parse_args(argv)
+    if (args.modified_after is None) != (args.modified_before is None):
+        parser.error("--modified-after and --modified-before must be given together")
+    if args.modified_after is not None and get_config().getboolean('options', 'incremental', fallback=False):
+        parser.error("--modified-after and --modified-before cannot be used with incremental = true; "
+                     "incremental runs take their dates from the watermark file")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging()
+    profiling.start()
+    if args.merge_shards:
+        merge_shard_outputs(args.merge_shards)
+        return
     start_time = datetime.now()
 
-    # Get modified date input from user
-    date_input_after = input("Enter modified after date (e.g. 2023-12-31 or 12/31/2023) or press Enter to skip: ")
+    context = configure(args.shard)
+    incremental = context.incremental
+    # Prompt for anything not given on the command line
+    interactive = args.stages is None
+    # Each run starts a new archive
+    if os.path.exists(context.file_path):
+        os.remove(context.file_path)
+        logger.info(f"Existing file '{context.file_path}' has been deleted.")
+
+    # Get modified date input from user; incremental runs take their dates from the watermark file
+    date_input_after = args.modified_after or ""
+    if interactive and not incremental and args.modified_after is None:
+        date_input_after = input("Enter modified after date (e.g. 2023-12-31 or 12/31/2023) or press Enter to skip: ")
     
-    date_input_before = ""
-    if date_input_after.strip():
+    date_input_before = args.modified_before or ""
+    if interactive and date_input_after.strip() and args.modified_before is None:
         date_input_before = input("Enter modified before date(e.g. 2023-12-31 or 12/31/2023) or press Enter to skip: ")
 
     # Ask the user if they want Ingredients, Recipe Analysis, Recipe Items, or All, then proceed accordingly.
-    choice = input("Do you want to export Ingredients, Recipe Analysis, Recipe Items, or All? (i/r/ri/a): ")
+    choice = args.stages or input("Do you want to export Ingredients, Recipe Analysis, Recipe Items, or All? (i/r/ri/a): ")
     if choice.lower() not in ['i', 'r', 'ri', 'a']:
         logger.error("Invalid choice. Exiting.")
         exit(0)
-
-    if not date_input_after.strip() and not date_input_before.strip():
-        proceed = input("No dates entered. Do you want to proceed with a regular search? (y/n): ")
-        if proceed.lower() != 'y':
-            logger.info("Exiting as per user request")
-            exit(0)
+    # Fetch only the food details the chosen stages write
+    context.select_stages(choice.lower())
+
+    # A search that stops short raises IncompleteSearchError; the checkpoint is kept for the next run
+    try:
+        if incremental:
+            logger.info(f"Starting incremental export process...")
+            if not run_incremental_export(choice.lower()):
+                exit(1)
+        elif not date_input_after.strip() and not date_input_before.strip():
+            if interactive:
+                proceed = input("No dates entered. Do you want to proceed with a regular search? (y/n): ")
+                if proceed.lower() != 'y':
+                    logger.info("Exiting as per user request")
+                    exit(0)
         
-        logger.info(f"Starting export process...")
+            logger.info(f"Starting export process...")
         
-        # Search for ingredients if needed
-        ingredient_result = None
-        if choice.lower() in ['i', 'a']:
-            ingredient_result = search(query, "Ingredient")
-            if ingredient_result is None:
-                logger.error(f"No ingredient results found. Exiting.")
-                exit(0)
-            # Process ingredients
-            process_ingredients(ingredient_result)
-
-        # Search for recipes if needed
-        recipe_result = None
-        if choice.lower() in ['r', 'ri', 'a']:
-            recipe_result = search(query, "Recipe")
-            if recipe_result is None:
-                logger.error(f"No recipe results found. Exiting.")
-                exit(0)
-            # Process recipes
-            if choice.lower() in ['r', 'a']:
-                process_recipes(recipe_result)
-            # Process recipe items if needed
-            if choice.lower() in ['ri', 'a']:
-                process_recipe_items(recipe_result)
-    else:
-        # Try different date formats
-        date_formats = [
-            "%Y-%m-%d",  # 2023-12-31
-            "%m/%d/%Y",  # 12/31/2023
-            "%d/%m/%Y",  # 31/12/2023
-            "%Y/%m/%d"   # 2023/12/31
-        ]
-
-        modified_after_date = None
-        modified_before_date = None
-        for fmt in date_formats:
-            try:
-                modified_after_date = datetime.strptime(date_input_after, fmt)
-                modified_before_date = datetime.strptime(date_input_before, fmt)
-                break
-            except ValueError:
-                continue
-
-        if modified_after_date is None or modified_before_date is None:
-            logger.error("Invalid date format provided. Please use YYYY-MM-DD or MM/DD/YYYY")
-            exit(1)
-
-        logger.info(f"Using modified date after: {modified_after_date.strftime('%Y-%m-%d')}")
-        logger.info(f"Using modified date before: {modified_before_date.strftime('%Y-%m-%d')}")
-        logger.info(f"Starting export process...")
+            # Search for ingredients if needed
+            ingredient_result = None
+            if choice.lower() in ['i', 'a']:
+                ingredient_result = search(query, "Ingredient")
+                if ingredient_result is None:
+                    logger.error(f"No ingredient results found. Exiting.")
+                    exit(0)
+                # Process ingredients
+                process_ingredients(ingredient_result)
+
+            # Search for recipes if needed
+            recipe_result = None
+            if choice.lower() in ['r', 'ri', 'a']:
+                recipe_result = search(query, "Recipe")
+                if recipe_result is None:
+                    logger.error(f"No recipe results found. Exiting.")
+                    exit(0)
+                # Both recipe stages read the results, so keep them instead of paging once per stage
+                if choice.lower() == 'a':
+                    recipe_result = list(recipe_result)
+                # Process recipes
+                if choice.lower() in ['r', 'a']:
+                    process_recipes(recipe_result)
+                # Process recipe items if needed
+                if choice.lower() in ['ri', 'a']:
+                    process_recipe_items(recipe_result)
+        else:
+            # Try different date formats
+            date_formats = [
+                "%Y-%m-%d",  # 2023-12-31
+                "%m/%d/%Y",  # 12/31/2023
+                "%d/%m/%Y",  # 31/12/2023
+                "%Y/%m/%d"   # 2023/12/31
+            ]
+
+            modified_after_date = None
+            modified_before_date = None
+            for fmt in date_formats:
+                try:
+                    modified_after_date = datetime.strptime(date_input_after, fmt)
+                    modified_before_date = datetime.strptime(date_input_before, fmt)
+                    break
+                except ValueError:
+                    continue
+
+            if modified_after_date is None or modified_before_date is None:
+                logger.error("Invalid date format provided. Please use YYYY-MM-DD or MM/DD/YYYY")
+                exit(1)
+
+            logger.info(f"Using modified date after: {modified_after_date.strftime('%Y-%m-%d')}")
+            logger.info(f"Using modified date before: {modified_before_date.strftime('%Y-%m-%d')}")
+            logger.info(f"Starting export process...")
         
-        # Search for ingredients if needed
-        ingredient_result = None
-        if choice.lower() in ['i', 'a']:
-            logger.info(f"Searching for ingredients...")
-            ingredient_result = search_by_modified_date(query, "Ingredient", modified_after_date, modified_before_date) 
-
-            if ingredient_result is None:
-                logger.error(f"No ingredient results found. Exiting.")
-                exit(0)
-
-            # Process ingredients
-            process_ingredients(ingredient_result)
+            # Search for ingredients if needed
+            ingredient_result = None
+            if choice.lower() in ['i', 'a']:
+                logger.info(f"Searching for ingredients...")
+                ingredient_result = search_by_modified_date(query, "Ingredient", modified_after_date, modified_before_date) 
+
+                if ingredient_result is None:
+                    logger.error(f"No ingredient results found. Exiting.")
+                    exit(0)
+
+                # Process ingredients
+                process_ingredients(ingredient_result)
          
-        # Search for recipes if needed
-        recipe_result = None
-        if choice.lower() in ['r', 'ri', 'a']:
-            logger.info(f"Searching for recipes...")
-            recipe_result = search_by_modified_date(query, "Recipe", modified_after_date, modified_before_date)
-
-            if recipe_result is None:
-                logger.error(f"No recipe results found. Exiting.")
-                exit(0)
-
-            # Process recipes
-            if choice.lower() in ['r', 'a']:
-                process_recipes(recipe_result)
-            # Process recipe items if needed
-            if choice.lower() in ['ri', 'a']:
-                process_recipe_items(recipe_result)
+            # Search for recipes if needed
+            recipe_result = None
+            if choice.lower() in ['r', 'ri', 'a']:
+                logger.info(f"Searching for recipes...")
+                recipe_result = search_by_modified_date(query, "Recipe", modified_after_date, modified_before_date)
+
+                if recipe_result is None:
+                    logger.error(f"No recipe results found. Exiting.")
+                    exit(0)
+
+                # Both recipe stages read the results, so keep them instead of paging once per stage
+                if choice.lower() == 'a':
+                    recipe_result = list(recipe_result)
+                # Process recipes
+                if choice.lower() in ['r', 'a']:
+                    process_recipes(recipe_result)
+                # Process recipe items if needed
+                if choice.lower() in ['ri', 'a']:
+                    process_recipe_items(recipe_result)
+    except IncompleteSearchError as e:
+        logger.error(f"{e}. The export is incomplete; run it again to resume from the checkpoint.")
+        exit(1)
+
+    if context.checkpoint.resumed:
+        logger.info(f"Resumed {context.checkpoint.resumed} foods from the checkpoint.")
+    # Foods that failed were exported with blank details; keep the journal so the next run only fetches them
+    if context.failed:
+        logger.error(f"Requests failed for {context.failed} foods. Run the export again to fetch them.")
+        exit(1)
+    # Everything was exported, so a later run starts from scratch
+    if not incremental:
+        context.checkpoint.clear()
  
     end_time = datetime.now()
     elapsed_time = end_time - start_time
     logger.info(f"Exporting complete.")
     logger.info(f"Total elapsed time: {elapsed_time}")
+
+
+# Run the playground script
+if __name__ == "__main__":
+    main()
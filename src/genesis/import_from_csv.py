@@ -1,34 +1,16 @@
-import requests
-import configparser
+import argparse
 import json
 import csv
+import itertools
 import os
-from logging_config import setup_logging
+from logging_config import setup_logging, get_logger
+import profiling
+from client import run_query
 from constants import *
+from settings import get_config
+from sharding import parse_shard
 
-# Set up logging
-logger = setup_logging()
-
-# Read the configuration file
-config = configparser.ConfigParser()
-config.read('config.ini')
-
-# Retrieve the API settings
-endpoint = config.get('api', 'endpoint')
-api_key = config.get('api', 'api_key')
-
-# Retrieve the input file path from the configuration
-input_csv = config.get('files', 'input_csv')
-
-# Retrieve options
-food_type = config.get('options', 'food_type')
-output_limit = int(config.get('options', 'limit', fallback=10000))
-
-# Define the headers
-headers = {
-    "X-API-KEY": api_key,
-    "Content-Type": "application/json"
-}
+logger = get_logger()
 
 ENGLISH = "973847da-8760-4b54-9981-a596640a4659"
 
@@ -177,21 +159,6 @@ mutation($input: ApproveDocumentInput!){
 """
 
 
-def run_query(graphql_query, variables):
-    """Run a GraphQL query against the Genesis API with variables."""
-    response = requests.post(
-        endpoint,
-        json={'query': graphql_query, 'variables': variables},
-        headers=headers
-    )
-    if response.status_code == 200:
-        return response.json()
-    else:
-        logger.error(f"Request failed with status code {response.status_code}")
-        logger.error(response.text)
-        return None
-
-
 def update_food_item(item_id, nutrientValues, amounts):
     variables = {
         "input": {
@@ -306,7 +273,29 @@ def set_supplier_on_food(food_id, supplier_id):
     return item
 
 
-if __name__ == "__main__":
+def count_rows(input_csv):
+    with open(input_csv, "r", encoding='utf-8-sig') as csvfile:
+        return sum(1 for _ in csv.DictReader(csvfile))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Create ingredients from the rows of a CSV file.")
+    parser.add_argument("--input", help="The CSV file to import. Default: input_csv in config.ini")
+    parser.add_argument("--shard", type=parse_shard, metavar="I/N",
+                        help="Import only shard I of N of the rows, a contiguous range of the file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging()
+    profiling.start()
+    input_csv = args.input or get_config().get('files', 'input_csv')
+
+    start, stop = 0, None
+    if args.shard:
+        start, stop = args.shard.row_range(count_rows(input_csv))
+        logger.info(f"Importing rows {start + 1} to {stop} of {input_csv} as shard {args.shard}")
 
     # Base work - Get the list of suppliers
 
@@ -318,7 +307,7 @@ if __name__ == "__main__":
     with open(input_csv, "r", encoding='utf-8-sig') as csvfile:
         csvreader = csv.DictReader(csvfile)
         linecount = 0
-        for item in csvreader:
+        for item in itertools.islice(csvreader, start, stop):
 
             errors = False
             nutrientValues = []
@@ -461,3 +450,7 @@ if __name__ == "__main__":
 
             else:
                 logger.info(f"Skipped creation of '{name}'!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import csv
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+from logging_config import get_logger
+from models import as_dict
+from response_cache import parse_timestamp
+
+logger = get_logger()
+
+
+def load_watermark(state_file, stage):
+    """Return the modified high-water mark saved for a stage, or None."""
+    if not os.path.exists(state_file):
+        return None
+
+    with open(state_file, encoding='utf-8') as f:
+        state = json.load(f)
+
+    return state.get(stage) or None
+
+
+def to_datetime(modified):
+    """Convert a `modified` value to a UTC datetime."""
+    return datetime.fromtimestamp(parse_timestamp(modified), timezone.utc)
+
+
+def save_watermark(state_file, stage, modified):
+    """Save the modified high-water mark for a stage."""
+    state = {}
+    if os.path.exists(state_file):
+        with open(state_file, encoding='utf-8') as f:
+            state = json.load(f)
+
+    state[stage] = modified
+
+    # Write to a temporary file first so an interrupted run cannot leave a corrupt state file
+    temp_file = f"{state_file}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=4)
+    os.replace(temp_file, state_file)
+    logger.info(f"Saved {stage} watermark {modified} to {state_file}")
+
+
+class HighWaterMark:
+    """Tracks the latest `modified` value of the search results passed through track()."""
+
+    def __init__(self, previous=None):
+        self.value = previous
+        self._value_at = parse_timestamp(previous) if previous else None
+
+    def update(self, item):
+        """Take the item's `modified` value if it is later than the current mark."""
+        modified = item.modified
+        if not modified:
+            return
+        modified_at = parse_timestamp(modified)
+        if self._value_at is None or modified_at > self._value_at:
+            self.value, self._value_at = modified, modified_at
+
+    def track(self, items):
+        """Yield the items unchanged, updating the mark from each one."""
+        for item in items:
+            self.update(item)
+            yield item
+
+
+def merge_csv(csv_file, rows, key, replaced_keys=(), fieldnames=()):
+    """
+    Merge rows into an existing CSV file by a key column.
+
+    Existing rows whose key matches a new row are replaced in place by all the new rows
+    with that key; rows for keys in `replaced_keys` are dropped. New keys are appended
+    at the end. The existing file is streamed rather than loaded, so memory only grows
+    with the number of new rows.
+
+    Args:
+        csv_file: The CSV file to update. It is created if it does not exist.
+        rows: The new rows (dictionaries).
+        key: The column that identifies a row, e.g. "id" or "recipe_id".
+        replaced_keys: Extra keys whose old rows should be removed even without new rows.
+        fieldnames: Columns the merged file should have in addition to the existing ones.
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault(str(row.get(key)), []).append(row)
+    replaced = set(groups) | {str(k) for k in replaced_keys}
+
+    existing = os.path.exists(csv_file)
+    columns = []
+    if existing:
+        with open(csv_file, newline='', encoding='utf-8') as f:
+            columns = next(csv.reader(f), [])
+    for field in fieldnames:
+        if field not in columns:
+            columns.append(field)
+    for row in rows:
+        for field in row.keys():
+            if field not in columns:
+                columns.append(field)
+
+    temp_file = f"{csv_file}.tmp"
+    written = set()
+    with open(temp_file, mode='w', newline='', encoding='utf-8') as out:
+        writer = csv.DictWriter(out, fieldnames=columns, restval='')
+        writer.writeheader()
+
+        if existing:
+            with open(csv_file, newline='', encoding='utf-8') as f:
+                for old_row in csv.DictReader(f):
+                    row_key = old_row.get(key)
+                    if row_key not in replaced:
+                        writer.writerow(old_row)
+                    elif row_key in groups and row_key not in written:
+                        writer.writerows(groups[row_key])
+                        written.add(row_key)
+
+        for row_key, group in groups.items():
+            if row_key not in written:
+                writer.writerows(group)
+
+    os.replace(temp_file, csv_file)
+    logger.info(f"Merged {len(rows)} rows into {csv_file}")
+
+
+class CsvMergeSink:
+    """
+    A row sink for incremental runs that merges its rows into an existing CSV on close.
+
+    It has the same interface as writers.CsvRowSink. Rows are kept until the sink is
+    closed, which is fine for the few changed foods of an incremental run.
+    """
+
+    def __init__(self, csv_file, fieldnames, key):
+        self.csv_file = csv_file
+        self.fieldnames = list(fieldnames)
+        self.key = key
+        self.rows = []
+        self.replaced_keys = set()
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            merge_csv(self.csv_file, self.rows, self.key, self.replaced_keys, self.fieldnames)
+
+    def replace(self, key):
+        """Drop the existing rows for a key even if no new rows are written for it."""
+        self.replaced_keys.add(key)
+
+    def write(self, row):
+        """Queue one row for the merge. Like CsvRowSink, keys outside the schema are ignored."""
+        row = as_dict(row)
+        with self._lock:
+            self.rows.append({field: row[field] for field in self.fieldnames if field in row})
+            self.count += 1
+
+    def write_all(self, rows):
+        """Queue each row and return them unchanged."""
+        for row in rows:
+            self.write(row)
+            yield row
@@ -0,0 +1,199 @@
+import ast
+import csv
+import math
+import os
+import shutil
+import struct
+import sys
+import threading
+from array import array
+
+from logging_config import get_logger
+
+logger = get_logger()
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+# The header is written before the row count is known and rewritten in place on close,
+# so it gets a fixed size (a multiple of 64 bytes, as the format asks for)
+NPY_HEADER_SIZE = 128
+
+
+def npy_header(rows, columns):
+    """Return a version 1.0 .npy header for a C-ordered float64 matrix of the given shape."""
+    header = f"{{'descr': '<f8', 'fortran_order': False, 'shape': ({rows}, {columns}), }}"
+    padding = NPY_HEADER_SIZE - len(NPY_MAGIC) - 2 - len(header) - 1
+    return NPY_MAGIC + struct.pack("<H", NPY_HEADER_SIZE - len(NPY_MAGIC) - 2) + (header + " " * padding + "\n").encode("latin1")
+
+
+def read_npy_shape(f):
+    """Read the header of a .npy file written by NutrientMatrixSink and return its (rows, columns)."""
+    if f.read(len(NPY_MAGIC)) != NPY_MAGIC:
+        raise ValueError(f"{f.name} is not a version 1.0 .npy file")
+    header_length = struct.unpack("<H", f.read(2))[0]
+    header = ast.literal_eval(f.read(header_length).decode("latin1"))
+    if header.get("descr") != "<f8" or header.get("fortran_order"):
+        raise ValueError(f"{f.name} is not a C-ordered float64 matrix")
+    return header["shape"]
+
+
+def merge_matrices(paths, path):
+    """
+    Stack the rows of several nutrient matrices (e.g. the shards of an export) into one.
+
+    The `_rows.csv` indexes are concatenated with their row numbers renumbered, and the
+    `_columns.csv` index, which must be the same for every matrix, is copied.
+    """
+    shapes = []
+    for matrix in paths:
+        with open(matrix, "rb") as f:
+            shapes.append(read_npy_shape(f))
+    columns = {shape[1] for shape in shapes}
+    if len(columns) > 1:
+        raise ValueError(f"The matrices do not have the same columns: {', '.join(paths)}")
+    rows = sum(shape[0] for shape in shapes)
+
+    with open(path, "wb") as out:
+        out.write(npy_header(rows, columns.pop() if columns else 0))
+        for matrix in paths:
+            with open(matrix, "rb") as f:
+                read_npy_shape(f)
+                shutil.copyfileobj(f, out)
+
+    base = os.path.splitext(path)[0]
+    with open(f"{base}_rows.csv", "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        writer.writerow(["row", "id"])
+        position = 0
+        for matrix in paths:
+            with open(f"{os.path.splitext(matrix)[0]}_rows.csv", newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                next(reader, None)
+                for _, food_id in reader:
+                    writer.writerow([position, food_id])
+                    position += 1
+    if paths:
+        shutil.copyfile(f"{os.path.splitext(paths[0])[0]}_columns.csv", f"{base}_columns.csv")
+    logger.info(f"Merged {len(paths)} nutrient matrices into {path} ({rows} rows)")
+
+
+def to_float(value):
+    """Convert an analysis value to a float; missing or non-numeric values become NaN."""
+    if value is None or value == "":
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class NutrientMatrixSink:
+    """
+    Writes the nutrient values of export rows as a foods x nutrients float64 matrix.
+
+    The matrix is a standard .npy file, so consumers can open it with
+    numpy.load(path, mmap_mode='r') and run vectorized math on it without parsing CSV.
+    Two index files are written next to it: `<name>_rows.csv` (row position and food id)
+    and `<name>_columns.csv` (column position, nutrient id and name). Missing values are
+    NaN. Rows are appended as they arrive, so memory stays flat and NumPy is not needed
+    to write the file.
+
+    It has the same interface as the CSV row sinks in writers.py.
+    """
+
+    def __init__(self, path, projection, id_field="id"):
+        self.path = path
+        self.projection = projection
+        self.id_field = id_field
+        self.count = 0
+        base = os.path.splitext(path)[0]
+        self.rows_path = f"{base}_rows.csv"
+        self.columns_path = f"{base}_columns.csv"
+        self._file = None
+        self._rows_file = None
+        self._rows_writer = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._file = open(self.path, "wb")
+        self._file.write(npy_header(0, len(self.projection.columns)))
+        self._rows_file = open(self.rows_path, "w", newline="", encoding="utf-8")
+        self._rows_writer = csv.writer(self._rows_file)
+        self._rows_writer.writerow(["row", "id"])
+
+        with open(self.columns_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["column", "nutrient_id", "name"])
+            for position, (nutrient_id, name, _) in enumerate(self.projection.columns):
+                writer.writerow([position, nutrient_id or "", name])
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Write the final shape into the header
+        self._file.seek(0)
+        self._file.write(npy_header(self.count, len(self.projection.columns)))
+        self._file.close()
+        self._rows_file.close()
+        self._file = None
+        self._rows_file = None
+        self._rows_writer = None
+        logger.info(f"Wrote {self.count} x {len(self.projection.columns)} nutrient matrix to {self.path}")
+
+    def write(self, row):
+        """Append the nutrient values of a row (a models.Row or a dict)."""
+        if isinstance(row, dict):
+            values = array("d", (to_float(row.get(name)) for _, name, _ in self.projection.columns))
+            food_id = row.get(self.id_field)
+        else:
+            values = array("d", (to_float(row.values[column]) for _, _, column in self.projection.columns))
+            food_id = row[self.id_field]
+        if sys.byteorder != "little":
+            values.byteswap()
+
+        with self._lock:
+            self._file.write(values.tobytes())
+            self._rows_writer.writerow([self.count, food_id])
+            self.count += 1
+
+    def write_all(self, rows):
+        """Write each row and return them unchanged."""
+        for row in rows:
+            self.write(row)
+            yield row
+
+
+def rebuild_matrix(csv_path, path, projection, id_field="id"):
+    """Rewrite a nutrient matrix and its index files from the rows of a CSV."""
+    with open(csv_path, newline="", encoding="utf-8") as f, NutrientMatrixSink(path, projection, id_field) as sink:
+        for row in csv.DictReader(f):
+            sink.write(row)
+
+
+class MatrixRebuildSink:
+    """
+    Rebuilds the nutrient matrix of a CSV from the CSV once it has been written.
+
+    An incremental run merges its rows into the existing CSV on close (see
+    incremental.CsvMergeSink), so the matrix cannot just be appended to. Put this sink
+    after the merge sink in a writers.MultiSink: rows written to it are ignored, and on a
+    successful close the matrix is rewritten from the merged CSV so the two stay in step.
+    """
+
+    def __init__(self, csv_path, path, projection, id_field="id"):
+        self.csv_path = csv_path
+        self.path = path
+        self.projection = projection
+        self.id_field = id_field
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            rebuild_matrix(self.csv_path, self.path, self.projection, self.id_field)
+
+    def write(self, row):
+        pass
+
+    def write_all(self, rows):
+        return rows
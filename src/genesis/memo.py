@@ -0,0 +1,111 @@
+import atexit
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+
+from logging_config import get_logger
+from response_cache import ResponseCache
+
+logger = get_logger()
+
+DEFAULT_MAX_ITEMS = 10000
+
+
+class MemoCache:
+    """
+    A per-run memo of query payloads, so the same food is fetched at most once per run.
+
+    It has the same interface as ResponseCache and can be given to a BatchedQuery in its
+    place. Up to `max_items` payloads are kept in memory; the least recently used beyond
+    that are spilled to a temporary SQLite file that is deleted when the memo is closed
+    or the process exits. Lookups that miss fall through to `backing` (normally the
+    persistent ResponseCache, if enabled) and stores are written to both.
+    """
+
+    def __init__(self, max_items=DEFAULT_MAX_ITEMS, backing=None):
+        self.max_items = max_items
+        self.backing = backing
+        self.spilled = 0
+        self._items = OrderedDict()
+        self._spill_path = None
+        self._spill = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(graphql_query, variables):
+        """Return the key for a query and its variables; the same key ResponseCache uses."""
+        return ResponseCache.key(graphql_query, variables)
+
+    def _spill_connection(self):
+        if self._spill is None:
+            handle, self._spill_path = tempfile.mkstemp(prefix="genesis_memo_", suffix=".sqlite")
+            os.close(handle)
+            self._spill = sqlite3.connect(self._spill_path, check_same_thread=False)
+            self._spill.execute("PRAGMA journal_mode=OFF")
+            self._spill.execute("PRAGMA synchronous=OFF")
+            self._spill.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            atexit.register(self.close)
+            logger.info(f"Spilling food details beyond {self.max_items} entries to {self._spill_path}")
+        return self._spill
+
+    def get_many(self, keys):
+        """Return a dict of the memoized values for the keys that are present."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._items:
+                    self._items.move_to_end(key)
+                    found[key] = self._items[key]
+
+            missing = [key for key in keys if key not in found]
+            if missing and self._spill is not None:
+                placeholders = ",".join("?" * len(missing))
+                rows = self._spill.execute(f"SELECT key, value FROM entries WHERE key IN ({placeholders})",
+                                           missing).fetchall()
+                for key, value in rows:
+                    found[key] = json.loads(value)
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.backing is not None:
+            backed = self.backing.get_many(missing)
+            if backed:
+                self._remember(backed.items())
+                found.update(backed)
+        return found
+
+    def put_many(self, entries):
+        """Memoize (key, value, food_id) entries and pass them on to the backing cache."""
+        if not entries:
+            return
+        self._remember((key, value) for key, value, _ in entries)
+        if self.backing is not None:
+            self.backing.put_many(entries)
+
+    def _remember(self, items):
+        with self._lock:
+            for key, value in items:
+                self._items[key] = value
+                self._items.move_to_end(key)
+
+            overflow = []
+            while len(self._items) > self.max_items:
+                key, value = self._items.popitem(last=False)
+                overflow.append((key, json.dumps(value, separators=(',', ':'))))
+            if overflow:
+                connection = self._spill_connection()
+                connection.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?)", overflow)
+                connection.commit()
+                self.spilled += len(overflow)
+
+    def close(self):
+        """Forget everything and delete the spill file."""
+        with self._lock:
+            self._items.clear()
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+                os.remove(self._spill_path)
+                self._spill_path = None
@@ -0,0 +1,291 @@
+"""
+Request metrics for the Genesis API client.
+
+Every call client.run_query() makes is counted and timed under the name of its operation
+(e.g. foods.search, analysis.getAnalysis, label.unitedStates2016.create) and its HTTP
+status, together with the bytes sent and received. Latencies go into log-linear (HDR
+style) histograms. The metrics are written periodically as a Prometheus textfile and as a
+JSON summary when the process exits, as configured in the [metrics] section of config.ini.
+"""
+
+import atexit
+import functools
+import json
+import os
+import re
+import threading
+
+from logging_config import get_logger
+from settings import get_config
+
+logger = get_logger()
+
+DEFAULT_TEXTFILE = "genesis_metrics.prom"
+DEFAULT_SUMMARY_FILE = "genesis_metrics.json"
+DEFAULT_INTERVAL = 15
+QUANTILES = (0.5, 0.9, 0.95, 0.99, 0.999)
+
+# Linear sub-buckets per power of two; bounds the relative error of a recorded latency to 1/64
+SUB_BUCKET_BITS = 6
+
+OPERATION_TOKEN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|\.\.\.|[{}():]|[_A-Za-z][_0-9A-Za-z]*')
+
+_registry = None
+_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=512)
+def operation_name(graphql_query):
+    """
+    Return the name of the operation(s) a GraphQL document calls, e.g. "foods.get".
+
+    The name is the path of field names (not aliases) to each field that takes arguments.
+    A batched document that calls several operations is named after all of them in order
+    of appearance, joined with "+", e.g. "analysis.getAnalysis+foods.get".
+    """
+    operations = []
+    first_path = None
+    path = []
+    field = None
+    fragment = False
+    parens = 0
+    for token in OPERATION_TOKEN_RE.findall(graphql_query):
+        if parens:
+            parens += {"(": 1, ")": -1}.get(token, 0)
+        elif token == "(":
+            if path:
+                name = ".".join(p for p in path + [field] if p)
+                if name not in operations:
+                    operations.append(name)
+            parens = 1
+        elif token == "{":
+            path.append(field if path and not fragment else None)
+            field = None
+            fragment = False
+        elif token == "}":
+            if path:
+                path.pop()
+            field = None
+        elif token == "...":
+            fragment = True
+        elif token != ":" and not fragment:
+            field = token
+            if first_path is None and path:
+                first_path = ".".join(p for p in path + [field] if p)
+    if operations:
+        return "+".join(operations)
+    return first_path or "unknown"
+
+
+class Histogram:
+    """
+    A log-linear histogram of non-negative values, like HdrHistogram.
+
+    Values are recorded as integer microseconds into buckets that split every power of two
+    into 2**SUB_BUCKET_BITS linear steps, so quantiles are accurate to within ~1.6% while the
+    histogram stays a small dict of bucket counts whatever the number of samples.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    @staticmethod
+    def bucket(units):
+        shift = max(0, units.bit_length() - SUB_BUCKET_BITS - 1)
+        return shift, units >> shift
+
+    @staticmethod
+    def bucket_value(bucket):
+        """Return the midpoint of a bucket, in seconds."""
+        shift, sub_bucket = bucket
+        return ((sub_bucket << shift) + ((1 << shift) - 1) / 2) / 1e6
+
+    def record(self, seconds):
+        bucket = self.bucket(int(seconds * 1e6))
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def quantile(self, q):
+        """Return the value at quantile q (0 to 1) in seconds, or None if nothing was recorded."""
+        if not self.count:
+            return None
+        rank = max(1, round(q * self.count))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self.max, max(self.min, self.bucket_value(bucket)))
+        return self.max
+
+
+class Operation:
+    """The metrics of one operation."""
+
+    def __init__(self):
+        self.statuses = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency = Histogram()
+
+
+class Metrics:
+    """A thread-safe registry of per-operation request metrics."""
+
+    def __init__(self):
+        self.operations = {}
+        self._lock = threading.Lock()
+
+    def observe(self, graphql_query, status, seconds, bytes_sent=0, bytes_received=0):
+        """
+        Record one HTTP request.
+
+        Args:
+            graphql_query: The GraphQL document that was sent.
+            status: The HTTP status code, or "error" if no response was received.
+            seconds: How long the request took.
+            bytes_sent: The size of the request body.
+            bytes_received: The size of the response body.
+        """
+        name = operation_name(graphql_query)
+        status = str(status)
+        with self._lock:
+            operation = self.operations.get(name)
+            if operation is None:
+                operation = self.operations[name] = Operation()
+            operation.statuses[status] = operation.statuses.get(status, 0) + 1
+            operation.bytes_sent += bytes_sent
+            operation.bytes_received += bytes_received
+            operation.latency.record(seconds)
+
+    def prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP genesis_requests_total GraphQL requests sent to the Genesis API.",
+            "# TYPE genesis_requests_total counter"
+        ]
+        with self._lock:
+            operations = sorted(self.operations.items())
+            for name, operation in operations:
+                for status, count in sorted(operation.statuses.items()):
+                    lines.append(f'genesis_requests_total{{operation="{name}",status="{status}"}} {count}')
+
+            lines += ["# HELP genesis_request_bytes_sent_total Request body bytes sent.",
+                      "# TYPE genesis_request_bytes_sent_total counter"]
+            lines += [f'genesis_request_bytes_sent_total{{operation="{name}"}} {operation.bytes_sent}'
+                      for name, operation in operations]
+
+            lines += ["# HELP genesis_response_bytes_received_total Response body bytes received.",
+                      "# TYPE genesis_response_bytes_received_total counter"]
+            lines += [f'genesis_response_bytes_received_total{{operation="{name}"}} {operation.bytes_received}'
+                      for name, operation in operations]
+
+            lines += ["# HELP genesis_request_duration_seconds GraphQL request latency.",
+                      "# TYPE genesis_request_duration_seconds summary"]
+            for name, operation in operations:
+                latency = operation.latency
+                for q in QUANTILES:
+                    lines.append(f'genesis_request_duration_seconds{{operation="{name}",quantile="{q}"}} '
+                                 f'{latency.quantile(q):.6f}')
+                lines.append(f'genesis_request_duration_seconds_sum{{operation="{name}"}} {latency.total:.6f}')
+                lines.append(f'genesis_request_duration_seconds_count{{operation="{name}"}} {latency.count}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Return a JSON-serializable summary, with each operation's share of the total request time."""
+        with self._lock:
+            total_time = sum(operation.latency.total for operation in self.operations.values())
+            summary = {}
+            for name, operation in sorted(self.operations.items(), key=lambda item: -item[1].latency.total):
+                latency = operation.latency
+                summary[name] = {
+                    "requests": latency.count,
+                    "statuses": dict(operation.statuses),
+                    "bytes_sent": operation.bytes_sent,
+                    "bytes_received": operation.bytes_received,
+                    "time_s": round(latency.total, 3),
+                    "time_share": round(latency.total / total_time, 4) if total_time else None,
+                    "latency_ms": {
+                        "min": round(latency.min * 1000, 3),
+                        **{f"p{q * 100:g}": round(latency.quantile(q) * 1000, 3) for q in QUANTILES},
+                        "max": round(latency.max * 1000, 3)
+                    }
+                }
+            return summary
+
+
+def write_atomic(path, text):
+    """Write a file through a temporary file so readers never see it half written."""
+    temp_file = f"{path}.tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp_file, path)
+
+
+class MetricsWriter:
+    """Writes the Prometheus textfile every `interval` seconds and the files once more at exit."""
+
+    def __init__(self, metrics, textfile=None, summary_file=None, interval=DEFAULT_INTERVAL):
+        self.metrics = metrics
+        self.textfile = textfile
+        self.summary_file = summary_file
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self.textfile and self.interval > 0:
+            threading.Thread(target=self._run, name="metrics-writer", daemon=True).start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.write_textfile()
+
+    def write_textfile(self):
+        if not self.textfile or not self.metrics.operations:
+            return
+        try:
+            write_atomic(self.textfile, self.metrics.prometheus())
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {self.textfile}: {e}")
+
+    def close(self):
+        """Stop the periodic writes and write the final textfile and JSON summary."""
+        self._stopped.set()
+        if not self.metrics.operations:
+            return
+        self.write_textfile()
+        summary = self.metrics.summary()
+        if self.summary_file:
+            try:
+                write_atomic(self.summary_file, json.dumps(summary, indent=4))
+            except OSError as e:
+                logger.warning(f"Could not write metrics summary to {self.summary_file}: {e}")
+        name, busiest = next(iter(summary.items()))
+        logger.info(f"{sum(s['requests'] for s in summary.values())} requests; {name} took the most time: "
+                    f"{busiest['requests']} requests, {busiest['time_s']}s, p99 {busiest['latency_ms']['p99']}ms")
+
+
+def get_metrics():
+    """Return the process-wide Metrics, reading the [metrics] section of config.ini on first use."""
+    global _registry
+    if _registry is None:
+        with _lock:
+            if _registry is None:
+                config = get_config()
+                metrics = Metrics()
+                if config.getboolean('metrics', 'enabled', fallback=False):
+                    MetricsWriter(
+                        metrics,
+                        textfile=config.get('metrics', 'textfile', fallback=DEFAULT_TEXTFILE),
+                        summary_file=config.get('metrics', 'summary_file', fallback=DEFAULT_SUMMARY_FILE),
+                        interval=config.getfloat('metrics', 'interval', fallback=DEFAULT_INTERVAL)
+                    ).start()
+                _registry = metrics
+    return _registry
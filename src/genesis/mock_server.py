@@ -0,0 +1,755 @@
+#!/usr/bin/env python3
+"""
+A local stand-in for the Genesis GraphQL API, for running the scripts offline and for
+benchmarking them.
+
+It serves a synthetic catalog of ingredients and recipes and implements the queries and
+mutations these scripts use: foods.search (with cursors), foods.get, analysis.getAnalysis,
+labels.getLabelsForFood, tags, suppliers, the food and label create/set mutations and
+documents.approve. Documents can use aliases, several root fields and inline fragments.
+Latency, throttling (429 with Retry-After) and server errors (503) can be injected.
+Automatic persisted queries are supported, and a persisted query manifest (see
+persisted_queries.py) can be loaded at start with --persisted-queries.
+
+Run it and point [api] endpoint in config.ini at it:
+
+    python mock_server.py --port 8787 --foods 10000 --latency 0.05
+    endpoint = http://127.0.0.1:8787/graphql
+
+GET /stats returns request counters and latency percentiles as JSON.
+"""
+
+import argparse
+import functools
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from constants import NUTRIENTS, UNITS
+from persisted_queries import NOT_FOUND, load_manifest, query_hash
+from response_cache import parse_timestamp
+
+DEFAULT_PORT = 8787
+DEFAULT_FOODS = 1000
+DEFAULT_RECIPE_RATIO = 0.3
+LABEL_EVERY = 3
+TAGS = ["Bakery", "Dairy", "Frozen", "Produce", "Snacks"]
+REGIONS = ["unitedStates2016", "canada2016", "europeanUnion2011", "mexico2020"]
+
+
+class GraphQLError(Exception):
+    """An error reported in the `errors` of the response instead of failing the request."""
+
+
+# ---------------------------------------------------------------------------
+# Parsing
+# ---------------------------------------------------------------------------
+
+TOKEN_RE = re.compile(r"""
+    (?P<ignore>[\s,]+|\#[^\n]*)
+  | (?P<spread>\.\.\.)
+  | (?P<punct>[{}()\[\]:!$=@])
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<name>[_A-Za-z][_0-9A-Za-z]*)
+""", re.VERBOSE)
+
+
+class Field:
+    __slots__ = ("alias", "name", "arguments", "selections")
+
+    def __init__(self, alias, name, arguments, selections):
+        self.alias = alias
+        self.name = name
+        self.arguments = arguments
+        self.selections = selections
+
+
+class InlineFragment:
+    __slots__ = ("type_condition", "selections")
+
+    def __init__(self, type_condition, selections):
+        self.type_condition = type_condition
+        self.selections = selections
+
+
+class Variable:
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+
+def tokenize(source):
+    tokens = []
+    position = 0
+    while position < len(source):
+        match = TOKEN_RE.match(source, position)
+        if match is None:
+            raise GraphQLError(f"Syntax error: unexpected character {source[position]!r} at {position}")
+        position = match.end()
+        if match.lastgroup != "ignore":
+            tokens.append((match.lastgroup, match.group()))
+    return tokens
+
+
+class Parser:
+    """
+    Parses the subset of GraphQL the scripts send: one query or mutation with variables,
+    aliases, arguments and inline fragments. Named fragments and directives are not supported.
+    """
+
+    def __init__(self, source):
+        self.tokens = tokenize(source)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        kind, token = self.peek()
+        if token is None or (value is not None and token != value):
+            raise GraphQLError(f"Syntax error: expected {value or 'a token'}, found {token!r}")
+        self.position += 1
+        return token
+
+    def parse_operation(self):
+        """Return the operation type ('query' or 'mutation') and its selections."""
+        operation = "query"
+        if self.peek()[1] in ("query", "mutation"):
+            operation = self.take()
+            if self.peek()[0] == "name":
+                self.take()
+            if self.peek()[1] == "(":
+                self.skip_variable_definitions()
+        return operation, self.parse_selection_set()
+
+    def skip_variable_definitions(self):
+        depth = 0
+        while True:
+            token = self.take()
+            if token == "(":
+                depth += 1
+            elif token == ")":
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def parse_selection_set(self):
+        self.take("{")
+        selections = []
+        while self.peek()[1] != "}":
+            if self.peek()[0] == "spread":
+                self.take()
+                self.take("on")
+                type_condition = self.take()
+                selections.append(InlineFragment(type_condition, self.parse_selection_set()))
+            else:
+                selections.append(self.parse_field())
+        self.take("}")
+        return selections
+
+    def parse_field(self):
+        alias = name = self.take()
+        if self.peek()[1] == ":":
+            self.take()
+            name = self.take()
+        arguments = {}
+        if self.peek()[1] == "(":
+            self.take()
+            while self.peek()[1] != ")":
+                argument = self.take()
+                self.take(":")
+                arguments[argument] = self.parse_value()
+            self.take(")")
+        selections = self.parse_selection_set() if self.peek()[1] == "{" else None
+        return Field(alias, name, arguments, selections)
+
+    def parse_value(self):
+        kind, token = self.peek()
+        if token == "$":
+            self.take()
+            return Variable(self.take())
+        if token == "[":
+            self.take()
+            values = []
+            while self.peek()[1] != "]":
+                values.append(self.parse_value())
+            self.take("]")
+            return values
+        if token == "{":
+            self.take()
+            values = {}
+            while self.peek()[1] != "}":
+                key = self.take()
+                self.take(":")
+                values[key] = self.parse_value()
+            self.take("}")
+            return values
+        self.take()
+        if kind == "string":
+            return json.loads(token)
+        if kind == "number":
+            return float(token) if any(c in token for c in ".eE") else int(token)
+        return {"true": True, "false": False, "null": None}.get(token, token)
+
+
+def resolve_value(value, variables):
+    """Substitute variables into a parsed argument value."""
+    if isinstance(value, Variable):
+        return variables.get(value.name)
+    if isinstance(value, list):
+        return [resolve_value(v, variables) for v in value]
+    if isinstance(value, dict):
+        return {k: resolve_value(v, variables) for k, v in value.items()}
+    return value
+
+
+# ---------------------------------------------------------------------------
+# Execution
+# ---------------------------------------------------------------------------
+
+def project(value, selections):
+    """Select the requested fields of a resolved value."""
+    if selections is None or value is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, selections) for item in value]
+
+    output = {}
+    for selection in selections:
+        if isinstance(selection, InlineFragment):
+            if value.get("__typename") == selection.type_condition:
+                output.update(project(value, selection.selections))
+        else:
+            output[selection.alias] = project(value.get(selection.name), selection.selections)
+    return output
+
+
+@functools.lru_cache(maxsize=256)
+def parse_document(document):
+    """Parse a document once; the scripts send the same few documents over and over."""
+    return Parser(document).parse_operation()
+
+
+def execute(document, variables, resolvers):
+    """
+    Execute a GraphQL document against a tree of resolvers.
+
+    `resolvers` maps root field names to nested dicts (namespaces such as foods or
+    label.unitedStates2016) whose leaves are functions taking the field's arguments.
+    Returns the response dict and the dotted names of the fields that were resolved
+    (e.g. foods.get), once per call.
+    """
+    try:
+        operation, selections = parse_document(document)
+    except (GraphQLError, IndexError) as e:
+        return {"errors": [{"message": str(e)}]}, []
+
+    errors = []
+    resolved = []
+
+    def resolve_namespace(namespace, selections, path, names):
+        output = {}
+        for selection in selections:
+            if isinstance(selection, InlineFragment):
+                output.update(resolve_namespace(namespace, selection.selections, path, names))
+                continue
+            field_path = path + [selection.alias]
+            resolver = namespace.get(selection.name)
+            if resolver is None:
+                errors.append({"message": f"Cannot query field '{selection.name}'", "path": field_path})
+                output[selection.alias] = None
+            elif isinstance(resolver, dict):
+                output[selection.alias] = resolve_namespace(resolver, selection.selections or [], field_path,
+                                                            names + [selection.name])
+            else:
+                resolved.append(".".join(names + [selection.name]))
+                try:
+                    arguments = {name: resolve_value(value, variables or {})
+                                 for name, value in selection.arguments.items()}
+                    output[selection.alias] = project(resolver(**arguments), selection.selections)
+                except GraphQLError as e:
+                    errors.append({"message": str(e), "path": field_path})
+                    output[selection.alias] = None
+        return output
+
+    response = {"data": resolve_namespace(resolvers.get(operation, {}), selections, [], [])}
+    if errors:
+        response["errors"] = errors
+    return response, resolved
+
+
+# ---------------------------------------------------------------------------
+# Synthetic catalog
+# ---------------------------------------------------------------------------
+
+def iso(moment):
+    """Format a datetime the way the API does, with seven fractional digits."""
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.%f") + "0Z"
+
+
+class Catalog:
+    """
+    A deterministic synthetic catalog of `size` foods, roughly recipe_ratio of them recipes.
+
+    Foods are generated from their index when asked for, so large catalogs cost little
+    memory. Foods created or changed through mutations are kept in an overlay.
+    """
+
+    def __init__(self, size=DEFAULT_FOODS, recipe_ratio=DEFAULT_RECIPE_RATIO, seed=0):
+        self.size = size
+        self.seed = seed
+        self.start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        recipe_every = max(1, round(1 / recipe_ratio)) if recipe_ratio else 0
+        self.recipes = [i for i in range(size) if recipe_every and i % recipe_every == 0]
+        self.recipe_set = set(self.recipes)
+        self.ingredients = [i for i in range(size) if i not in self.recipe_set]
+        self.nutrients = list(NUTRIENTS.items())
+        self.overlay = {}
+        self.suppliers = {}
+        self.labels = {}
+        self.created = 0
+        self._lock = threading.Lock()
+
+    def food_id(self, index):
+        return f"{index:08x}-0000-4000-8000-{self.seed:012x}"
+
+    def index_of(self, food_id):
+        try:
+            prefix, _, _, _, seed = food_id.split("-")
+            index = int(prefix, 16)
+        except (AttributeError, ValueError):
+            return None
+        if int(seed, 16) != self.seed or not 0 <= index < self.size:
+            return None
+        return index
+
+    def is_recipe(self, index):
+        return index in self.recipe_set
+
+    def modified(self, index):
+        return self.start + timedelta(minutes=17 * index)
+
+    def search_result(self, index):
+        food_type = "Recipe" if self.is_recipe(index) else "Ingredient"
+        return {
+            "__typename": "FoodSearchResult",
+            "id": self.food_id(index),
+            "name": f"Synthetic {food_type} {index}",
+            "modified": iso(self.modified(index)),
+            "created": iso(self.start),
+            "versionName": "1",
+            "eshaCode": str(100000 + index),
+            "foodType": food_type,
+            "product": f"Product {index % 50}",
+            "supplier": f"Supplier {index % 20}",
+            "versionHistoryId": self.food_id(index),
+            "tags": [TAGS[index % len(TAGS)]]
+        }
+
+    def food(self, food_id):
+        """Return the full food document for an id, or None."""
+        if food_id in self.overlay:
+            return self.overlay[food_id]
+        index = self.index_of(food_id)
+        if index is None:
+            return None
+
+        rng = random.Random(f"{self.seed}:{index}")
+        result = self.search_result(index)
+        food = {
+            "__typename": result["foodType"],
+            "id": result["id"],
+            "name": result["name"],
+            "created": result["created"],
+            "modified": result["modified"],
+            "amountCost": {
+                "amount": {"quantity": {"value": "100"}, "unit": {"id": UNITS["Gram"], "name": "Gram"}},
+                "cost": round(rng.uniform(0.1, 20), 2)
+            },
+            "conversions": [{
+                "from": {"quantity": {"value": "1"}, "unit": {"id": UNITS["Serving"], "name": "Serving"}},
+                "to": {"quantity": {"value": str(rng.randint(20, 300))}, "unit": {"id": UNITS["Gram"], "name": "Gram"}}
+            }],
+            "customFields": [{"value": f"UC{index:06d}", "customField": {"name": "User Code"}}],
+            "notes": [{"text": f"Synthetic note {index}"}],
+            "supplier": {"id": f"supplier-{index % 20}", "name": result["supplier"]},
+            "aliases": [],
+            "allergens": [],
+            "allergensVerified": False
+        }
+        if self.is_recipe(index) and self.ingredients:
+            items = rng.sample(self.ingredients, min(len(self.ingredients), rng.randint(3, 8)))
+            food.update({
+                "cookMethod": rng.choice(["Bake", "Boil", "Fry", "Raw"]),
+                "cookTime": f"{rng.randint(5, 90)} min",
+                "cookTemperature": f"{rng.randint(150, 230)} C",
+                "instructions": "Mix and cook.",
+                "panSize": "9x13",
+                "preparationTime": f"{rng.randint(5, 30)} min",
+                "items": [{
+                    "food": {"id": self.food_id(item), "name": f"Synthetic Ingredient {item}",
+                             "customFields": [{"value": f"UC{item:06d}", "customField": {"name": "User Code"}}]},
+                    "amount": {"quantity": {"value": str(rng.randint(1, 500))}, "unit": {"name": "Gram"}}
+                } for item in items],
+                "unitedStates2016AllergenStatement": {
+                    "englishStatements": {"statement": "Contains: Milk", "voluntaryStatement": ""}
+                },
+                "unitedStates2016IngredientStatement": {
+                    "englishStatement": {"customStatement": None,
+                                         "generatedStatement": ", ".join(f"INGREDIENT {item}" for item in items)}
+                }
+            })
+        else:
+            food["subIngredients"] = [{"name": f"Sub {index}-{n}", "percentage": 50} for n in range(rng.randint(0, 3))]
+        return food
+
+    def search(self, input):
+        """Return the foods.search result for a FoodSearchInput."""
+        food_types = input.get("foodTypes") or ["Ingredient", "Recipe"]
+        indices = []
+        if "Ingredient" in food_types:
+            indices.extend(self.ingredients)
+        if "Recipe" in food_types:
+            indices.extend(self.recipes)
+        indices.sort()
+
+        after = input.get("modifiedAfter")
+        before = input.get("modifiedBefore")
+        if after or before:
+            after = parse_timestamp(after) if after else None
+            before = parse_timestamp(before) if before else None
+            indices = [i for i in indices
+                       if (after is None or self.modified(i).timestamp() > after)
+                       and (before is None or self.modified(i).timestamp() < before)]
+
+        text = (input.get("searchText") or "").lower()
+        tag_names = {tag.get("name") for tag in input.get("tagsFilter") or []}
+        results = (self.search_result(i) for i in indices)
+        results = [r for r in results
+                   if (not text or text in r["name"].lower()) and (not tag_names or tag_names & set(r["tags"]))]
+
+        first = int(input.get("first") or 50)
+        offset = int(input.get("after") or 0)
+        page = results[offset:offset + first]
+        end = offset + len(page)
+        return {
+            "foodSearchResults": page,
+            "totalCount": len(results),
+            "pageInfo": {"cursor": offset, "hasNextPage": end < len(results), "startCursor": offset, "endCursor": end}
+        }
+
+    def analysis(self, input):
+        food_id = input.get("foodId")
+        index = self.index_of(food_id)
+        if index is None and food_id not in self.overlay:
+            raise GraphQLError(f"Food {food_id} not found")
+        analysis_input = input.get("analysisInput") or {}
+        amount = analysis_input.get("amount") or {}
+        quantity = float(amount.get("quantity") or 100)
+        scale = quantity / 100 if amount.get("unitId") == UNITS["Gram"] else quantity
+        rng = random.Random(f"{self.seed}:{food_id}:analysis")
+        rounded = analysis_input.get("analysisType") == "LabelRounded"
+        nutrient_infos = []
+        for nutrient_name, nutrient_id in self.nutrients:
+            value = rng.uniform(0, 50) * scale
+            nutrient_infos.append({"nutrient": {"id": nutrient_id, "name": nutrient_name},
+                                   "value": round(value) if rounded else round(value, 4)})
+        return {"analysis": {
+            "analysisType": analysis_input.get("analysisType"),
+            "nutrientInfos": nutrient_infos,
+            "amountAnalyzed": {"quantity": {"value": str(quantity)}, "unit": {"name": "Gram"}},
+            "weight": {"quantity": {"value": str(100 * scale)}, "unit": {"name": "Gram"}}
+        }}
+
+    def labels_for_food(self, input):
+        food_id = input.get("foodId")
+        index = self.index_of(food_id)
+        labels = [label for label in self.labels.values() if food_id in label["foodIds"]]
+        if index is not None and self.is_recipe(index) and index % LABEL_EVERY == 0:
+            labels.insert(0, {"id": f"label-{food_id}", "name": f"Label {index}",
+                              "regulation": {"id": "us2016", "name": "United States 2016"}})
+        return {"labels": [{k: v for k, v in label.items() if k != "foodIds"} for label in labels]}
+
+    def create_food(self, input):
+        with self._lock:
+            self.created += 1
+            food_id = f"created-{self.created:08d}"
+            now = iso(datetime.now(timezone.utc))
+            food = {"__typename": input.get("foodType") or "Ingredient", "id": food_id,
+                    "name": input.get("name"), "created": now, "modified": now,
+                    "definingAmount": input.get("definingAmount"), "conversions": input.get("conversions") or [],
+                    "customFields": [], "notes": [], "aliases": [], "allergens": [], "allergensVerified": False}
+            self.overlay[food_id] = food
+        return {"food": food}
+
+    def update_food(self, food_id, **changes):
+        food = self.food(food_id)
+        if food is None:
+            raise GraphQLError(f"Food {food_id} not found")
+        with self._lock:
+            food = dict(food, **changes, modified=iso(datetime.now(timezone.utc)))
+            self.overlay[food_id] = food
+        return {"food": food}
+
+    def create_supplier(self, input):
+        with self._lock:
+            supplier = {"id": f"supplier-created-{len(self.suppliers)}", "name": input.get("name")}
+            self.suppliers[supplier["id"]] = supplier
+        return {"supplier": supplier}
+
+    def create_label(self, input):
+        with self._lock:
+            label = {"id": f"label-created-{len(self.labels)}", "name": input.get("name"), "foodIds": []}
+            self.labels[label["id"]] = label
+        return {"label": label}
+
+    def set_label_items(self, input):
+        label = self.labels.get(input.get("labelId"))
+        if label is None:
+            raise GraphQLError(f"Label {input.get('labelId')} not found")
+        food_ids = input.get("foodIds") or [input.get("foodId")]
+        with self._lock:
+            label["foodIds"] = list(dict.fromkeys(label["foodIds"] + food_ids))
+        return {"label": label}
+
+    def get_food(self, input):
+        food = self.food(input.get("id"))
+        if food is None:
+            raise GraphQLError(f"Food {input.get('id')} not found")
+        return {"food": food}
+
+    def resolvers(self):
+        """Return the resolver tree for execute()."""
+        label_regions = {region: {"create": lambda input: self.create_label(input),
+                                  "setLabelItems": lambda input: self.set_label_items(input),
+                                  "setLabelItem": lambda input: self.set_label_items(input)}
+                         for region in REGIONS}
+        return {
+            "query": {
+                "foods": {"search": lambda input: self.search(input), "get": lambda input: self.get_food(input)},
+                "analysis": {"getAnalysis": lambda input: self.analysis(input)},
+                "labels": {"getLabelsForFood": lambda input: self.labels_for_food(input)},
+                "tags": {"getUserAddedFoodTags": lambda input=None: {
+                    "tags": [{"id": f"tag-{n}", "name": name} for n, name in enumerate(TAGS)]}},
+                "suppliers": {"getUserAdded": lambda input=None: {
+                    "suppliers": [{"id": f"supplier-{n}", "name": f"Supplier {n}"} for n in range(20)]
+                    + list(self.suppliers.values())}}
+            },
+            "mutation": {
+                "foods": {
+                    "create": lambda input: self.create_food(input),
+                    "setNutrientValues": lambda input: self.update_food(input.get("foodId")),
+                    "setAmount": lambda input: self.update_food(input.get("foodId"), definingAmount=input.get("amount")),
+                    "setAliases": lambda input: self.update_food(
+                        input.get("foodId"),
+                        aliases=[{"id": f"alias-{n}", "name": name} for n, name in enumerate(input.get("aliases") or [])]),
+                    "setSupplier": lambda input: self.update_food(
+                        input.get("foodId"),
+                        supplier=self.suppliers.get(input.get("supplierId"), {"id": input.get("supplierId"), "name": None})),
+                    "setAllergens": lambda input: self.update_food(input.get("foodId")),
+                    "setAllergensVerified": lambda input: self.update_food(
+                        input.get("foodId"), allergensVerified=input.get("allergensVerified"))
+                },
+                "suppliers": {"create": lambda input: self.create_supplier(input)},
+                "label": label_regions,
+                "documents": {"approve": lambda input: {"document": {"id": input.get("documentId")}}}
+            }
+        }
+
+
+# ---------------------------------------------------------------------------
+# HTTP server
+# ---------------------------------------------------------------------------
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of a sorted list, or None if it is empty."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+class Stats:
+    """Request counters and latencies reported by GET /stats."""
+
+    def __init__(self):
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.persisted_hits = 0
+        self.persisted_misses = 0
+        self.fields = {}
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def record_persisted(self, hit):
+        with self._lock:
+            if hit:
+                self.persisted_hits += 1
+            else:
+                self.persisted_misses += 1
+
+    def record(self, status, fields=(), latency=None):
+        with self._lock:
+            self.requests += 1
+            if status == 429:
+                self.throttled += 1
+            elif status >= 500:
+                self.errors += 1
+            for field in fields:
+                self.fields[field] = self.fields.get(field, 0) + 1
+            if latency is not None:
+                self.latencies.append(latency)
+
+    def as_dict(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            return {
+                "requests": self.requests, "throttled": self.throttled, "errors": self.errors,
+                "persisted_hits": self.persisted_hits, "persisted_misses": self.persisted_misses,
+                "fields": dict(self.fields),
+                "latency_ms": {name: None if percentile(latencies, fraction) is None
+                               else round(percentile(latencies, fraction) * 1000, 3)
+                               for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+            }
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, catalog, latency=0.0, jitter=0.0, throttle_rate=0.0, retry_after=1.0, error_rate=0.0,
+                 persisted_queries=None):
+        super().__init__(address, MockRequestHandler)
+        self.catalog = catalog
+        self.resolvers = catalog.resolvers()
+        # Persisted query documents by sha256 hash
+        self.persisted_queries = dict(persisted_queries or {})
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.stats = Stats()
+
+    @property
+    def endpoint(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/graphql"
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, Nagle's algorithm and delayed
+    # ACKs add ~40ms to every keep-alive request
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self.send_json(200, self.server.stats.as_dict())
+        else:
+            self.send_json(404, {"message": "Not found"})
+
+    def do_POST(self):
+        started = time.perf_counter()
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+        if server.throttle_rate and random.random() < server.throttle_rate:
+            server.stats.record(429, latency=time.perf_counter() - started)
+            self.send_json(429, {"message": "Too many requests"}, {"Retry-After": str(server.retry_after)})
+            return
+        if server.error_rate and random.random() < server.error_rate:
+            server.stats.record(503, latency=time.perf_counter() - started)
+            self.send_json(503, {"message": "Service unavailable"})
+            return
+
+        try:
+            request = json.loads(body)
+        except ValueError:
+            server.stats.record(400)
+            self.send_json(400, {"errors": [{"message": "Request body is not JSON"}]})
+            return
+
+        document = request.get("query")
+        persisted = (request.get("extensions") or {}).get("persistedQuery")
+        if persisted:
+            sha256 = persisted.get("sha256Hash")
+            if document:
+                if query_hash(document) != sha256:
+                    server.stats.record(400)
+                    self.send_json(400, {"errors": [{"message": "provided sha does not match query"}]})
+                    return
+                server.persisted_queries[sha256] = document
+            else:
+                document = server.persisted_queries.get(sha256)
+                server.stats.record_persisted(document is not None)
+                if document is None:
+                    server.stats.record(200, latency=time.perf_counter() - started)
+                    self.send_json(200, {"errors": [{"message": NOT_FOUND,
+                                                     "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"}}]})
+                    return
+
+        response, fields = execute(document or "", request.get("variables") or {}, server.resolvers)
+        server.stats.record(200, fields, time.perf_counter() - started)
+        self.send_json(200, response)
+
+
+def start_server(catalog=None, host="127.0.0.1", port=0, **faults):
+    """Start a MockServer on a background thread and return it. Use server.endpoint to reach it."""
+    server = MockServer((host, port), catalog or Catalog(), **faults)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a synthetic Genesis GraphQL API locally.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--foods", type=int, default=DEFAULT_FOODS, help="Number of foods in the catalog")
+    parser.add_argument("--recipe-ratio", type=float, default=DEFAULT_RECIPE_RATIO, help="Share of foods that are recipes")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra random seconds per request")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--persisted-queries", help="A persisted query manifest to load at start")
+    args = parser.parse_args(argv)
+
+    catalog = Catalog(args.foods, args.recipe_ratio, args.seed)
+    persisted_queries = load_manifest(args.persisted_queries) if args.persisted_queries else None
+    server = MockServer((args.host, args.port), catalog, latency=args.latency, jitter=args.jitter,
+                        throttle_rate=args.throttle_rate, retry_after=args.retry_after, error_rate=args.error_rate,
+                        persisted_queries=persisted_queries)
+    print(f"Serving {len(catalog.ingredients)} ingredients and {len(catalog.recipes)} recipes at {server.endpoint}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Compact record types for the foods the export scripts read and write.
+
+Responses are decoded once into small __slots__ classes, and export rows are stored as a
+plain list of values in column order, instead of keeping nested response dicts and a
+~30-key dict per row around.
+"""
+
+from types import MappingProxyType
+
+from logging_config import get_logger
+
+logger = get_logger()
+
+
+def dig(data, *path):
+    """Follow keys through nested response dicts, returning None if any of them is missing or null."""
+    for key in path:
+        if not data:
+            return None
+        data = data.get(key)
+    return data
+
+
+def user_code(custom_fields):
+    """Return the value of the 'User Code' custom field, or ""."""
+    return next((cf.get('value') for cf in custom_fields or [] if dig(cf, 'customField', 'name') == 'User Code'), "")
+
+
+def blank(value):
+    """Return "" for a missing (None) value, so 0 and False are kept."""
+    return "" if value is None else value
+
+
+def as_dict(record):
+    """Return a record as a dict, for writers that accept both dicts and the classes below."""
+    return record if isinstance(record, dict) else record.as_dict()
+
+
+class SearchResult:
+    """A foodSearchResult: the id, name and modified date of a food."""
+
+    __slots__ = ("id", "name", "modified")
+
+    def __init__(self, id, name, modified=None):
+        self.id = id
+        self.name = name
+        self.modified = modified
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data.get('id'), data.get('name'), data.get('modified'))
+
+    def as_dict(self):
+        return {"id": self.id, "name": self.name, "modified": self.modified}
+
+
+class NutrientInfo:
+    """One nutrient value of an analysis."""
+
+    __slots__ = ("id", "name", "value")
+
+    def __init__(self, id, name, value):
+        self.id = id
+        self.name = name
+        self.value = value
+
+    @classmethod
+    def decode_all(cls, nutrient_infos, wanted=None):
+        """
+        Decode the nutrientInfos list of an analysis.
+
+        Args:
+            nutrient_infos: The nutrientInfos of the response.
+            wanted: Optional collection of nutrient ids and names (see NutrientProjection.wanted).
+                Nutrients matching neither are skipped without being decoded.
+        """
+        decoded = []
+        for n in nutrient_infos or []:
+            nutrient = n.get('nutrient') or {}
+            if wanted is None or nutrient.get('id') in wanted or nutrient.get('name') in wanted:
+                decoded.append(cls(nutrient.get('id'), nutrient.get('name'), n.get('value')))
+        return decoded
+
+
+class RecipeItem:
+    """One ingredient line of a recipe."""
+
+    __slots__ = ("food_id", "name", "usercode", "measure", "quantity")
+
+    def __init__(self, food_id, name, usercode, measure, quantity):
+        self.food_id = food_id
+        self.name = name
+        self.usercode = usercode
+        self.measure = measure
+        self.quantity = quantity
+
+    @classmethod
+    def from_json(cls, item):
+        food = item.get('food') or {}
+        return cls(food.get('id'), food.get('name'), user_code(food.get('customFields')),
+                   dig(item, 'amount', 'unit', 'name'), dig(item, 'amount', 'quantity', 'value'))
+
+
+class FoodDetails:
+    """The exported details of a food from foods.get, already flattened to column values."""
+
+    __slots__ = ("usercode", "cost", "amount", "sub_ingredients", "cook_method", "cook_time",
+                 "cook_temperature", "instructions", "pan_size", "preparation_time",
+                 "ingredient_statement", "allergen_statement", "voluntary_statement", "notes", "items")
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name, [] if name == "items" else ""))
+
+    @classmethod
+    def from_json(cls, food):
+        """Decode the food of a foods.get response. An empty or missing food decodes to empty details."""
+        if not food:
+            return cls()
+
+        amount_cost = food.get('amountCost') or {}
+        amount = ""
+        if amount_cost:
+            # Combine amount value and unit into single column
+            amount_value = dig(amount_cost, 'amount', 'quantity', 'value') or ''
+            amount_unit = dig(amount_cost, 'amount', 'unit', 'name') or ''
+            amount = f"{amount_value} {amount_unit}".strip()
+
+        return cls(
+            usercode=user_code(food.get('customFields')),
+            cost=blank(amount_cost.get('cost')),
+            amount=amount,
+            sub_ingredients=','.join(sub.get('name') or '' for sub in food.get('subIngredients') or []),
+            cook_method=blank(food.get('cookMethod')),
+            cook_time=blank(food.get('cookTime')),
+            cook_temperature=blank(food.get('cookTemperature')),
+            instructions=blank(food.get('instructions')),
+            pan_size=blank(food.get('panSize')),
+            preparation_time=blank(food.get('preparationTime')),
+            ingredient_statement=dig(food, 'unitedStates2016IngredientStatement', 'englishStatement',
+                                     'generatedStatement') or '',
+            allergen_statement=dig(food, 'unitedStates2016AllergenStatement', 'englishStatements', 'statement') or '',
+            voluntary_statement=dig(food, 'unitedStates2016AllergenStatement', 'englishStatements',
+                                    'voluntaryStatement') or '',
+            notes='|'.join(note.get('text') or '' for note in food.get('notes') or []),
+            items=[RecipeItem.from_json(item) for item in food.get('items') or []]
+        )
+
+
+class Row:
+    """
+    An export row, stored as a list of values in the order of its schema's fields.
+
+    Use Row.schema() to make a row class for a set of CSV columns. Values are set and read
+    by column name; a column that is never set is written as "".
+    """
+
+    __slots__ = ("values",)
+    fields = ()
+    index = {}
+
+    def __init__(self, values=None):
+        self.values = values if values is not None else [""] * len(self.fields)
+
+    @classmethod
+    def schema(cls, name, fields):
+        """Return a Row subclass for the given columns."""
+        fields = tuple(fields)
+        return type(name, (cls,), {"__slots__": (), "fields": fields,
+                                   "index": {field: i for i, field in enumerate(fields)}})
+
+    def __getitem__(self, field):
+        return self.values[self.index[field]]
+
+    def __setitem__(self, field, value):
+        self.values[self.index[field]] = value
+
+    def __contains__(self, field):
+        return field in self.index
+
+    def get(self, field, default=None):
+        i = self.index.get(field)
+        return default if i is None else self.values[i]
+
+    def as_dict(self):
+        return dict(zip(self.fields, self.values))
+
+
+class NutrientProjection:
+    """
+    A fixed map from nutrient id to the row column the nutrient's value is written to.
+
+    It is built once per row type from the nutrient column names and their ids (e.g.
+    constants.NUTRIENTS), so each nutrient of an analysis costs one dict lookup and its
+    value goes straight into the row's slot. Nutrients are matched by their stable id;
+    a column whose name has no known id falls back to matching by display name.
+    """
+
+    __slots__ = ("by_id", "by_name", "wanted", "columns")
+
+    def __init__(self, row_type, names, ids):
+        by_id = {}
+        by_name = {}
+        for name in names:
+            if name in ids:
+                by_id[ids[name]] = row_type.index[name]
+            else:
+                logger.warning(f"No nutrient id known for '{name}', matching it by name")
+                by_name[name] = row_type.index[name]
+        self.by_id = MappingProxyType(by_id)
+        self.by_name = MappingProxyType(by_name)
+        # Ids and names worth decoding from a response
+        self.wanted = frozenset(by_id) | frozenset(by_name)
+        # (nutrient id or None, name, row column) of each projected nutrient, in the order given
+        self.columns = tuple((ids.get(name), name, row_type.index[name]) for name in names)
+
+    def apply(self, row, nutrients):
+        """Write the values of the projected NutrientInfos into the row."""
+        values = row.values
+        by_id = self.by_id
+        by_name = self.by_name
+        for n in nutrients:
+            column = by_id.get(n.id)
+            if column is None and by_name:
+                column = by_name.get(n.name)
+            if column is not None:
+                values[column] = n.value
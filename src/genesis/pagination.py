@@ -0,0 +1,248 @@
+import math
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from client import run_query
+from logging_config import get_logger
+from profiling import span
+from response_cache import parse_timestamp
+
+logger = get_logger()
+
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_WORKERS = 8
+
+
+class IncompleteSearchError(RuntimeError):
+    """A search stopped short because one of its pages could not be fetched."""
+
+
+class SearchResults:
+    """
+    The foodSearchResults of a foods.search query, fetched one page at a time.
+
+    total_count is known as soon as the first page has arrived. Iterating yields each
+    foodSearchResult in order and requests the next page only when the current one is
+    used up, so callers can start on the first results before the search is finished.
+    The results can only be iterated once. If a later page cannot be fetched, iterating
+    raises IncompleteSearchError rather than ending early.
+    """
+
+    def __init__(self, total_count, results):
+        self.total_count = total_count
+        self._results = results
+
+    def __iter__(self):
+        return self._results
+
+
+def fetch_search_page(graphql_query, variables):
+    """Run one foods.search page and return its search object, or None on failure."""
+    with span("search page", after=variables["input"].get("after")):
+        result = run_query(graphql_query, variables)
+    if result is None:
+        return None
+
+    search = ((result.get("data") or {}).get("foods") or {}).get("search")
+    if search is None:
+        logger.error(f"Search returned no data: {result.get('errors')}")
+    return search
+
+
+def _iter_search_results(graphql_query, variables, search, limit):
+    """Yield the foodSearchResults of each page, following endCursor until the last page."""
+    yielded = 0
+    while True:
+        for food in search.get("foodSearchResults") or []:
+            if limit and yielded >= limit:
+                logger.info(f"Stopping after {limit} results (limit reached).")
+                return
+            yield food
+            yielded += 1
+
+        page_info = search.get("pageInfo") or {}
+        if not page_info.get("hasNextPage"):
+            return
+
+        variables["input"]["after"] = page_info.get("endCursor")
+        search = fetch_search_page(graphql_query, variables)
+        if search is None:
+            raise IncompleteSearchError(f"Failed to fetch the next search page after {yielded} results")
+
+
+def paginate_search(graphql_query, variables, page_size=DEFAULT_PAGE_SIZE, limit=None):
+    """
+    Run a foods.search query and page through all of its results.
+
+    Args:
+        graphql_query: A foods.search query that selects foodSearchResults, totalCount and pageInfo.
+        variables: The query variables. The first/after values of the input are managed here.
+        page_size: Number of results requested per page.
+        limit: Optional maximum number of results to yield. If None or 0, yield all results.
+
+    Returns:
+        A SearchResults, or None if the first page could not be fetched. Iterating it raises
+        IncompleteSearchError if a later page cannot be fetched.
+    """
+    variables = dict(variables)
+    variables["input"] = dict(variables["input"], first=page_size, after=0)
+
+    search = fetch_search_page(graphql_query, variables)
+    if search is None:
+        return None
+
+    return SearchResults(search.get("totalCount", 0), _iter_search_results(graphql_query, variables, search, limit))
+
+
+class Window:
+    """A modifiedAfter/modifiedBefore range of a search, in epoch seconds, and its totalCount."""
+
+    __slots__ = ("after", "before", "count")
+
+    def __init__(self, after, before, count=None):
+        self.after = after
+        self.before = before
+        self.count = count
+
+    def __repr__(self):
+        return f"Window({timestamp(self.after)}, {timestamp(self.before)}, {self.count})"
+
+    def split(self):
+        """
+        Halve the window. The halves overlap by a second, so a food modified exactly at the
+        midpoint is found whether the API's bounds are exclusive or inclusive.
+        """
+        middle = (self.after + self.before) // 2
+        return Window(self.after, middle + 1), Window(middle, self.before)
+
+    def variables(self, variables):
+        return dict(variables, input=dict(variables["input"], modifiedAfter=timestamp(self.after),
+                                          modifiedBefore=timestamp(self.before)))
+
+
+def timestamp(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def count_window(graphql_query, variables, window):
+    """Set the window's count from a one-result search. Return False if the search failed."""
+    search = fetch_search_page(graphql_query, window.variables(
+        dict(variables, input=dict(variables["input"], first=1, after=0))))
+    if search is None:
+        return False
+    window.count = search.get("totalCount", 0)
+    return True
+
+
+def plan_windows(graphql_query, variables, target, workers=DEFAULT_WORKERS):
+    """
+    Split the modified date range of a search into windows of at most `target` results.
+
+    The range of the input's modifiedAfter/modifiedBefore (or the epoch to now) is bisected
+    until every window's totalCount is at most `target`, counting all windows of a level in
+    parallel. Empty windows are dropped. A window only a second or two wide cannot be split
+    further and is kept even if it is larger.
+
+    Returns:
+        (total_count, windows) with the windows in chronological order, or None if a count failed.
+    """
+    search_input = variables["input"]
+    after = math.floor(parse_timestamp(search_input["modifiedAfter"])) if search_input.get("modifiedAfter") else 0
+    before = math.ceil(parse_timestamp(search_input["modifiedBefore"])) if search_input.get("modifiedBefore") \
+        else math.ceil(time.time()) + 1
+
+    root = Window(after, before)
+    plan = [root]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            pending = [window for window in plan if window.count is None]
+            if not pending:
+                break
+            if not all(executor.map(lambda window: count_window(graphql_query, variables, window), pending)):
+                logger.error("Failed to count the results of a search window.")
+                return None
+
+            next_plan = []
+            for window in plan:
+                if window.count is None or window.count <= target:
+                    next_plan.append(window)
+                elif window.before - window.after > 2:
+                    next_plan.extend(window.split())
+                else:
+                    logger.warning(f"{window.count} results were modified in {window}, which cannot be split further.")
+                    next_plan.append(window)
+            plan = [window for window in next_plan if window.count != 0]
+
+    logger.info(f"Split the search for {root.count} results into {len(plan)} windows of at most {target}.")
+    return root.count, plan
+
+
+def fetch_window(graphql_query, variables, window, page_size):
+    """Return all the foodSearchResults of a window. Raises IncompleteSearchError if its search fails."""
+    result = paginate_search(graphql_query, window.variables(variables), page_size)
+    if result is None:
+        raise IncompleteSearchError(f"Failed to search {window}")
+    return list(result)
+
+
+def _iter_windows(graphql_query, variables, windows, page_size, workers, limit):
+    """Yield the results of each window in window order, fetching up to `workers` windows ahead."""
+    seen = set()
+    yielded = 0
+    windows = iter(windows)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+
+        def submit():
+            window = next(windows, None)
+            if window is not None:
+                pending.append(executor.submit(fetch_window, graphql_query, variables, window, page_size))
+
+        for _ in range(workers):
+            submit()
+        while pending:
+            foods = pending.popleft().result()
+            submit()
+            for food in foods:
+                # Foods on a window boundary, or modified during the search, can turn up twice
+                food_id = food.get("id")
+                if food_id in seen:
+                    continue
+                seen.add(food_id)
+                if limit and yielded >= limit:
+                    logger.info(f"Stopping after {limit} results (limit reached).")
+                    return
+                yield food
+                yielded += 1
+
+
+def windowed_search(graphql_query, variables, page_size=DEFAULT_PAGE_SIZE, limit=None, target=None,
+                    workers=DEFAULT_WORKERS):
+    """
+    Run a foods.search query as parallel searches over modified date windows.
+
+    Instead of following one cursor chain through the whole result set, the modified date
+    range is split by plan_windows() into windows of at most `target` results (page_size by
+    default), which are fetched `workers` at a time. No single search goes deep enough to
+    hit the API's result cap. Results are yielded in window order, oldest first, without
+    duplicates.
+
+    Args:
+        graphql_query: A foods.search query that selects foodSearchResults, totalCount and pageInfo.
+        variables: The query variables. modifiedAfter/modifiedBefore, if given, bound the windows.
+        page_size: Number of results requested per page.
+        limit: Optional maximum number of results to yield. If None or 0, yield all results.
+        target: The most results a window may have.
+        workers: Number of searches run at once.
+
+    Returns:
+        A SearchResults, or None if the windows could not be planned. Iterating it raises
+        IncompleteSearchError if the search of a window fails.
+    """
+    planned = plan_windows(graphql_query, variables, target or page_size, workers)
+    if planned is None:
+        return None
+    total_count, windows = planned
+    return SearchResults(total_count, _iter_windows(graphql_query, variables, windows, page_size, workers, limit))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Automatic persisted queries (APQ) for the Genesis API client.
+
+With `persisted_queries = true` in the [api] section of config.ini, client.run_query()
+sends the sha256 hash of a document in the persistedQuery extension instead of the
+document itself. A server that does not have the document yet answers
+PersistedQueryNotFound, and the request is sent again with the text. The server keeps the
+text under its hash, so later requests for the same document send the hash only. If
+the server does not support persisted queries, they are turned off for the rest of the
+process.
+
+registry() collects the GraphQL documents defined in the five scripts, so a server can
+load them ahead of time as a persisted query manifest:
+
+    python persisted_queries.py --output persisted_queries.json
+
+A script whose documents are built at run time lists them in a persisted_documents()
+function. export_to_csv returns its batched and combined queries for every batch size up
+to the configured batch_size, so the manifest must be written with the config.ini the
+exports run with. Any other document is persisted the first time it is sent.
+"""
+
+import argparse
+import functools
+import hashlib
+import importlib
+import json
+import re
+import sys
+
+from metrics import operation_name
+
+VERSION = 1
+NOT_FOUND = "PersistedQueryNotFound"
+NOT_SUPPORTED = "PersistedQueryNotSupported"
+ERROR_CODES = {"PERSISTED_QUERY_NOT_FOUND": NOT_FOUND, "PERSISTED_QUERY_NOT_SUPPORTED": NOT_SUPPORTED}
+MANIFEST_FORMAT = "apollo-persisted-query-manifest"
+SCRIPTS = ["export_to_csv", "bulk_download", "import_from_csv", "build_upload", "bulk_create_label"]
+
+DOCUMENT_RE = re.compile(r"\s*(query|mutation)\b")
+
+
+@functools.lru_cache(maxsize=1024)
+def query_hash(document):
+    """Return the sha256 hash of a document, as hex."""
+    return hashlib.sha256(document.encode("utf-8")).hexdigest()
+
+
+def extensions(document):
+    """Return the request extensions that refer to a document by its hash."""
+    return {"persistedQuery": {"version": VERSION, "sha256Hash": query_hash(document)}}
+
+
+def persisted_query_error(result):
+    """Return NOT_FOUND or NOT_SUPPORTED if a response rejected a persisted query, otherwise None."""
+    for error in (result or {}).get("errors") or []:
+        message = error.get("message")
+        if message in (NOT_FOUND, NOT_SUPPORTED):
+            return message
+        code = ERROR_CODES.get((error.get("extensions") or {}).get("code"))
+        if code:
+            return code
+    return None
+
+
+def registry(scripts=SCRIPTS):
+    """
+    Return {hash: document} for every query and mutation defined at the top level of the
+    scripts, plus the documents their persisted_documents() functions build.
+    """
+    documents = {}
+    for script in scripts:
+        module = importlib.import_module(script)
+        values = list(vars(module).values())
+        if hasattr(module, "persisted_documents"):
+            values += module.persisted_documents()
+        for value in values:
+            if isinstance(value, str) and DOCUMENT_RE.match(value):
+                documents[query_hash(value)] = value
+    return documents
+
+
+def manifest(documents):
+    """Return the documents as a persisted query manifest."""
+    return {
+        "format": MANIFEST_FORMAT,
+        "version": VERSION,
+        "operations": [
+            {"id": sha256, "name": operation_name(document), "type": DOCUMENT_RE.match(document).group(1),
+             "body": document}
+            for sha256, document in documents.items()
+        ]
+    }
+
+
+def load_manifest(path):
+    """Read a persisted query manifest and return {hash: document}, checking every hash."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    documents = {}
+    for operation in data.get("operations", []):
+        if query_hash(operation["body"]) != operation["id"]:
+            raise ValueError(f"The hash of operation {operation.get('name')} in {path} does not match its body")
+        documents[operation["id"]] = operation["body"]
+    return documents
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the GraphQL documents of the scripts as a persisted query manifest.")
+    parser.add_argument("--output", help="Write the manifest to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    text = json.dumps(manifest(registry()), indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
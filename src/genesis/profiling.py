@@ -0,0 +1,220 @@
+"""
+Opt-in profiling for the playground scripts.
+
+Turn it on with the GENESIS_PROFILE environment variable or `enabled = true` in the
+[profiling] section of config.ini. GENESIS_PROFILE can be 1 (the configured modes) or a
+comma separated list of modes:
+
+    trace     Tracing spans around the main stages (search pages, enrichment, run_query,
+              JSON decoding, archive and CSV writes), written as a Chrome trace that opens
+              in https://ui.perfetto.dev or chrome://tracing.
+    sample    A sampling profiler that records the stacks of every thread every
+              sample_interval seconds, written in the folded format read by speedscope and
+              flamegraph.pl.
+    cprofile  cProfile for the main thread, written as a pstats file.
+
+When profiling is off, span() and traced() cost a single check.
+"""
+
+import atexit
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+from logging_config import get_logger
+from settings import get_config
+
+logger = get_logger()
+
+DEFAULT_MODES = ("trace", "sample")
+DEFAULT_TRACE_FILE = "genesis_trace.json"
+DEFAULT_SAMPLE_FILE = "genesis_profile.folded"
+DEFAULT_CPROFILE_FILE = "genesis_profile.pstats"
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+_NO_SPAN = contextlib.nullcontext()
+_tracer = None
+_started = False
+_lock = threading.Lock()
+
+
+class Tracer:
+    """Collects complete ("X") events in the Chrome trace event format."""
+
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self.thread_names = {}
+        self.pid = os.getpid()
+        self.origin = time.perf_counter_ns()
+        self._lock = threading.Lock()
+
+    def now(self):
+        """Microseconds since the tracer started."""
+        return (time.perf_counter_ns() - self.origin) / 1000
+
+    def add(self, name, start, end, args):
+        thread = threading.current_thread()
+        event = {"name": name, "ph": "X", "ts": start, "dur": end - start, "pid": self.pid, "tid": thread.ident}
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+            if thread.ident not in self.thread_names:
+                self.thread_names[thread.ident] = thread.name
+
+    def write(self):
+        metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                    for tid, name in self.thread_names.items()]
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}, f)
+        logger.info(f"Wrote {len(self.events)} trace spans to {self.path}")
+
+
+class Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = self.tracer.now()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.add(self.name, self.start, self.tracer.now(), self.args)
+
+
+def span(name, **args):
+    """Return a context manager that records a tracing span, or does nothing when tracing is off."""
+    tracer = _tracer
+    if tracer is None:
+        return _NO_SPAN
+    return Span(tracer, name, args)
+
+
+def traced(name):
+    """Decorate a function so each call is recorded as a span."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with Span(_tracer, name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class Sampler:
+    """
+    A statistical profiler: a background thread that samples the stack of every other
+    thread at a fixed interval and counts identical stacks.
+    """
+
+    def __init__(self, path, interval=DEFAULT_SAMPLE_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    @staticmethod
+    def frame_name(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self.frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        with open(self.path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f"{stack} {count}\n")
+        logger.info(f"Wrote {self.samples} profile samples to {self.path}")
+
+
+def profile_modes(config):
+    """Return the profiling modes turned on by GENESIS_PROFILE or config.ini, or an empty tuple."""
+    configured = tuple(m.strip() for m in config.get('profiling', 'modes', fallback=",".join(DEFAULT_MODES))
+                       .split(",") if m.strip())
+    value = os.environ.get("GENESIS_PROFILE", "").strip().lower()
+    if value in ("0", "false", "no", "off"):
+        return ()
+    if value in ("1", "true", "yes", "on"):
+        return configured
+    if value:
+        return tuple(m.strip() for m in value.split(",") if m.strip())
+    return configured if config.getboolean('profiling', 'enabled', fallback=False) else ()
+
+
+def start():
+    """
+    Start the profiling modes that are turned on, if any, for the rest of the process.
+
+    Call it once at the start of a script. The profiles are written when the process exits.
+    """
+    global _tracer, _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+
+    config = get_config()
+    modes = profile_modes(config)
+    unknown = set(modes) - {"trace", "sample", "cprofile"}
+    if unknown:
+        logger.warning(f"Ignoring unknown profiling modes: {', '.join(sorted(unknown))}")
+    if not set(modes) - unknown:
+        return
+    logger.info(f"Profiling enabled: {', '.join(modes)}")
+
+    if "trace" in modes:
+        _tracer = Tracer(config.get('profiling', 'trace_file', fallback=DEFAULT_TRACE_FILE))
+        atexit.register(_tracer.write)
+
+    if "sample" in modes:
+        sampler = Sampler(config.get('profiling', 'sample_file', fallback=DEFAULT_SAMPLE_FILE),
+                          config.getfloat('profiling', 'sample_interval', fallback=DEFAULT_SAMPLE_INTERVAL))
+        sampler.start()
+        atexit.register(sampler.stop)
+
+    if "cprofile" in modes:
+        profiler = cProfile.Profile()
+        path = config.get('profiling', 'cprofile_file', fallback=DEFAULT_CPROFILE_FILE)
+
+        def write_profile():
+            profiler.disable()
+            profiler.dump_stats(path)
+            logger.info(f"Wrote cProfile stats to {path}")
+
+        profiler.enable()
+        atexit.register(write_profile)
@@ -0,0 +1,48 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket shared by every request the client sends.
+
+    Tokens refill at `rate` per second up to `capacity`, and each request takes one, so
+    bursts of up to `capacity` requests go out immediately and the long-run request rate
+    stays at `rate`. A rate of 0 disables the limit. pause() holds every caller back,
+    for example while the server has asked us to wait with Retry-After.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.rate <= 0:
+                    return
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back all callers for `seconds`, then resume with an empty bucket."""
+        with self.lock:
+            resume_at = time.monotonic() + seconds
+            if resume_at > self.paused_until:
+                self.paused_until = resume_at
+                self.tokens = 0
+                self.updated = resume_at
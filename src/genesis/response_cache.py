@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from logging_config import get_logger
+
+logger = get_logger()
+
+DEFAULT_TTL = 86400
+DEFAULT_MAX_BYTES = 500000000
+
+
+def parse_timestamp(value):
+    """Convert an API timestamp such as 2024-01-31T12:00:00.1234567Z to epoch seconds."""
+    value = value.strip().replace("Z", "+00:00")
+    # fromisoformat only accepts up to six fractional digits before Python 3.11
+    value = re.sub(r"(\.\d{6})\d+", r"\1", value)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class ResponseCache:
+    """
+    A persistent on-disk cache for the results of read-only queries.
+
+    Entries are keyed by a sha256 of the query text and its canonical JSON variables and
+    kept in a SQLite file. An entry expires `ttl` seconds after it was stored, and the
+    least recently used entries are evicted once the cache grows past `max_bytes`.
+    Entries can be tagged with a food id, so they can be dropped as soon as a search
+    shows the food was modified after they were stored.
+
+    Nothing touches the disk until the cache is first used.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(graphql_query, variables):
+        """Return the cache key for a query and its variables."""
+        digest = hashlib.sha256(graphql_query.encode("utf-8"))
+        digest.update(json.dumps(variables, sort_keys=True, separators=(',', ':')).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    food_id TEXT,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_food_id ON entries (food_id)")
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+            connection.commit()
+            self.total_bytes = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            self._connection = connection
+        return self._connection
+
+    def get_many(self, keys):
+        """Return a dict of the cached values for the keys that are present and not expired."""
+        if not keys:
+            return {}
+
+        now = time.time()
+        found = {}
+        with self._lock:
+            connection = self._connect()
+            placeholders = ",".join("?" * len(keys))
+            rows = connection.execute(
+                f"SELECT key, value FROM entries WHERE key IN ({placeholders}) AND stored_at > ?",
+                (*keys, now - self.ttl)
+            ).fetchall()
+            for key, value in rows:
+                found[key] = json.loads(value)
+            if found:
+                connection.executemany("UPDATE entries SET accessed_at = ? WHERE key = ?",
+                                       [(now, key) for key in found])
+                connection.commit()
+        return found
+
+    def put_many(self, entries):
+        """Store (key, value, food_id) entries, evicting the least recently used if needed."""
+        if not entries:
+            return
+
+        now = time.time()
+        rows = []
+        for key, value, food_id in entries:
+            encoded = json.dumps(value, separators=(',', ':'))
+            rows.append((key, food_id, encoded, len(encoded), now, now))
+
+        with self._lock:
+            connection = self._connect()
+            keys = [row[0] for row in rows]
+            placeholders = ",".join("?" * len(keys))
+            replaced = connection.execute(
+                f"SELECT COALESCE(SUM(size), 0) FROM entries WHERE key IN ({placeholders})", keys
+            ).fetchone()[0]
+            connection.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.total_bytes += sum(row[3] for row in rows) - replaced
+            if self.total_bytes > self.max_bytes:
+                self._evict(connection)
+            connection.commit()
+
+    def _evict(self, connection):
+        """Delete expired entries, then the least recently used, until under max_bytes."""
+        connection.execute("DELETE FROM entries WHERE stored_at <= ?", (time.time() - self.ttl,))
+        self.total_bytes = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+        # Evict down to 90% so we do not have to evict again on the next insert
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for key, size in connection.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+            if self.total_bytes <= target:
+                break
+            connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.total_bytes -= size
+            evicted += 1
+        if evicted:
+            logger.info(f"Evicted {evicted} entries from the response cache")
+
+    def invalidate_food(self, food_id, modified):
+        """Drop the entries for a food that were stored before its `modified` timestamp."""
+        try:
+            modified_at = parse_timestamp(modified)
+        except ValueError:
+            logger.warning(f"Unable to parse modified date '{modified}' for {food_id}")
+            return
+
+        with self._lock:
+            connection = self._connect()
+            removed = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries WHERE food_id = ? AND stored_at < ?",
+                (food_id, modified_at)
+            ).fetchone()[0]
+            if removed:
+                connection.execute("DELETE FROM entries WHERE food_id = ? AND stored_at < ?", (food_id, modified_at))
+                connection.commit()
+                self.total_bytes -= removed
+
+    def close(self):
+        """Close the cache file."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,85 @@
+"""
+The smallest foods.get query for a set of export columns.
+
+Each column the export scripts fill from foods.get is mapped to the fields it is read
+from (see models.FoodDetails and models.RecipeItem). food_document() merges the fields of
+the requested columns into one selection set for a food type, so a run fetches only what
+it writes: an ingredient export never asks for recipe items or statements, and a recipe
+items export asks for nothing but the items. Columns that come from the search or the
+analysis (id, name, modified, the nutrients) need no foods.get fields.
+"""
+
+# column: (the fragment type the fields are on, or None for fields of every food, field paths)
+FOOD_COLUMNS = {
+    "usercode": (None, ["customFields.value", "customFields.customField.name"]),
+    "cost": (None, ["amountCost.cost"]),
+    "amount": (None, ["amountCost.amount.quantity.value", "amountCost.amount.unit.name"]),
+    "notes": (None, ["notes.text"]),
+    "subIngredients": ("Ingredient", ["subIngredients.name"]),
+    "cookMethod": ("Recipe", ["cookMethod"]),
+    "cookTime": ("Recipe", ["cookTime"]),
+    "cookTemperature": ("Recipe", ["cookTemperature"]),
+    "instructions": ("Recipe", ["instructions"]),
+    "panSize": ("Recipe", ["panSize"]),
+    "preparationTime": ("Recipe", ["preparationTime"]),
+    "ingredientStatement": ("Recipe", ["unitedStates2016IngredientStatement.englishStatement.generatedStatement"]),
+    "allergenStatement": ("Recipe", ["unitedStates2016AllergenStatement.englishStatements.statement"]),
+    "voluntaryStatement": ("Recipe", ["unitedStates2016AllergenStatement.englishStatements.voluntaryStatement"]),
+    "item_usercode": ("Recipe", ["items.food.customFields.value", "items.food.customFields.customField.name"]),
+    "item_id": ("Recipe", ["items.food.id"]),
+    "item_name": ("Recipe", ["items.food.name"]),
+    "item_amount_measure": ("Recipe", ["items.amount.unit.name"]),
+    "item_amount_quantity": ("Recipe", ["items.amount.quantity.value"]),
+}
+
+
+def food_selection(columns, food_type):
+    """
+    Return the selection set of `food` needed for the columns of a food type.
+
+    Args:
+        columns: The export columns, e.g. export_to_csv.recipe_fields. Unknown columns are ignored.
+        food_type: "Recipe" or "Ingredient". Fields of the other type's fragment are left out.
+
+    Returns:
+        A nested dict of field names; fields without a selection map to an empty dict.
+    """
+    fragment = f"... on {food_type}"
+    # The id keeps the selection valid when no column needs anything from foods.get
+    selection = {fragment: {"id": {}}}
+    for column in columns:
+        on_type, paths = FOOD_COLUMNS.get(column, (None, ()))
+        if on_type is not None and on_type != food_type:
+            continue
+        for path in paths:
+            node = selection[fragment] if on_type else selection
+            for field in path.split("."):
+                node = node.setdefault(field, {})
+    return selection
+
+
+def render(selection, indent=1):
+    """Render a nested selection dict as GraphQL, one field per line."""
+    padding = "    " * indent
+    lines = []
+    for field, fields in selection.items():
+        if fields:
+            lines.append(f"{padding}{field} {{\n{render(fields, indent + 1)}\n{padding}}}")
+        else:
+            lines.append(f"{padding}{field}")
+    return "\n".join(lines)
+
+
+def food_document(columns, food_type):
+    """Return a foods.get query that selects only what the columns of a food type need."""
+    return f"""
+query($input: GetFoodInput!){{
+    foods{{
+        get(input: $input){{
+            food{{
+{render(food_selection(columns, food_type), 4)}
+            }}
+        }}
+    }}
+}}
+"""
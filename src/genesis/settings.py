@@ -0,0 +1,34 @@
+"""
+Access to config.ini, read on first use.
+
+The scripts and library modules only read the configuration when a setting is first
+needed, so importing them reads no files. Output files are only touched by each script's
+main().
+"""
+
+import configparser
+import threading
+
+CONFIG_FILE = 'config.ini'
+
+_config = None
+_lock = threading.Lock()
+
+
+def get_config():
+    """Return config.ini as a ConfigParser, reading it on first use."""
+    global _config
+    if _config is None:
+        with _lock:
+            if _config is None:
+                config = configparser.ConfigParser()
+                config.read(CONFIG_FILE)
+                _config = config
+    return _config
+
+
+def reset():
+    """Forget the configuration read so far, so the next get_config() reads config.ini again."""
+    global _config
+    with _lock:
+        _config = None
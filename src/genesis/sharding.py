@@ -0,0 +1,119 @@
+"""
+Splitting one job over several processes or machines.
+
+Run N copies of a script with --shard 1/N ... --shard N/N. Each copy keeps only its share
+of the foods, chosen by a stable hash of the food id (or, for CSV input, a contiguous
+range of rows), and writes its output files with a shard suffix, e.g.
+ingredients.shard-2-of-4.csv. Once every shard has finished, merge_csv() and
+merge_files() combine the shard outputs, always in shard order, so the merged files are
+the same however the shards were scheduled.
+"""
+
+import argparse
+import csv
+import os
+import shutil
+import zlib
+
+from logging_config import get_logger
+
+logger = get_logger()
+
+
+class Shard:
+    """One of `count` shards, numbered from 1."""
+
+    __slots__ = ("index", "count")
+
+    def __init__(self, index, count):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError(f"Shard {index}/{count} is out of range; use i/N with 1 <= i <= N")
+        self.index = index
+        self.count = count
+
+    def __repr__(self):
+        return f"{self.index}/{self.count}"
+
+    def owns(self, food_id):
+        """Return True if the food with this id belongs to this shard."""
+        return zlib.crc32(str(food_id).encode("utf-8")) % self.count == self.index - 1
+
+    def filter(self, items, key=lambda item: item.id):
+        """Yield the items that belong to this shard."""
+        for item in items:
+            if self.owns(key(item)):
+                yield item
+
+    def row_range(self, total):
+        """Return the [start, stop) range of rows this shard takes out of `total`."""
+        return total * (self.index - 1) // self.count, total * self.index // self.count
+
+    def path(self, path):
+        """Return the shard's name for an output file, e.g. ingredients.csv -> ingredients.shard-1-of-4.csv."""
+        return shard_path(path, self.index, self.count)
+
+
+def shard_path(path, index, count):
+    base, extension = os.path.splitext(path)
+    if extension == ".gz":
+        base, inner = os.path.splitext(base)
+        extension = inner + extension
+    return f"{base}.shard-{index}-of-{count}{extension}"
+
+
+def parse_shard(value):
+    """Parse an i/N shard argument, for use as an argparse type."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+        return Shard(index, count)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"Invalid shard '{value}': {e}") from None
+
+
+def shard_paths(path, count):
+    """Return the shard file names of an output file, in shard order, checking that they all exist."""
+    paths = [shard_path(path, index, count) for index in range(1, count + 1)]
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing:
+        raise FileNotFoundError(f"Missing shard outputs: {', '.join(missing)}")
+    return paths
+
+
+def merge_csv(path, count):
+    """
+    Concatenate the shard CSVs of `path` into `path`, in shard order.
+
+    The header is written once. Every shard must have the same columns.
+    """
+    paths = shard_paths(path, count)
+    temp_file = f"{path}.tmp"
+    rows = 0
+    with open(temp_file, "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        header = None
+        for shard_file in paths:
+            with open(shard_file, newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                shard_header = next(reader, [])
+                if header is None:
+                    header = shard_header
+                    writer.writerow(header)
+                elif shard_header != header:
+                    raise ValueError(f"{shard_file} does not have the same columns as {paths[0]}")
+                for row in reader:
+                    writer.writerow(row)
+                    rows += 1
+    os.replace(temp_file, path)
+    logger.info(f"Merged {rows} rows from {count} shards into {path}")
+
+
+def merge_files(path, count):
+    """Concatenate the shard files of `path` byte for byte, in shard order, e.g. NDJSON archives (gzip or not)."""
+    paths = shard_paths(path, count)
+    temp_file = f"{path}.tmp"
+    with open(temp_file, "wb") as out:
+        for shard_file in paths:
+            with open(shard_file, "rb") as f:
+                shutil.copyfileobj(f, out)
+    os.replace(temp_file, path)
+    logger.info(f"Merged {count} shards into {path}")
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Tests for packing single-field queries into aliased batches with batching.BatchedQuery
+and combining several of them into one request with batching.CombinedQuery.
+"""
+
+import pytest
+
+import batching
+
+food_query = """
+query($input: GetFoodInput!){
+    foods{
+        get(input: $input){
+            food{
+                id
+                name
+            }
+        }
+    }
+}
+"""
+
+
+def test_field_selection_returns_the_selection_set():
+    selection = batching.field_selection(food_query, "get")
+
+    assert selection.startswith("{")
+    assert selection.endswith("}")
+    assert "food{" in selection
+    assert "foods" not in selection
+
+
+def test_document_aliases_each_input():
+    batched = batching.BatchedQuery(food_query, "foods", "get", "GetFoodInput")
+    document = batched.document(2)
+
+    assert "query($i0: GetFoodInput!, $i1: GetFoodInput!)" in document
+    assert "f0: get(input: $i0)" in document
+    assert "f1: get(input: $i1)" in document
+
+
+def test_run_splits_inputs_and_demultiplexes_responses(monkeypatch):
+    requests_sent = []
+
+    def fake_run_query(graphql_query, variables):
+        requests_sent.append(len(variables))
+        foods = {}
+        for alias, value in variables.items():
+            # Leave one food out to check that a missing alias maps to None
+            if value["id"] != "missing":
+                foods[alias.replace("i", "f")] = {"food": {"id": value["id"]}}
+        return {"data": {"foods": foods}}
+
+    monkeypatch.setattr(batching, "run_query", fake_run_query)
+
+    batched = batching.BatchedQuery(food_query, "foods", "get", "GetFoodInput", batch_size=2)
+    payloads = batched.run([{"id": "a"}, {"id": "missing"}, {"id": "c"}])
+
+    assert requests_sent == [2, 1]
+    assert payloads == [{"food": {"id": "a"}}, None, {"food": {"id": "c"}}]
+
+
+def test_run_reports_only_failed_requests_as_failed(monkeypatch):
+    def fake_run_query(graphql_query, variables):
+        if any(value["id"] == "down" for value in variables.values()):
+            return None
+        # "missing" is answered with null and an error, like a food the API cannot find
+        return {"data": {"foods": {alias.replace("i", "f"): None if value["id"] == "missing" else {"food": value}
+                                   for alias, value in variables.items()}},
+                "errors": [{"message": "Food not found", "path": ["foods", "f1"]}]}
+
+    monkeypatch.setattr(batching, "run_query", fake_run_query)
+
+    batched = batching.BatchedQuery(food_query, "foods", "get", "GetFoodInput", batch_size=2)
+    failed = set()
+    payloads = batched.run([{"id": "a"}, {"id": "missing"}, {"id": "down"}, {"id": "d"}], failed)
+
+    assert payloads == [{"food": {"id": "a"}}, None, None, None]
+    assert failed == {2, 3}
+
+
+def test_batch_size_shrinks_to_fit_max_batch_bytes():
+    batched = batching.BatchedQuery(food_query, "foods", "get", "GetFoodInput", batch_size=50, max_batch_bytes=1000)
+    batched.item_bytes = 100
+
+    assert batched.next_batch_size() == 10
+
+
+label_query = """
+query($input: GetLabelsForFoodInput!){
+    labels{
+        getLabelsForFood(input: $input){
+            labels{
+                id
+            }
+        }
+    }
+}
+"""
+
+
+def test_combined_query_sends_every_part_in_one_request(monkeypatch):
+    requests_sent = []
+
+    def fake_run_query(graphql_query, variables):
+        requests_sent.append(graphql_query)
+        data = {"foods": {}, "labels": {}}
+        for name, value in variables.items():
+            alias = name.replace("_i", "_f")
+            if name.startswith("p0_"):
+                data["foods"][alias] = {"food": {"id": value["id"]}}
+            else:
+                data["labels"][alias] = {"labels": [{"id": f"label-{value['foodId']}"}]}
+        return {"data": data}
+
+    monkeypatch.setattr(batching, "run_query", fake_run_query)
+
+    combined = batching.CombinedQuery([
+        batching.BatchedQuery(food_query, "foods", "get", "GetFoodInput"),
+        batching.BatchedQuery(label_query, "labels", "getLabelsForFood", "GetLabelsForFoodInput")
+    ])
+    foods, labels = combined.run([[{"id": "a"}, {"id": "b"}], [{"foodId": "a"}, {"foodId": "b"}]])
+
+    assert len(requests_sent) == 1
+    assert "p0_f1: get(input: $p0_i1)" in requests_sent[0]
+    assert "p1_f0: getLabelsForFood(input: $p1_i0)" in requests_sent[0]
+    assert foods == [{"food": {"id": "a"}}, {"food": {"id": "b"}}]
+    assert labels == [{"labels": [{"id": "label-a"}]}, {"labels": [{"id": "label-b"}]}]
+
+
+def test_chunked():
+    assert list(batching.chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_map_ahead_keeps_order_and_reads_items_only_as_needed():
+    from concurrent.futures import ThreadPoolExecutor
+
+    pulled = []
+
+    def items():
+        for i in range(10):
+            pulled.append(i)
+            yield i
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results = batching.map_ahead(executor, lambda i: i * i, items(), 3)
+        assert next(results) == 0
+        assert len(pulled) == 3
+        assert list(results) == [i * i for i in range(1, 10)]
+
+
+def test_chunked_and_map_ahead_hand_over_what_was_read_before_an_error():
+    from concurrent.futures import ThreadPoolExecutor
+
+    def items():
+        yield from range(5)
+        raise RuntimeError("search page failed")
+
+    results = []
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        with pytest.raises(RuntimeError):
+            for result in batching.map_ahead(executor, sum, batching.chunked(items(), 2), 5):
+                results.append(result)
+    assert results == [1, 5, 4]
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Tests for the regression check of benchmark.py.
+"""
+
+import signal
+import sys
+
+import pytest
+
+import benchmark
+from benchmark import compare, run_script
+
+
+def test_compare_reports_wall_time_regressions():
+    previous = {"results": [{"script": "export_to_csv", "foods": 1000, "wall_time_s": 10.0},
+                            {"script": "bulk_download", "foods": 1000, "wall_time_s": 2.0}]}
+    results = [{"script": "export_to_csv", "foods": 1000, "wall_time_s": 13.0},
+               {"script": "bulk_download", "foods": 1000, "wall_time_s": 2.1},
+               {"script": "build_upload", "foods": 1000, "wall_time_s": 5.0}]
+
+    regressions = compare(results, previous, tolerance=0.2)
+
+    assert regressions == ["export_to_csv at 1000 foods: 10.0s -> 13.0s (+30%)"]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="needs POSIX signals")
+def test_run_script_reports_exit_codes_and_kills_runs_at_the_timeout(tmp_path, monkeypatch):
+    monkeypatch.setattr(benchmark, "SCRIPT_DIR", str(tmp_path))
+    (tmp_path / "export_to_csv.py").write_text("import sys, time\ntime.sleep(float(sys.stdin.read() or 0))\nsys.exit(3)\n")
+
+    monkeypatch.setitem(benchmark.STDIN, "export_to_csv", "0")
+    exit_code, wall_time, _ = run_script("export_to_csv", str(tmp_path), timeout=10)
+    assert exit_code == 3 and wall_time < 10
+
+    monkeypatch.setitem(benchmark.STDIN, "export_to_csv", "30")
+    exit_code, wall_time, _ = run_script("export_to_csv", str(tmp_path), timeout=0.5)
+    assert exit_code == -signal.SIGKILL
+    assert 0.5 <= wall_time < 10
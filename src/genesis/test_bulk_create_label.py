@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""
+Tests for the command line options of bulk_create_label.py.
+"""
+
+import pytest
+
+from bulk_create_label import parse_args
+
+
+def test_mode_all_requires_labels():
+    assert parse_args(["--mode", "all", "--labels", "US2016"]).labels == "us2016"
+    with pytest.raises(SystemExit):
+        parse_args(["--mode", "all"])
+    with pytest.raises(SystemExit):
+        parse_args(["--mode", "all", "--labels", "all", "--tags", "US"])
+
+
+def test_mode_tags_rejects_labels():
+    assert parse_args(["--mode", "tags", "--tags", "US, EU"]).tags == "US, EU"
+    with pytest.raises(SystemExit):
+        parse_args(["--mode", "tags", "--labels", "us2016"])
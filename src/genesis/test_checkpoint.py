@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Tests for the journal of finished foods in checkpoint.py and how the export stages use it.
+"""
+
+import csv
+import types
+
+import pytest
+
+import export_to_csv
+from checkpoint import Checkpoint
+from models import FoodDetails, SearchResult
+
+RESULTS = [SearchResult(food_id, f"Food {food_id}", "2024-01-01T00:00:00Z") for food_id in ("a", "b", "c")]
+
+
+@pytest.fixture
+def context(tmp_path, monkeypatch):
+    """An export context writing to tmp_path, with one batch of ingredients per lookup."""
+    context = types.SimpleNamespace(
+        checkpoint=Checkpoint(str(tmp_path / "checkpoint.sqlite")), failed=0, concurrency=2, batch_size=1,
+        file_path=str(tmp_path / "output.json"), compress_archive=False, nutrient_matrix=False,
+        ingredient_csv=str(tmp_path / "ingredients.csv"), response_cache=None)
+    monkeypatch.setattr(export_to_csv, "get_context", lambda: context)
+    yield context
+    context.checkpoint.clear()
+
+
+def lookups(monkeypatch, failing):
+    """Replace the ingredient lookups with ones that fail for the ids in `failing`; return the ids looked up."""
+    looked_up = []
+
+    def get_ingredient_data(food_ids, failed=None):
+        looked_up.extend(food_ids)
+        failed.update(food_id for food_id in food_ids if food_id in failing)
+        return [[] for _ in food_ids], [FoodDetails(usercode=food_id.upper()) for food_id in food_ids]
+
+    monkeypatch.setattr(export_to_csv, "get_ingredient_data", get_ingredient_data)
+    return looked_up
+
+
+def test_resume_replays_journaled_foods_unless_modified(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.sqlite"))
+    checkpoint.record("recipes", [({"id": "a", "modified": "2024-01-01T00:00:00Z"}, None),
+                                  ({"id": "b", "modified": "2023-01-01T00:00:00Z"}, [{"id": "b", "item": 1}])])
+
+    replayed = []
+    pending = list(checkpoint.resume("recipes", RESULTS, lambda record, rows: replayed.append(rows)))
+
+    assert [item.id for item in pending] == ["b", "c"]
+    assert replayed == [[{"id": "a", "modified": "2024-01-01T00:00:00Z"}]]
+    assert checkpoint.resumed == 1
+    checkpoint.clear()
+
+
+def test_foods_with_failed_lookups_are_not_journaled(context, monkeypatch):
+    lookups(monkeypatch, failing={"b"})
+    export_to_csv.process_ingredients(iter(RESULTS))
+    assert context.failed == 1
+
+    # The next run writes a and c from the journal and only looks up b again
+    looked_up = lookups(monkeypatch, failing=set())
+    context.failed = 0
+    export_to_csv.process_ingredients(iter(RESULTS))
+
+    assert looked_up == ["b"]
+    assert context.failed == 0 and context.checkpoint.resumed == 2
+    with open(context.ingredient_csv, newline='', encoding='utf-8') as f:
+        assert sorted(row["usercode"] for row in csv.DictReader(f)) == ["A", "B", "C"]
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Tests for the retry rules of client.run_query and the rate limit of rate_limiter.TokenBucket.
+"""
+
+import time
+
+import pytest
+import requests
+
+import client
+from metrics import Metrics
+from mock_server import Catalog, start_server
+from rate_limiter import TokenBucket
+
+QUERY = "query ($input: FoodSearchInput!) { foods { search(input: $input) { totalCount } } }"
+MUTATION = "mutation ($input: CreateFoodInput!) { foods { create(input: $input) { food { id } } } }"
+
+
+@pytest.fixture
+def use_server(monkeypatch):
+    """Point the client at a mock server started with the given faults, with 3 fast retries."""
+    servers = []
+
+    def use(**faults):
+        server = start_server(Catalog(size=10), **faults)
+        servers.append(server)
+        monkeypatch.setattr(client, "_settings", dict(client._load_settings(), endpoint=server.endpoint,
+                                                      max_retries=3, backoff_base=0.01, backoff_max=0.01,
+                                                      rate_limit=0, rate_burst=0, persisted_queries=False))
+        monkeypatch.setattr(client, "_session", None)
+        monkeypatch.setattr(client, "_rate_limiter", None)
+        monkeypatch.setattr(client, "get_metrics", Metrics)
+        return server
+
+    yield use
+    client.close()
+    for server in servers:
+        server.shutdown()
+
+
+def test_queries_are_retried_on_server_errors_but_mutations_are_not(use_server):
+    server = use_server(error_rate=1.0)
+
+    assert client.run_query(QUERY, {"input": {}}) is None
+    assert server.stats.as_dict()["requests"] == 4
+
+    assert client.run_query(MUTATION, {"input": {"name": "Food"}}) is None
+    assert server.stats.as_dict()["requests"] == 5
+
+
+def test_throttled_requests_are_retried_after_retry_after(use_server):
+    server = use_server(throttle_rate=1.0, retry_after=0.2)
+
+    started = time.monotonic()
+    assert client.run_query(MUTATION, {"input": {"name": "Food"}}) is None
+    assert server.stats.as_dict()["throttled"] == 4
+    assert time.monotonic() - started >= 3 * 0.2
+
+
+def test_mutations_are_retried_after_connect_timeouts_only(use_server, monkeypatch):
+    server = use_server()
+    session = client.get_session()
+    post = session.post
+
+    def failing_post(error):
+        attempts = []
+
+        def fake_post(url, json, timeout):
+            attempts.append(url)
+            if len(attempts) == 1:
+                raise error
+            return post(url, json=json, timeout=timeout)
+        return attempts, fake_post
+
+    attempts, fake_post = failing_post(requests.ConnectTimeout("connect timed out"))
+    monkeypatch.setattr(session, "post", fake_post)
+    assert client.run_query(MUTATION, {"input": {"name": "Food"}})["data"]["foods"]["create"]["food"]["id"]
+    assert len(attempts) == 2
+
+    attempts, fake_post = failing_post(requests.ReadTimeout("read timed out"))
+    monkeypatch.setattr(session, "post", fake_post)
+    assert client.run_query(MUTATION, {"input": {"name": "Food"}}) is None
+    assert len(attempts) == 1
+
+    attempts, fake_post = failing_post(requests.ReadTimeout("read timed out"))
+    monkeypatch.setattr(session, "post", fake_post)
+    assert client.run_query(QUERY, {"input": {}}) is not None
+    assert len(attempts) == 2
+    assert server.stats.as_dict()["requests"] == 2
+
+
+def test_token_bucket_limits_the_request_rate():
+    bucket = TokenBucket(rate=50, capacity=5)
+
+    started = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - started < 0.05
+
+    for _ in range(10):
+        bucket.acquire()
+    # The burst is used up, so the next 10 requests go out at 50 per second
+    assert time.monotonic() - started >= 10 / 50 - 0.01
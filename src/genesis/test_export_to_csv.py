@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Tests for the command line options of export_to_csv.py.
+"""
+
+import configparser
+
+import pytest
+
+import export_to_csv
+from export_to_csv import parse_args
+
+
+def test_modified_dates_must_be_given_together():
+    args = parse_args(["--modified-after", "2024-01-01", "--modified-before", "2024-06-30"])
+    assert (args.modified_after, args.modified_before) == ("2024-01-01", "2024-06-30")
+    with pytest.raises(SystemExit):
+        parse_args(["--stages", "a", "--modified-after", "2024-01-01"])
+    with pytest.raises(SystemExit):
+        parse_args(["--modified-before", "2024-06-30"])
+
+
+def test_modified_dates_are_rejected_in_incremental_mode(monkeypatch):
+    config = configparser.ConfigParser()
+    config.read_dict({"options": {"incremental": "true"}})
+    monkeypatch.setattr(export_to_csv, "get_config", lambda: config)
+
+    assert parse_args(["--stages", "a"]).stages == "a"
+    with pytest.raises(SystemExit):
+        parse_args(["--modified-after", "2024-01-01", "--modified-before", "2024-06-30"])
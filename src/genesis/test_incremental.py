@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Tests for merging changed rows into existing CSVs and for the watermarks of incremental exports.
+"""
+
+import csv
+import types
+
+import pytest
+
+import export_to_csv
+from incremental import CsvMergeSink, load_watermark, merge_csv, save_watermark
+from models import SearchResult
+from pagination import IncompleteSearchError
+
+
+def read_rows(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return [list(row) for row in csv.reader(f)]
+
+
+def test_merge_csv_replaces_rows_in_place_and_appends_new_ids(tmp_path):
+    path = str(tmp_path / "ingredients.csv")
+    merge_csv(path, [{"id": "a", "name": "A"}, {"id": "b", "name": "B"}, {"id": "c", "name": "C"}], "id")
+
+    merge_csv(path, [{"id": "b", "name": "B2"}, {"id": "d", "name": "D"}], "id")
+
+    assert read_rows(path) == [["id", "name"], ["a", "A"], ["b", "B2"], ["c", "C"], ["d", "D"]]
+
+
+def test_replaced_keys_drop_rows_without_new_ones(tmp_path):
+    path = str(tmp_path / "recipe_items.csv")
+    merge_csv(path, [{"recipe_id": "r1", "item_id": "x"}, {"recipe_id": "r1", "item_id": "y"},
+                     {"recipe_id": "r2", "item_id": "z"}, {"recipe_id": "r3", "item_id": "w"}], "recipe_id")
+
+    with CsvMergeSink(path, ["recipe_id", "item_id"], "recipe_id") as sink:
+        for recipe_id in ("r1", "r2"):
+            sink.replace(recipe_id)
+        sink.write({"recipe_id": "r1", "item_id": "v", "extra": "ignored"})
+
+    assert sink.count == 1 and sink.replaced_keys == {"r1", "r2"}
+    assert read_rows(path) == [["recipe_id", "item_id"], ["r1", "v"], ["r3", "w"]]
+
+
+@pytest.fixture
+def incremental_run(tmp_path, monkeypatch):
+    """Run run_incremental_export('a') against fake searches and stages; return the watermark file."""
+    watermark_file = str(tmp_path / "watermark.json")
+    context = types.SimpleNamespace(watermark_file=watermark_file, failed=0,
+                                    checkpoint=types.SimpleNamespace(clear=lambda: None))
+    monkeypatch.setattr(export_to_csv, "get_context", lambda: context)
+
+    def search_changed(food_type, watermarks, modified_before):
+        day = "02" if food_type == "Ingredient" else "03"
+        return iter([SearchResult(f"{food_type}-1", "Food", f"2024-01-{day}T10:00:00Z"),
+                     SearchResult(f"{food_type}-2", "Food", f"2024-01-{day}T12:00:00Z")])
+
+    monkeypatch.setattr(export_to_csv, "search_changed", search_changed)
+    for stage in ("process_ingredients", "process_recipes", "process_recipe_items"):
+        monkeypatch.setattr(export_to_csv, stage, lambda results, merge=False: list(results))
+    return watermark_file
+
+
+def test_watermarks_advance_after_a_successful_run(incremental_run):
+    save_watermark(incremental_run, "ingredients", "2024-01-01T00:00:00Z")
+
+    assert export_to_csv.run_incremental_export("a")
+
+    assert load_watermark(incremental_run, "ingredients") == "2024-01-02T12:00:00Z"
+    assert load_watermark(incremental_run, "recipes") == "2024-01-03T12:00:00Z"
+    assert load_watermark(incremental_run, "recipe_items") == "2024-01-03T12:00:00Z"
+
+
+def test_watermarks_are_kept_when_a_stage_fails(incremental_run, monkeypatch):
+    save_watermark(incremental_run, "ingredients", "2024-01-01T00:00:00Z")
+
+    def fail(results, merge=False):
+        raise RuntimeError("network down")
+
+    monkeypatch.setattr(export_to_csv, "process_recipe_items", fail)
+    with pytest.raises(RuntimeError):
+        export_to_csv.run_incremental_export("a")
+
+    # The ingredient stage finished, but its watermark only moves once every stage has
+    assert load_watermark(incremental_run, "ingredients") == "2024-01-01T00:00:00Z"
+    assert load_watermark(incremental_run, "recipes") is None
+
+
+def test_watermarks_are_kept_when_lookups_failed(incremental_run, monkeypatch):
+    def fail_lookups(results, merge=False):
+        export_to_csv.get_context().failed += 1
+        return list(results)
+
+    monkeypatch.setattr(export_to_csv, "process_recipes", fail_lookups)
+
+    assert not export_to_csv.run_incremental_export("a")
+
+    assert load_watermark(incremental_run, "ingredients") is None
+    assert load_watermark(incremental_run, "recipes") is None
+
+
+def test_watermarks_are_kept_when_a_search_stops_short(incremental_run, monkeypatch):
+    save_watermark(incremental_run, "ingredients", "2024-01-01T00:00:00Z")
+
+    def truncated_search(food_type, watermarks, modified_before):
+        # The page with the newest food arrives first; the next page fails
+        yield SearchResult(f"{food_type}-2", "Food", "2024-01-02T12:00:00Z")
+        raise IncompleteSearchError("Failed to fetch the next search page after 1 results")
+
+    monkeypatch.setattr(export_to_csv, "search_changed", truncated_search)
+    with pytest.raises(IncompleteSearchError):
+        export_to_csv.run_incremental_export("a")
+
+    assert load_watermark(incremental_run, "ingredients") == "2024-01-01T00:00:00Z"
+    assert load_watermark(incremental_run, "recipes") is None
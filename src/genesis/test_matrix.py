@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Tests for writing nutrient values as a .npy matrix with matrix.NutrientMatrixSink.
+"""
+
+import ast
+import math
+import struct
+
+import matrix
+import models
+
+SampleRow = models.Row.schema("SampleRow", ["id", "Fat", "Protein"])
+
+
+def read_npy(path):
+    """Read a float64 .npy file without NumPy, returning its shape and flat values."""
+    with open(path, "rb") as f:
+        data = f.read()
+    assert data[:8] == matrix.NPY_MAGIC
+    header_length = struct.unpack("<H", data[8:10])[0]
+    header = ast.literal_eval(data[10:10 + header_length].decode("latin1"))
+    assert header["descr"] == "<f8"
+    body = data[10 + header_length:]
+    return header["shape"], struct.unpack(f"<{len(body) // 8}d", body)
+
+
+def test_matrix_sink_writes_projected_values(tmp_path):
+    projection = models.NutrientProjection(SampleRow, ["Protein", "Fat"], {"Fat": "fat-id", "Protein": "protein-id"})
+    path = str(tmp_path / "foods.npy")
+
+    with matrix.NutrientMatrixSink(path, projection) as sink:
+        sink.write(SampleRow(["a", 3.5, "2"]))
+        sink.write({"id": "b", "Fat": "", "Protein": 1})
+
+    shape, values = read_npy(path)
+    assert shape == (2, 2)
+    assert values[:3] == (2.0, 3.5, 1.0)
+    assert math.isnan(values[3])
+    assert (tmp_path / "foods_rows.csv").read_text().splitlines() == ["row,id", "0,a", "1,b"]
+    assert (tmp_path / "foods_columns.csv").read_text().splitlines()[1] == "0,protein-id,Protein"
+
+
+def test_matrix_is_rebuilt_after_rows_are_merged_into_the_csv(tmp_path):
+    from incremental import CsvMergeSink, merge_csv
+    from writers import MultiSink
+
+    projection = models.NutrientProjection(SampleRow, ["Protein", "Fat"], {"Fat": "fat-id", "Protein": "protein-id"})
+    csv_path = str(tmp_path / "foods.csv")
+    path = str(tmp_path / "foods.npy")
+    merge_csv(csv_path, [{"id": "a", "Fat": 1, "Protein": 2}, {"id": "b", "Fat": 3, "Protein": 4}], "id")
+    matrix.rebuild_matrix(csv_path, path, projection)
+
+    with MultiSink(CsvMergeSink(csv_path, SampleRow.fields, "id"),
+                   matrix.MatrixRebuildSink(csv_path, path, projection)) as sink:
+        sink.write(SampleRow(["b", 5, 6]))
+        sink.write(SampleRow(["c", 7, ""]))
+
+    shape, values = read_npy(path)
+    assert shape == (3, 2)
+    assert values[:4] == (2.0, 1.0, 6.0, 5.0)
+    assert math.isnan(values[4]) and values[5] == 7.0
+    assert (tmp_path / "foods_rows.csv").read_text().splitlines() == ["row,id", "0,a", "1,b", "2,c"]
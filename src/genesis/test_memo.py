@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-run memo of food details in memo.py.
+"""
+
+import os
+
+from memo import MemoCache
+
+
+def test_entries_beyond_max_items_spill_to_disk_and_read_back():
+    memo = MemoCache(max_items=3)
+    memo.put_many([(f"k{i}", {"food": {"id": i}}, str(i)) for i in range(5)])
+
+    assert memo.spilled == 2
+    assert list(memo._items) == ["k2", "k3", "k4"]
+    assert os.path.exists(memo._spill_path)
+    assert memo.get_many([f"k{i}" for i in range(6)]) == {f"k{i}": {"food": {"id": i}} for i in range(5)}
+    memo.close()
+
+
+def test_close_deletes_the_spill_file():
+    memo = MemoCache(max_items=1)
+    memo.put_many([("a", 1, None), ("b", 2, None)])
+    spill_path = memo._spill_path
+
+    memo.close()
+
+    assert not os.path.exists(spill_path)
+    assert memo.get_many(["a", "b"]) == {}
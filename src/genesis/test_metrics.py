@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Tests for the request metrics in metrics.py.
+"""
+
+from metrics import Histogram, Metrics, operation_name
+
+
+def test_operation_name_uses_field_paths_not_aliases():
+    search = "query ($input: FoodSearchInput!) { foods { search(input: $input) { foodSearchResults { id } } } }"
+    label = "mutation ($input: X!) { label { unitedStates2016 { create(input: $input) { label { id } } } } }"
+    batched = """query ($p0_i0: A!, $p1_i0: B!) {
+        analysis { p0_f0: getAnalysis(input: $p0_i0) { analysis { nutrientInfos { value } } } }
+        foods { p1_f0: get(input: $p1_i0) { food { id ... on Recipe { items { food { id } } } } } }
+    }"""
+
+    assert operation_name(search) == "foods.search"
+    assert operation_name(label) == "label.unitedStates2016.create"
+    assert operation_name(batched) == "analysis.getAnalysis+foods.get"
+
+
+def test_histogram_quantiles_are_within_bucket_precision():
+    histogram = Histogram()
+    for ms in range(1, 1001):
+        histogram.record(ms / 1000)
+
+    assert abs(histogram.quantile(0.5) - 0.5) < 0.5 * 0.02
+    assert abs(histogram.quantile(0.99) - 0.99) < 0.99 * 0.02
+    assert histogram.quantile(1.0) <= 1.0
+
+
+def test_prometheus_textfile_and_summary():
+    metrics = Metrics()
+    search = "query ($input: FoodSearchInput!) { foods { search(input: $input) { totalCount } } }"
+    metrics.observe(search, 200, 0.25, 100, 2000)
+    metrics.observe(search, 429, 0.05, 100, 20)
+
+    text = metrics.prometheus()
+    assert 'genesis_requests_total{operation="foods.search",status="200"} 1' in text
+    assert 'genesis_requests_total{operation="foods.search",status="429"} 1' in text
+    assert 'genesis_response_bytes_received_total{operation="foods.search"} 2020' in text
+    assert 'genesis_request_duration_seconds_count{operation="foods.search"} 2' in text
+
+    summary = metrics.summary()["foods.search"]
+    assert summary["requests"] == 2
+    assert summary["time_share"] == 1.0
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Tests for the local mock Genesis API in mock_server.py.
+"""
+
+import requests
+
+from mock_server import Catalog, execute, start_server
+
+
+def test_execute_resolves_aliases_and_fragments():
+    catalog = Catalog(size=10)
+    document = """
+        query ($a: GetFoodInput!) {
+            first: foods { get(input: $a) { food { id ... on Recipe { items { food { id } } } } } }
+            second: foods { get(input: {id: "missing"}) { food { id } } }
+        }
+    """
+    response, fields = execute(document, {"a": {"id": catalog.food_id(0)}}, catalog.resolvers())
+
+    food = response["data"]["first"]["get"]["food"]
+    assert food["id"] == catalog.food_id(0)
+    assert len(food["items"]) >= 3
+    assert response["data"]["second"]["get"] is None
+    assert response["errors"][0]["path"] == ["second", "get"]
+    assert fields == ["foods.get", "foods.get"]
+
+
+def test_search_pages_by_cursor():
+    catalog = Catalog(size=100, recipe_ratio=0.25)
+    ids = []
+    after = 0
+    while True:
+        page = catalog.search({"foodTypes": ["Ingredient"], "first": 30, "after": after})
+        ids.extend(result["id"] for result in page["foodSearchResults"])
+        if not page["pageInfo"]["hasNextPage"]:
+            break
+        after = page["pageInfo"]["endCursor"]
+
+    assert page["totalCount"] == 75
+    assert len(set(ids)) == 75
+
+
+def test_server_round_trip_and_throttling():
+    server = start_server(Catalog(size=10))
+    throttled = start_server(Catalog(size=10), throttle_rate=1.0, retry_after=2)
+    try:
+        query = "query ($input: FoodSearchInput!) { foods { search(input: $input) { totalCount } } }"
+        response = requests.post(server.endpoint, json={"query": query, "variables": {"input": {}}})
+        assert response.json() == {"data": {"foods": {"search": {"totalCount": 10}}}}
+
+        response = requests.post(throttled.endpoint, json={"query": query, "variables": {"input": {}}})
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "2"
+        assert server.stats.as_dict()["fields"] == {"foods.search": 1}
+    finally:
+        server.shutdown()
+        throttled.shutdown()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Tests for the record types and the nutrient projection in models.py.
+"""
+
+import models
+
+SampleRow = models.Row.schema("SampleRow", ["id", "Fat", "Protein"])
+NUTRIENT_IDS = {"Fat": "fat-id", "Protein": "protein-id"}
+
+
+def nutrient_infos():
+    return [
+        {"nutrient": {"id": "fat-id", "name": "Fat"}, "value": 3.5},
+        {"nutrient": {"id": "water-id", "name": "Water"}, "value": 80},
+        {"nutrient": {"id": "protein-id", "name": "Renamed Protein"}, "value": 0}
+    ]
+
+
+def test_row_keeps_values_in_column_order():
+    row = SampleRow()
+    row["Protein"] = 2
+    row["id"] = "a"
+
+    assert row.values == ["a", "", 2]
+    assert row.as_dict() == {"id": "a", "Fat": "", "Protein": 2}
+
+
+def test_projection_matches_nutrients_by_id():
+    projection = models.NutrientProjection(SampleRow, ["Fat", "Protein"], NUTRIENT_IDS)
+    nutrients = models.NutrientInfo.decode_all(nutrient_infos(), projection.wanted)
+    row = SampleRow()
+    projection.apply(row, nutrients)
+
+    # Water is not projected and is never decoded; Protein matches by id despite its name
+    assert [n.name for n in nutrients] == ["Fat", "Renamed Protein"]
+    assert row.values == ["", 3.5, 0]
+
+
+def test_food_details_decoder_handles_nulls():
+    details = models.FoodDetails.from_json({"amountCost": None, "notes": None, "cookTime": 0})
+
+    assert details.cost == ""
+    assert details.amount == ""
+    assert details.notes == ""
+    assert details.cook_time == 0
+    assert details.items == []
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Tests for walking foods.search pages with pagination.paginate_search.
+"""
+
+import pytest
+
+import pagination
+
+
+def make_pages(total, page_size):
+    """Build fake foods.search responses for `total` foods keyed by their after cursor."""
+    pages = {}
+    for start in range(0, total, page_size):
+        end = min(start + page_size, total)
+        pages[start] = {
+            "data": {
+                "foods": {
+                    "search": {
+                        "foodSearchResults": [{"id": str(i), "name": f"Food {i}"} for i in range(start, end)],
+                        "totalCount": total,
+                        "pageInfo": {"hasNextPage": end < total, "endCursor": end}
+                    }
+                }
+            }
+        }
+    return pages
+
+
+def test_paginate_search_follows_end_cursor(monkeypatch):
+    pages = make_pages(25, 10)
+    requested = []
+
+    def fake_run_query(graphql_query, variables):
+        requested.append((variables["input"]["first"], variables["input"]["after"]))
+        return pages[variables["input"]["after"]]
+
+    monkeypatch.setattr(pagination, "run_query", fake_run_query)
+
+    results = pagination.paginate_search("query", {"input": {"searchText": ''}}, page_size=10)
+
+    assert results.total_count == 25
+    assert [food["id"] for food in results] == [str(i) for i in range(25)]
+    assert requested == [(10, 0), (10, 10), (10, 20)]
+
+
+def test_paginate_search_stops_at_limit(monkeypatch):
+    pages = make_pages(25, 10)
+    monkeypatch.setattr(pagination, "run_query", lambda q, v: pages[v["input"]["after"]])
+
+    results = pagination.paginate_search("query", {"input": {}}, page_size=10, limit=12)
+
+    assert len(list(results)) == 12
+
+
+def test_paginate_search_returns_none_when_first_page_fails(monkeypatch):
+    monkeypatch.setattr(pagination, "run_query", lambda q, v: None)
+
+    assert pagination.paginate_search("query", {"input": {}}) is None
+
+
+def test_paginate_search_raises_when_a_later_page_fails(monkeypatch):
+    pages = make_pages(25, 10)
+    monkeypatch.setattr(pagination, "run_query", lambda q, v: pages[0] if v["input"]["after"] == 0 else None)
+
+    results = pagination.paginate_search("query", {"input": {}}, page_size=10)
+    foods = []
+    with pytest.raises(pagination.IncompleteSearchError):
+        for food in results:
+            foods.append(food)
+
+    assert len(foods) == 10
+
+
+def test_windowed_search_splits_by_modified_date(monkeypatch):
+    from mock_server import Catalog
+
+    catalog = Catalog(size=300)
+    searched = []
+
+    def fake_run_query(graphql_query, variables):
+        search = catalog.search(variables["input"])
+        if variables["input"]["first"] > 1:
+            searched.append(len(search["foodSearchResults"]))
+        return {"data": {"foods": {"search": search}}}
+
+    monkeypatch.setattr(pagination, "run_query", fake_run_query)
+
+    search_input = {"foodTypes": ["Ingredient", "Recipe"], "modifiedAfter": "2019-12-31T00:00:00Z"}
+    results = pagination.windowed_search("query", {"input": search_input}, page_size=50, target=40, workers=4)
+
+    foods = list(results)
+    assert results.total_count == 300
+    assert sorted(food["id"] for food in foods) == sorted(catalog.food_id(i) for i in range(300))
+    assert [food["modified"] for food in foods] == sorted(food["modified"] for food in foods)
+    assert len(searched) > 300 // 40 and max(searched) <= 40
+
+
+def test_windowed_search_raises_when_a_window_fails(monkeypatch):
+    from mock_server import Catalog
+
+    catalog = Catalog(size=300)
+    windows = []
+
+    def fake_run_query(graphql_query, variables):
+        search_input = variables["input"]
+        if search_input["first"] > 1:
+            windows.append(search_input["modifiedAfter"])
+            # The third window searched fails after every retry
+            if len(windows) == 3:
+                return None
+        return {"data": {"foods": {"search": catalog.search(search_input)}}}
+
+    monkeypatch.setattr(pagination, "run_query", fake_run_query)
+
+    search_input = {"foodTypes": ["Ingredient", "Recipe"], "modifiedAfter": "2019-12-31T00:00:00Z"}
+    results = pagination.windowed_search("query", {"input": search_input}, page_size=50, target=40, workers=1)
+
+    foods = []
+    with pytest.raises(pagination.IncompleteSearchError):
+        for food in results:
+            foods.append(food)
+    assert 0 < len(foods) < 300
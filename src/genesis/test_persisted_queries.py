@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Tests for automatic persisted queries in persisted_queries.py, client.py and mock_server.py.
+"""
+
+import json
+
+import client
+import export_to_csv
+from metrics import Metrics
+from mock_server import Catalog, start_server
+from persisted_queries import load_manifest, manifest, query_hash, registry
+from settings import get_config
+
+
+def test_registry_round_trips_through_a_manifest(tmp_path):
+    documents = registry()
+    assert documents[query_hash(export_to_csv.analysis_query)] == export_to_csv.analysis_query
+    assert len(documents) > 10
+
+    # The batched requests export_to_csv sends are registered, for full and shorter batches
+    context = export_to_csv.ExportContext(get_config())
+    batch_size = context.batch_size
+    for count in (batch_size, 1):
+        for document in (context.ingredient_data_query.document((count, count)),
+                         context.recipe_data_query.document((count, count)),
+                         context.batched_analysis_query.document(count),
+                         context.recipe_food_query.document(count)):
+            assert documents[query_hash(document)] == document
+    context.select_stages("ri")
+    assert query_hash(context.recipe_food_query.document(batch_size)) in documents
+
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps(manifest(documents)))
+    assert load_manifest(str(path)) == documents
+
+
+def test_run_query_sends_the_document_only_on_a_miss(monkeypatch):
+    server = start_server(Catalog(size=10))
+    try:
+        monkeypatch.setattr(client, "_settings", dict(client._load_settings(), endpoint=server.endpoint, max_retries=0,
+                                                      persisted_queries=True, rate_limit=0, rate_burst=0))
+        monkeypatch.setattr(client, "_session", None)
+        monkeypatch.setattr(client, "_rate_limiter", None)
+        monkeypatch.setattr(client, "get_metrics", Metrics)
+
+        sent = []
+        session = client.get_session()
+        post = session.post
+
+        def recording_post(url, json, timeout):
+            sent.append(json)
+            return post(url, json=json, timeout=timeout)
+
+        monkeypatch.setattr(session, "post", recording_post)
+
+        query = "query ($input: FoodSearchInput!) { foods { search(input: $input) { totalCount } } }"
+        for _ in range(2):
+            result = client.run_query(query, {"input": {}})
+            assert result == {"data": {"foods": {"search": {"totalCount": 10}}}}
+
+        assert ["query" in body for body in sent] == [False, True, False]
+        assert all(body["extensions"]["persistedQuery"]["sha256Hash"] == query_hash(query) for body in sent)
+        stats = server.stats.as_dict()
+        assert (stats["persisted_hits"], stats["persisted_misses"]) == (1, 1)
+    finally:
+        client.close()
+        server.shutdown()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""
+Tests for the tracing spans in profiling.py.
+"""
+
+import configparser
+import json
+
+import profiling
+
+
+def test_spans_are_written_as_chrome_trace_events(tmp_path, monkeypatch):
+    tracer = profiling.Tracer(str(tmp_path / "trace.json"))
+    monkeypatch.setattr(profiling, "_tracer", tracer)
+
+    @profiling.traced("outer")
+    def outer():
+        with profiling.span("inner", count=3):
+            pass
+
+    outer()
+    tracer.write()
+
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    spans = {e["name"]: e for e in events if e["ph"] == "X"}
+    assert set(spans) == {"outer", "inner"}
+    assert spans["inner"]["args"] == {"count": 3}
+    assert spans["outer"]["ts"] <= spans["inner"]["ts"]
+    assert spans["inner"]["ts"] + spans["inner"]["dur"] <= spans["outer"]["ts"] + spans["outer"]["dur"]
+
+
+def test_profile_modes_from_environment(monkeypatch):
+    config = configparser.ConfigParser()
+    config.read_string("[profiling]\nenabled = false\nmodes = trace\n")
+
+    monkeypatch.delenv("GENESIS_PROFILE", raising=False)
+    assert profiling.profile_modes(config) == ()
+    monkeypatch.setenv("GENESIS_PROFILE", "1")
+    assert profiling.profile_modes(config) == ("trace",)
+    monkeypatch.setenv("GENESIS_PROFILE", "sample,cprofile")
+    assert profiling.profile_modes(config) == ("sample", "cprofile")
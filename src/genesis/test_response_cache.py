@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tests for the on-disk cache of query results in response_cache.py.
+"""
+
+import pytest
+
+import response_cache
+from response_cache import ResponseCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A fake time.time() for the cache, starting at 2024-01-01T00:00:00Z."""
+    now = [1704067200.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl=60)
+    cache.put_many([("a", {"value": 1}, "food-a")])
+
+    clock[0] += 59
+    assert cache.get_many(["a"]) == {"a": {"value": 1}}
+    clock[0] += 2
+    assert cache.get_many(["a"]) == {}
+    cache.close()
+
+
+def test_invalidate_food_drops_entries_stored_before_it_was_modified(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    cache.put_many([("a1", 1, "food-a"), ("a2", 2, "food-a"), ("b", 3, "food-b")])
+
+    # Modified before the entries were stored: they are still current
+    cache.invalidate_food("food-a", "2023-12-31T23:59:00Z")
+    assert cache.get_many(["a1", "a2", "b"]) == {"a1": 1, "a2": 2, "b": 3}
+
+    cache.invalidate_food("food-a", "2024-01-01T00:01:00.1234567Z")
+    assert cache.get_many(["a1", "a2", "b"]) == {"b": 3}
+    assert cache.total_bytes == 1
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted_to_the_low_water_mark(tmp_path, clock):
+    value = "x" * 98  # 100 bytes once encoded as JSON
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=1000)
+    for i in range(10):
+        clock[0] += 1
+        cache.put_many([(f"k{i}", value, None)])
+    assert cache.total_bytes == 1000
+
+    # Reading k0 makes it the most recently used, so k1 and k2 are evicted instead
+    clock[0] += 1
+    cache.get_many(["k0"])
+    clock[0] += 1
+    cache.put_many([("k10", value, None)])
+
+    remaining = cache.get_many([f"k{i}" for i in range(11)])
+    assert sorted(remaining) == sorted(["k0"] + [f"k{i}" for i in range(3, 11)])
+    assert cache.total_bytes == 900
+    cache.close()
@@ -0,0 +1,30 @@
+from batching import field_selection
+from mock_server import Catalog, execute
+from models import FoodDetails
+from selection import food_document, food_selection
+
+
+def test_food_selection_only_has_the_fields_of_the_columns():
+    ingredient = food_selection(["id", "name", "usercode", "subIngredients", "cookMethod"], "Ingredient")
+    assert ingredient == {
+        "... on Ingredient": {"id": {}, "subIngredients": {"name": {}}},
+        "customFields": {"value": {}, "customField": {"name": {}}}
+    }
+
+    items = food_selection(["recipe_id", "item_id", "item_amount_quantity"], "Recipe")
+    assert items == {"... on Recipe": {"id": {}, "items": {"food": {"id": {}}, "amount": {"quantity": {"value": {}}}}}}
+
+
+def test_food_document_decodes_like_the_full_query():
+    catalog = Catalog(size=20)
+    recipe_id = catalog.food_id(min(catalog.recipe_set))
+    columns = ["instructions", "notes", "item_name", "item_amount_measure"]
+    document = food_document(columns, "Recipe")
+    assert field_selection(document, "get").startswith("{")
+    assert "conversions" not in document and "cookMethod" not in document
+
+    response, _ = execute(document, {"input": {"id": recipe_id}}, catalog.resolvers())
+    details = FoodDetails.from_json(response["data"]["foods"]["get"]["food"])
+    assert details.instructions and details.items
+    assert details.items[0].name and details.items[0].measure
+    assert details.cook_method == ""
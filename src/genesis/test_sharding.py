@@ -0,0 +1,38 @@
+import csv
+
+import pytest
+
+from sharding import Shard, merge_csv, parse_shard, shard_path
+
+
+def test_shards_partition_the_foods():
+    ids = [f"{i:08x}-0000-4000-8000-000000000001" for i in range(1000)]
+    shards = [Shard(index, 4) for index in range(1, 5)]
+    owners = [sum(shard.owns(food_id) for shard in shards) for food_id in ids]
+    assert owners == [1] * len(ids)
+    assert all(len(list(shard.filter(ids, key=str))) > 150 for shard in shards)
+
+    ranges = [shard.row_range(10) for shard in shards]
+    assert ranges == [(0, 2), (2, 5), (5, 7), (7, 10)]
+
+
+def test_shard_paths_and_arguments():
+    assert shard_path("out/ingredients.csv", 2, 4) == "out/ingredients.shard-2-of-4.csv"
+    assert shard_path("output.json.gz", 1, 2) == "output.shard-1-of-2.json.gz"
+    assert repr(parse_shard("3/8")) == "3/8"
+    with pytest.raises(Exception):
+        parse_shard("5/4")
+
+
+def test_merge_csv_keeps_shard_order(tmp_path):
+    path = str(tmp_path / "recipes.csv")
+    for index, rows in ((1, [["a", "1"]]), (2, []), (3, [["b", "2"], ["c", "3"]])):
+        with open(shard_path(path, index, 3), "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows([["Name", "Value"]] + rows)
+
+    merge_csv(path, 3)
+    with open(path, newline="", encoding="utf-8") as f:
+        assert list(csv.reader(f)) == [["Name", "Value"], ["a", "1"], ["b", "2"], ["c", "3"]]
+
+    with pytest.raises(FileNotFoundError):
+        merge_csv(path, 4)
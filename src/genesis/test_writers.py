@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Tests for the streaming CSV and NDJSON archive writers in writers.py.
+"""
+
+import csv
+import gzip
+
+import pytest
+
+from models import Row
+from writers import ArchiveWriter, CsvRowSink, read_archive
+
+FIELDS = ["id", "name", "Calories", "Protein", "Sodium"]
+
+
+def test_missing_nutrients_are_blank_without_shifting_columns(tmp_path):
+    path = str(tmp_path / "ingredients.csv")
+    with CsvRowSink(path, FIELDS) as sink:
+        sink.write({"id": "a", "name": "A", "Calories": 100, "Sodium": 5})
+        sink.write({"id": "b", "name": "B", "Protein": 0})
+
+    with open(path, newline='', encoding='utf-8') as f:
+        assert list(csv.reader(f)) == [FIELDS, ["a", "A", "100", "", "5"], ["b", "B", "", "0", ""]]
+    assert sink.count == 2
+
+
+def test_keys_outside_the_schema_are_ignored_and_other_rows_rejected(tmp_path):
+    path = str(tmp_path / "ingredients.csv")
+    OtherRow = Row.schema("OtherRow", ["id", "name"])
+    with CsvRowSink(path, FIELDS) as sink:
+        sink.write({"id": "a", "name": "A", "Iron": 3})
+        with pytest.raises(ValueError):
+            sink.write(OtherRow(["b", "B"]))
+
+    with open(path, newline='', encoding='utf-8') as f:
+        assert list(csv.reader(f)) == [FIELDS, ["a", "A", "", "", ""]]
+
+
+def test_gzip_archive_stages_read_back_as_one_stream(tmp_path):
+    path = str(tmp_path / "graphql_responses.ndjson.gz")
+    with ArchiveWriter(path, compress=True) as archive:
+        archive.write({"id": "a", "name": "Crème"})
+    with ArchiveWriter(path, compress=True) as archive:
+        archive.write(Row.schema("IdRow", ["id"])(["b"]))
+
+    with open(path, "rb") as f:
+        assert f.read(2) == b"\x1f\x8b"
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert f.read() == '{"id":"a","name":"Crème"}\n{"id":"b"}\n'
+    assert list(read_archive(path)) == [{"id": "a", "name": "Crème"}, {"id": "b"}]
@@ -0,0 +1,146 @@
+import csv
+import gzip
+import json
+import threading
+
+from models import as_dict
+from profiling import span
+
+
+class ArchiveWriter:
+    """
+    Writes records to an NDJSON archive: one compact JSON object per line.
+
+    Records are written as they are produced, so memory stays flat however many foods
+    are exported, and the archive can be read back line by line (see read_archive).
+    The file is opened in append mode so several export stages can add to the same
+    archive. With compress=True the archive is gzip compressed; each stage adds a gzip
+    member, and concatenated members still read back as one stream.
+    """
+
+    def __init__(self, path, compress=False):
+        self.path = path
+        self.compress = compress
+        self.count = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        if self.compress:
+            self._file = gzip.open(self.path, "at", encoding="utf-8")
+        else:
+            self._file = open(self.path, "a", encoding="utf-8")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        self._file = None
+
+    def write(self, record):
+        """Append one record (a dict, or a record from models.py) to the archive."""
+        with span("archive write"):
+            line = json.dumps(as_dict(record), separators=(',', ':'), ensure_ascii=False)
+            with self._lock:
+                self._file.write(line)
+                self._file.write("\n")
+                self.count += 1
+
+    def write_all(self, records):
+        """Append each record and return them unchanged, so writing can sit inside a pipeline."""
+        for record in records:
+            self.write(record)
+            yield record
+
+
+def read_archive(path):
+    """Yield the records of an NDJSON archive, gzip compressed or not."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class CsvRowSink:
+    """
+    Writes CSV rows as soon as they are produced.
+
+    The header is fixed up front from a known schema, so nothing has to be buffered to
+    discover the columns and memory stays flat however many rows are written. Rows can be
+    dicts, where columns a row does not have are left empty and keys outside the schema
+    are ignored, or models.Row instances with the same fields, which are written as is.
+    """
+
+    def __init__(self, csv_file, fieldnames):
+        self.csv_file = csv_file
+        self.fieldnames = list(fieldnames)
+        self.count = 0
+        self._file = None
+        self._writer = None
+        self._row_writer = None
+        self._row_type = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._file = open(self.csv_file, mode='w', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames, restval='', extrasaction='ignore')
+        self._writer.writeheader()
+        self._row_writer = csv.writer(self._file)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._file.close()
+        self._file = None
+        self._writer = None
+        self._row_writer = None
+
+    def write(self, row):
+        """Write one row."""
+        if not isinstance(row, dict) and type(row) is not self._row_type:
+            if list(row.fields) != self.fieldnames:
+                raise ValueError(f"{type(row).__name__} columns do not match {self.csv_file}")
+            self._row_type = type(row)
+
+        with span("csv write"), self._lock:
+            if isinstance(row, dict):
+                self._writer.writerow(row)
+            else:
+                self._row_writer.writerow(row.values)
+            self.count += 1
+
+    def write_all(self, rows):
+        """Write each row and return them unchanged, so writing can sit inside a pipeline."""
+        for row in rows:
+            self.write(row)
+            yield row
+
+
+class MultiSink:
+    """Writes every row to several row sinks, e.g. a CSV and a matrix of the same rows."""
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    @property
+    def count(self):
+        return self.sinks[0].count
+
+    def __enter__(self):
+        for sink in self.sinks:
+            sink.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for sink in self.sinks:
+            sink.__exit__(exc_type, exc_value, traceback)
+
+    def write(self, row):
+        """Write one row to every sink."""
+        for sink in self.sinks:
+            sink.write(row)
+
+    def write_all(self, rows):
+        """Write each row to every sink and return them unchanged."""
+        for row in rows:
+            self.write(row)
+            yield row